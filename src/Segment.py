@@ -4,24 +4,185 @@
 # Encapsulates sequence/ack numbers, window size, flags, and payload.
 #
 
+import struct
 import zlib
 
+try:
+    # CRC32C (Castagnoli) in hardware where the CPU has it, an optional dependency
+    import crc32c
+except ImportError:
+    crc32c = None
+
+
+class SegmentView:
+    """
+    a parsed segment, returned by Segment.parse_seg()
+
+    the fields are read as attributes or by key like the dict parse_seg()
+    used to return (seg["ack"], seg["SYN"]); the payload is a memoryview
+    into the parsed bytes, so a caller that keeps it past the life of a
+    reused receive buffer must copy it
+    """
+    __slots__ = ("seq", "ack", "window", "checksum", "flags", "payload", "valid", "version")
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+    @property
+    def ACK(self):
+        return bool(self.flags & (1 << 4))
+
+    @property
+    def SYN(self):
+        return bool(self.flags & (1 << 3))
+
+    @property
+    def FIN(self):
+        return bool(self.flags & (1 << 2))
+
+    @property
+    def DATA(self):
+        return bool(self.flags & (1 << 1))
+
+    @property
+    def PARITY(self):
+        return bool(self.flags & Segment.PARITY_FLAG)
+
+    def __repr__(self):
+        flags = "|".join(name for name in ("ACK", "SYN", "FIN", "DATA", "PARITY") if self[name])
+        return (f"SegmentView(seq={self.seq}, ack={self.ack}, window={self.window}, flags={flags}, "
+                f"payload={len(self.payload)} bytes, valid={self.valid}, version={self.version})")
+
 
 class Segment:
     HEADER_SIZE = 8
+    HEADER_V1 = struct.Struct("!BBBBI")
+
+    # version 2 header: version, 16-bit window, flags, checksum, 32-bit seq and ack
+    # the flags byte sits at offset 3 in both versions so a segment describes its own format
+    HEADER_V2 = struct.Struct("!BHBIII")
+    HEADER_SIZE_V2 = HEADER_V2.size
+    V2_FLAG = 1 << 5
+    # FEC parity segments (see fec.py): seq is the first DATA segment of the group,
+    # ack the index of the parity segment and window the number of DATA segments
+    PARITY_FLAG = 1 << 0
+    # the checksum field, at offset 4 in both versions, is zero while the checksum is computed
+    CHECKSUM = struct.Struct("!I")
+    ZERO_CHECKSUM = bytes(CHECKSUM.size)
+
+    # checksum algorithms a connection may negotiate: (function(data, value), initial value);
+    # "none" leaves the field zero and trusts the link (e.g. UDP's own checksum on loopback)
+    CHECKSUMS = {"crc32": (zlib.crc32, 0), "adler32": (zlib.adler32, 1), "none": (None, 0)}
+    if crc32c is not None:
+        CHECKSUMS["crc32c"] = (crc32c.crc32c, 0)
+    # SYN and SYN-ACK negotiate the algorithm, they are always checked with CRC32
+    SYN_FLAG = 1 << 3
+    EMPTY = memoryview(b"")
+
+    SEQ_MODULO = {1: 1 << 8, 2: 1 << 32}
+    # seq_diff() orders numbers less than half the sequence space apart, so a
+    # v1 window stays below 128 although its field could hold 255
+    WINDOW_MAX = {1: (1 << 7) - 1, 2: (1 << 16) - 1}
+
+    # SACK blocks carried in the payload of an ACK: (start, end) pairs, end exclusive
+    SACK_BLOCK = struct.Struct("!II")
+    MAX_SACK_BLOCKS = 4
 
     @staticmethod
-    def compute_checksum(packet: bytes) -> int:
+    def encode_options(options):
         """
-        compute the checksum
+        encode handshake options as the "key=value" text carried in SYN and SYN-ACK payloads
 
         arguments:
-        packet -- the segment converted to bytes
+        options -- dict of option names to values
         """
-        return zlib.crc32(packet) & 0xffffffff
+        return " ".join(f"{key}={value}" for key, value in options.items()).encode()
 
     @staticmethod
-    def create_seg(seq, ack, window, a_flag=False, s_flag=False, f_flag=False, d_flag=False, payload=b''):
+    def decode_options(payload):
+        """
+        decode the "key=value" handshake options of a SYN or SYN-ACK payload
+        tokens without "=" (e.g. the segment size leading a SYN payload) are skipped
+
+        arguments:
+        payload -- the payload bytes
+
+        returns:
+        dict -- option names to values (strings)
+        """
+        options = {}
+        for token in bytes(payload).decode(errors="replace").split():
+            key, sep, value = token.partition("=")
+            if sep:
+                options[key] = value
+        return options
+
+    @staticmethod
+    def announced_size(payload):
+        """
+        return the segment size leading a SYN payload, None if it has none
+
+        arguments:
+        payload -- the payload bytes
+        """
+        tokens = bytes(payload).decode(errors="replace").split()
+        if not tokens or not tokens[0].isdigit():
+            return None
+        return int(tokens[0])
+
+    @staticmethod
+    def encode_sack(blocks, version):
+        """
+        encode SACK blocks for the payload of an ACK
+
+        arguments:
+        blocks -- list of (start, end) sequence numbers, end exclusive
+        version -- the header version, which decides the size of the sequence space
+        """
+        modulo = Segment.SEQ_MODULO[version]
+        return b"".join(Segment.SACK_BLOCK.pack(start % modulo, end % modulo)
+                        for start, end in blocks[:Segment.MAX_SACK_BLOCKS])
+
+    @staticmethod
+    def decode_sack(payload):
+        """
+        decode the SACK blocks of an ACK payload
+
+        returns:
+        list -- (start, end) wire sequence numbers, end exclusive
+        """
+        usable = len(payload) - len(payload) % Segment.SACK_BLOCK.size
+        return [block for block in Segment.SACK_BLOCK.iter_unpack(payload[:usable])]
+
+    @staticmethod
+    def header_size(version):
+        """
+        size of the header of the given format version
+
+        arguments:
+        version -- the header version (1 or 2)
+        """
+        return Segment.HEADER_SIZE_V2 if version == 2 else Segment.HEADER_SIZE
+
+    @staticmethod
+    def seq_diff(a, b, version):
+        """
+        signed distance from sequence number b to a in the wrapping sequence space
+        a positive result means a is after b
+
+        arguments:
+        a, b -- sequence numbers (absolute or as carried on the wire)
+        version -- the header version, which decides the size of the sequence space
+        """
+        modulo = Segment.SEQ_MODULO[version]
+        diff = (a - b) % modulo
+        if diff >= modulo // 2:
+            diff -= modulo
+        return diff
+
+    @staticmethod
+    def create_seg(seq, ack, window, a_flag=False, s_flag=False, f_flag=False, d_flag=False, payload=b'', version=1,
+                   p_flag=False, checksum="crc32"):
         """"
         create a segment with a header and payload.
 
@@ -34,43 +195,86 @@ class Segment:
         f_flag --  boolean flag for FIN
         d_flag --  boolean flag for DATA
         payload -- the payload
+        version -- the header version, 1 (8-bit seq/ack/window) or 2 (32-bit seq/ack, 16-bit window)
+        p_flag -- boolean flag for PARITY
+        checksum -- the checksum algorithm of the connection, a key of Segment.CHECKSUMS
+                    (SYN segments always use CRC32)
 
         returns:
         bytes -- segment as a bytes object.
         """
-        seq = seq % 256
-        ack = ack % 256
-        window = window % 256
+        modulo = Segment.SEQ_MODULO[version]
+        seq = seq % modulo
+        ack = ack % modulo
+        window = min(window, Segment.WINDOW_MAX[version])
+        flags_byte = (a_flag << 4) | (s_flag << 3) | (f_flag << 2) | (d_flag << 1) | p_flag
+        if version == 2:
+            flags_byte |= Segment.V2_FLAG
+
+        function, value = Segment.CHECKSUMS["crc32" if s_flag else checksum]
+
+        # the checksum covers the header with a zero checksum field, then the payload
+        if version == 2:
+            if function is not None:
+                temp_header = Segment.HEADER_V2.pack(2, window, flags_byte, 0, seq, ack)
+                value = function(payload, function(temp_header, value)) & 0xffffffff
+            return Segment.HEADER_V2.pack(2, window, flags_byte, value, seq, ack) + payload
+
+        if function is not None:
+            temp_header = Segment.HEADER_V1.pack(seq, ack, window, flags_byte, 0)
+            value = function(payload, function(temp_header, value)) & 0xffffffff
+        return Segment.HEADER_V1.pack(seq, ack, window, flags_byte, value) + payload
+
+    @staticmethod
+    def encode_into(buffer, seq, ack, window, a_flag=False, s_flag=False, f_flag=False, d_flag=False, payload=b'',
+                    version=1, p_flag=False, checksum="crc32"):
+        """
+        encode a segment into a preallocated buffer, which a sender reuses for
+        every segment instead of allocating a new bytes object each time
 
-        flags_byte = 0
-        if a_flag:
-            flags_byte |= (1 << 4)
-        if s_flag:
-            flags_byte |= (1 << 3)
-        if f_flag:
-            flags_byte |= (1 << 2)
-        if d_flag:
-            flags_byte |= (1 << 1)
+        arguments:
+        buffer -- a writable buffer of at least the header size plus len(payload) bytes,
+                  preferably a memoryview of a bytearray created once (slicing it does not copy)
+        the other arguments are those of create_seg()
 
-        temp_header = bytes([seq, ack, window, flags_byte]) + b"\x00\x00\x00\x00"
-        temp_segment = temp_header + payload
-        checksum = Segment.compute_checksum(temp_segment)
-        checksum_bytes = checksum.to_bytes(4, byteorder='big')
+        returns:
+        int -- the length of the segment, written at the start of buffer
+        """
+        modulo = Segment.SEQ_MODULO[version]
+        seq = seq % modulo
+        ack = ack % modulo
+        window = min(window, Segment.WINDOW_MAX[version])
+        flags_byte = (a_flag << 4) | (s_flag << 3) | (f_flag << 2) | (d_flag << 1) | p_flag
+        if version == 2:
+            flags_byte |= Segment.V2_FLAG
 
-        header = temp_header[:4] + checksum_bytes
-        return header + payload
+        if version == 2:
+            Segment.HEADER_V2.pack_into(buffer, 0, 2, window, flags_byte, 0, seq, ack)
+            header_size = Segment.HEADER_SIZE_V2
+        else:
+            Segment.HEADER_V1.pack_into(buffer, 0, seq, ack, window, flags_byte, 0)
+            header_size = Segment.HEADER_SIZE
+        length = header_size + len(payload)
+        buffer[header_size:length] = payload
+        # the checksum field was packed as zero, one pass covers header and payload
+        function, value = Segment.CHECKSUMS["crc32" if s_flag else checksum]
+        if function is not None:
+            Segment.CHECKSUM.pack_into(buffer, 4, function(buffer[:length], value) & 0xffffffff)
+        return length
 
     @staticmethod
-    def parse_seg(seg_bytes):
+    def parse_seg(seg_bytes, checksum="crc32"):
         """
         parse a segment
         the checksum is verified by computing the checksum again
 
         arguments:
-        seg_bytes -- The complete segment as a bytes object
+        seg_bytes -- the complete segment, bytes or a memoryview of a receive buffer
+        checksum -- the checksum algorithm of the connection, a key of Segment.CHECKSUMS
+                    (SYN segments are always checked with CRC32)
 
         returns:
-        dict: a dictionary containing:
+        SegmentView: the parsed segment, with fields (attributes, or keys as in a dict):
             - seq: the sequence number
             - ack: the acknowledgment number
             - window: the window size
@@ -79,40 +283,57 @@ class Segment:
             - SYN: boolean flag for SYN
             - FIN: boolean flag for FIN
             - DATA: boolean flag for DATA
-            - payload: the payload
+            - PARITY: boolean flag for PARITY
+            - payload: the payload, a memoryview into seg_bytes (Segment.EMPTY when there is none)
             - valid: boolean which indicate if the segment's checksum is correct
+            - version: the header version the segment was encoded with
         """
         if len(seg_bytes) < Segment.HEADER_SIZE:
-            raise ValueError("Segment too short to contain 5-byte header")
-
-        header = seg_bytes[:Segment.HEADER_SIZE]
-        payload = seg_bytes[Segment.HEADER_SIZE:]
-
-        seq = header[0]
-        ack = header[1]
-        window = header[2]
-        flags_byte = header[3]
-        checksum_bytes = header[4:8]
-        checksum = int.from_bytes(checksum_bytes, byteorder='big')
-
-        header_zero = header[:4] + b"\x00\x00\x00\x00"
-        computed_checksum = Segment.compute_checksum(header_zero + payload)
-        valid = (computed_checksum == checksum)
-
-        a_flag = bool((flags_byte >> 4) & 1)
-        s_flag = bool((flags_byte >> 3) & 1)
-        f_flag = bool((flags_byte >> 2) & 1)
-        d_flag = bool((flags_byte >> 1) & 1)
-
-        return {
-            "seq": seq,
-            "ack": ack,
-            "window": window,
-            "checksum": checksum,
-            "ACK": a_flag,
-            "SYN": s_flag,
-            "FIN": f_flag,
-            "DATA": d_flag,
-            "payload": payload,
-            "valid": valid
-        }
+            raise ValueError("Segment too short to contain 8-byte header")
+
+        flags = seg_bytes[3]
+        if flags & Segment.SYN_FLAG:
+            checksum = "crc32"
+        function, value = Segment.CHECKSUMS[checksum]
+        length = len(seg_bytes)
+        segment = SegmentView()
+        if length == Segment.HEADER_SIZE_V2 and flags & Segment.V2_FLAG:
+            # header-only control segments (ACK, FIN, FIN-ACK) are unpacked in place, without
+            # the memoryview and its slices, and share one empty payload
+            segment.version = 2
+            _, segment.window, segment.flags, segment.checksum, segment.seq, segment.ack = \
+                Segment.HEADER_V2.unpack_from(seg_bytes)
+            segment.payload = Segment.EMPTY
+            segment.valid = function is None or function(
+                seg_bytes[8:], function(Segment.ZERO_CHECKSUM, function(seg_bytes[:4], value))) \
+                & 0xffffffff == segment.checksum
+            return segment
+        if length == Segment.HEADER_SIZE:
+            segment.version = 1
+            segment.seq, segment.ack, segment.window, segment.flags, segment.checksum = \
+                Segment.HEADER_V1.unpack_from(seg_bytes)
+            segment.payload = Segment.EMPTY
+            segment.valid = function is None or function(
+                Segment.ZERO_CHECKSUM, function(seg_bytes[:4], value)) & 0xffffffff == segment.checksum
+            return segment
+
+        view = memoryview(seg_bytes)
+        if flags & Segment.V2_FLAG and length > Segment.HEADER_SIZE_V2:
+            segment.version = 2
+            header_size = Segment.HEADER_SIZE_V2
+            _, segment.window, segment.flags, segment.checksum, segment.seq, segment.ack = \
+                Segment.HEADER_V2.unpack_from(view)
+        else:
+            segment.version = 1
+            header_size = Segment.HEADER_SIZE
+            segment.seq, segment.ack, segment.window, segment.flags, segment.checksum = \
+                Segment.HEADER_V1.unpack_from(view)
+
+        segment.payload = view[header_size:]
+        if function is None:
+            segment.valid = True
+            return segment
+        # header with a zero checksum field, then the rest of the header and the payload, without copying
+        value = function(view[8:], function(Segment.ZERO_CHECKSUM, function(view[:4], value))) & 0xffffffff
+        segment.valid = value == segment.checksum
+        return segment
@@ -2,19 +2,146 @@
 # Timer Utility
 #
 
+import collections
 import time
+from metrics import Histogram
+
+# RTO bounds in seconds, the initial RTO is the value used before any RTT sample
+INITIAL_RTO = 0.5
+MIN_RTO = 0.05
+MAX_RTO = 10.0
+
+# the side that answers a FIN with FIN-ACK waits this many RTOs for a retransmitted FIN
+LINGER_RTOS = 4
+
+# the most recent RTT samples kept for the percentiles of stats()
+RTT_HISTORY = 1 << 16
+
+
+class RTTEstimator:
+    """
+    round-trip time estimator in the style of RFC 6298
+
+    keeps the smoothed RTT (SRTT) and its variation (RTTVAR), derives the
+    retransmission timeout (RTO) from them and doubles the RTO on every
+    timeout until an ACK acknowledges new data
+    """
+    ALPHA = 1 / 8
+    BETA = 1 / 4
+    K = 4
+
+    def __init__(self, initial_rto=INITIAL_RTO, min_rto=MIN_RTO, max_rto=MAX_RTO):
+        """
+        initialize the estimator without any RTT sample
+
+        arguments:
+        initial_rto -- the RTO used until the first sample
+        min_rto -- the lower bound of the RTO
+        max_rto -- the upper bound of the RTO, also caps the backoff
+        """
+        self.min_rto = min_rto
+        self.max_rto = max_rto
+        self.srtt = None
+        self.rttvar = None
+        self.last_rtt = None
+        self.base_rto = min(max(initial_rto, min_rto), max_rto)
+        self.rto = self.base_rto
+        self.samples = 0
+        self.karn_skipped = 0
+        self.backoffs = 0
+        self.history = collections.deque(maxlen=RTT_HISTORY)
+        # every sample since the start, for metrics
+        self.histogram = Histogram()
+
+    def add_sample(self, rtt, retransmitted=False):
+        """
+        update SRTT, RTTVAR and the RTO with a new measurement
+
+        a valid sample also clears the backoff; a dropped one leaves the
+        backed-off RTO in place until a segment sent once is acknowledged
+
+        arguments:
+        rtt -- the measured round-trip time in seconds
+        retransmitted -- True if the measured segment was retransmitted,
+                         the sample is then ambiguous and dropped (Karn's rule)
+        """
+        if retransmitted:
+            self.karn_skipped += 1
+            return
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - self.BETA) * self.rttvar + self.BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - self.ALPHA) * self.srtt + self.ALPHA * rtt
+        self.last_rtt = rtt
+        self.samples += 1
+        self.history.append(rtt)
+        self.histogram.observe(rtt)
+        self.base_rto = min(max(self.srtt + self.K * self.rttvar, self.min_rto), self.max_rto)
+        self.rto = self.base_rto
+
+    def backoff(self):
+        """
+        double the RTO after a retransmission timeout
+        """
+        self.backoffs += 1
+        self.rto = min(self.rto * 2, self.max_rto)
+
+    def percentile(self, q):
+        """
+        return the nearest-rank percentile of the recent RTT samples, None without samples
+
+        arguments:
+        q -- the percentile in [0, 100]
+        """
+        if not self.history:
+            return None
+        ordered = sorted(self.history)
+        return ordered[min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered))) - 1))]
+
+    def stats(self):
+        """
+        return the current RTT/RTO statistics as a dict
+        """
+        return {
+            "srtt": self.srtt,
+            "rttvar": self.rttvar,
+            "last_rtt": self.last_rtt,
+            "p50": self.percentile(50),
+            "p99": self.percentile(99),
+            "rto": self.rto,
+            "min_rto": self.min_rto,
+            "max_rto": self.max_rto,
+            "samples": self.samples,
+            "karn_skipped": self.karn_skipped,
+            "backoffs": self.backoffs
+        }
 
 
 class Timer:
-    def __init__(self):
+    def __init__(self, estimator=None, scale=1):
         """
         initialize the timer
 
         set the running state to False
         set the start time to 0
+
+        arguments:
+        estimator -- the RTTEstimator providing the timeout, INITIAL_RTO is used without one
+        scale -- multiple of the RTO the timer waits for
         """
         self.running = False
         self.start_time = 0
+        self.estimator = estimator
+        self.scale = scale
+
+    def timeout(self):
+        """
+        return the current timeout in seconds
+        """
+        rto = self.estimator.rto if self.estimator else INITIAL_RTO
+        return rto * self.scale
 
     def reset_timer(self):
         """
@@ -22,7 +149,7 @@ class Timer:
         setting timer to running state, and start timer
         """
         self.running = True
-        self.start_time = time.time()
+        self.start_time = time.monotonic()
 
     def stop_timer(self):
         """
@@ -34,17 +161,17 @@ class Timer:
     def is_timeout(self):
         """
         check if timer is timeout
-        return True if 0.5s after a timer reset, false otherwise
+        return True if the timeout elapsed after a timer reset, false otherwise
         """
         if not self.running:
             return False
-        return (time.time() - self.start_time) >= 0.5
+        return (time.monotonic() - self.start_time) >= self.timeout()
 
-    def is_timeout_2s(self):
+    def time_left(self):
         """
-        check if timer is timeout
-        return True if 2.0s after a timer reset, false otherwise
+        seconds until is_timeout() becomes True
+        return None if the timer is not running
         """
         if not self.running:
-            return False
-        return (time.time() - self.start_time) >= 2.0
+            return None
+        return max(0.0, self.start_time + self.timeout() - time.monotonic())
@@ -0,0 +1,274 @@
+#
+# Mini Reliable Transport - Batched Datagram I/O
+# Sends and receives many UDP datagrams per system call
+#
+# A window burst of the client and a burst of arriving segments at the
+# server otherwise cost one sendto()/recvfrom() each. On Linux, sendmmsg()
+# and recvmmsg() are called through ctypes; elsewhere (or when batching is
+# turned off) BatchSocket falls back to one system call per datagram.
+#
+
+import ctypes
+import ctypes.util
+import errno
+import select
+import socket
+import sys
+
+# the most datagrams per sendmmsg()/recvmmsg() call
+MAX_BATCH = 32
+# the largest UDP payload, the size of every receive slot
+MAX_DATAGRAM = 65535
+# recvfrom() flag used to drain the socket without blocking (0 where unsupported)
+RECV_NOWAIT = getattr(socket, "MSG_DONTWAIT", 0)
+
+
+class IOVec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p), ("iov_len", ctypes.c_size_t)]
+
+
+class MsgHdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_name", ctypes.c_void_p),
+        ("msg_namelen", ctypes.c_uint32),
+        ("msg_iov", ctypes.POINTER(IOVec)),
+        ("msg_iovlen", ctypes.c_size_t),
+        ("msg_control", ctypes.c_void_p),
+        ("msg_controllen", ctypes.c_size_t),
+        ("msg_flags", ctypes.c_int),
+    ]
+
+
+class MMsgHdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", MsgHdr), ("msg_len", ctypes.c_uint)]
+
+
+class SockAddrIn(ctypes.Structure):
+    _fields_ = [
+        ("sin_family", ctypes.c_ushort),
+        ("sin_port", ctypes.c_uint16),
+        ("sin_addr", ctypes.c_uint8 * 4),
+        ("sin_zero", ctypes.c_uint8 * 8),
+    ]
+
+
+def load_mmsg():
+    """
+    return the libc functions (sendmmsg, recvmmsg), or None where they are not available
+    """
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        sendmmsg = libc.sendmmsg
+        recvmmsg = libc.recvmmsg
+    except (OSError, AttributeError):
+        return None
+    # the message vectors are passed as addresses, so a call can start inside the array
+    sendmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int]
+    sendmmsg.restype = ctypes.c_int
+    recvmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+    recvmmsg.restype = ctypes.c_int
+    return sendmmsg, recvmmsg
+
+
+MMSG = load_mmsg()
+
+
+class BatchSocket:
+    """
+    many datagrams per system call on a UDP (IPv4) socket
+
+    datagrams to send are encoded into fixed send slots and sent together
+    with send_slots(), or into any bytearray of the caller and sent with
+    send_spans(); recvmany() drains the socket; both use
+    sendmmsg()/recvmmsg() when batched is True, else (or where they do not
+    exist) one sendto()/recvfrom() per datagram, with the same results
+
+    the message vectors and iovecs are built once, so per datagram only
+    its address and length are written (through flat integer views of the arrays)
+    """
+    def __init__(self, sock, batched=True, slot_size=0, max_batch=MAX_BATCH, max_datagram=MAX_DATAGRAM):
+        """
+        wrap a socket, allocating the send slots and receive slots once
+
+        arguments:
+        sock -- the UDP socket, bound for receiving
+        batched -- use sendmmsg()/recvmmsg() where available
+        slot_size -- the size of each of the max_batch send slots, 0 if the socket only receives
+        max_batch -- the most datagrams per system call
+        max_datagram -- the size of a receive slot, longer datagrams are truncated
+        """
+        self.sock = sock
+        self.batched = batched and MMSG is not None
+        self.slot_size = slot_size
+        self.max_batch = max_batch
+        self.max_datagram = max_datagram
+        self.send_area = bytearray(max_batch * slot_size)
+        self.slots = [memoryview(self.send_area)[i * slot_size:(i + 1) * slot_size] for i in range(max_batch)]
+        self.dest = None
+        # id of every area send_spans() sent from -> (area, its memoryview, the address of its first byte)
+        self.areas = {}
+        # raw port and address of a sender's sockaddr -> (ip, port)
+        self.senders = {}
+        self.stats = {"send_calls": 0, "sent": 0, "recv_calls": 0, "received": 0}
+        if self.batched:
+            self.init_mmsg()
+
+    def init_mmsg(self):
+        """
+        build the message vectors of sendmmsg()/recvmmsg()
+        """
+        count = self.max_batch
+        self.send_msgs = (MMsgHdr * count)()
+        self.send_iovs = (IOVec * count)()
+        self.send_name = SockAddrIn()
+        # iov_base and iov_len of message i are words 2 * i and 2 * i + 1
+        self.send_iov_words = (ctypes.c_size_t * (2 * count)).from_buffer(self.send_iovs)
+        for i in range(count):
+            header = self.send_msgs[i].msg_hdr
+            header.msg_name = ctypes.addressof(self.send_name)
+            header.msg_namelen = ctypes.sizeof(SockAddrIn)
+            header.msg_iov = ctypes.pointer(self.send_iovs[i])
+            header.msg_iovlen = 1
+
+        self.recv_msgs = (MMsgHdr * count)()
+        self.recv_iovs = (IOVec * count)()
+        # the sender addresses and datagrams land in plain bytearrays, sliced without ctypes calls
+        self.recv_names = bytearray(count * ctypes.sizeof(SockAddrIn))
+        self.recv_names_anchor = ctypes.c_char.from_buffer(self.recv_names)
+        self.recv_area = bytearray(count * self.max_datagram)
+        self.recv_anchor = ctypes.c_char.from_buffer(self.recv_area)
+        # msg_len of message i is word i * msg_words + msg_len_word
+        self.recv_msg_words = (ctypes.c_uint * (ctypes.sizeof(self.recv_msgs) // 4)).from_buffer(self.recv_msgs)
+        self.msg_words = ctypes.sizeof(MMsgHdr) // 4
+        self.msg_len_word = MMsgHdr.msg_len.offset // 4
+        for i in range(count):
+            self.recv_iovs[i].iov_base = ctypes.addressof(self.recv_anchor) + i * self.max_datagram
+            self.recv_iovs[i].iov_len = self.max_datagram
+            header = self.recv_msgs[i].msg_hdr
+            header.msg_name = ctypes.addressof(self.recv_names_anchor) + i * ctypes.sizeof(SockAddrIn)
+            header.msg_namelen = ctypes.sizeof(SockAddrIn)
+            header.msg_iov = ctypes.pointer(self.recv_iovs[i])
+            header.msg_iovlen = 1
+
+    def send_slots(self, lengths, addr):
+        """
+        send the datagrams encoded into the first len(lengths) send slots to one address, in order
+
+        arguments:
+        lengths -- the length of the datagram in each slot, at most max_batch of them
+        addr -- the (ip, port) destination
+
+        returns:
+        int -- the number of system calls made
+        """
+        size = self.slot_size
+        return self.send_spans(self.send_area, [(i * size, length) for i, length in enumerate(lengths)], addr)
+
+    def send_spans(self, area, spans, addr):
+        """
+        send datagrams that lie anywhere in a bytearray to one address, in order, without copying them
+
+        arguments:
+        area -- the bytearray, it must not be resized once sent from
+        spans -- (offset, length) of each datagram in area, at most max_batch of them
+        addr -- the (ip, port) destination
+
+        returns:
+        int -- the number of system calls made
+        """
+        if not spans:
+            return 0
+        entry = self.areas.get(id(area))
+        if entry is None or entry[0] is not area:
+            # the ctypes view pins the area, its address stays valid
+            address = ctypes.addressof(ctypes.c_char.from_buffer(area)) if self.batched else 0
+            entry = self.areas[id(area)] = (area, memoryview(area), address)
+        if not self.batched:
+            view = entry[1]
+            for offset, length in spans:
+                self.sock.sendto(view[offset:offset + length], addr)
+            self.stats["send_calls"] += len(spans)
+            self.stats["sent"] += len(spans)
+            return len(spans)
+
+        if addr != self.dest:
+            self.send_name.sin_family = socket.AF_INET
+            self.send_name.sin_port = socket.htons(addr[1])
+            self.send_name.sin_addr[:] = socket.inet_aton(socket.gethostbyname(addr[0]))
+            self.dest = addr
+        words = self.send_iov_words
+        base = entry[2]
+        for i, (offset, length) in enumerate(spans):
+            words[2 * i] = base + offset
+            words[2 * i + 1] = length
+        sent = 0
+        calls = 0
+        while sent < len(spans):
+            msgs = ctypes.addressof(self.send_msgs) + sent * ctypes.sizeof(MMsgHdr)
+            result = MMSG[0](self.sock.fileno(), msgs, len(spans) - sent, 0)
+            calls += 1
+            if result < 0:
+                code = ctypes.get_errno()
+                if code in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    # a socket with a timeout is non-blocking underneath, wait like sendto() would
+                    select.select([], [self.sock], [])
+                    continue
+                if code == errno.EINTR:
+                    continue
+                raise OSError(code, "sendmmsg: " + errno.errorcode.get(code, str(code)))
+            sent += result
+        self.stats["send_calls"] += calls
+        self.stats["sent"] += len(spans)
+        return calls
+
+    def recvmany(self):
+        """
+        receive every datagram already queued on the socket without blocking
+        (at least one should be, e.g. after select())
+
+        returns:
+        list -- (datagram, (ip, port)) of the datagrams in arrival order, each
+                datagram a bytes-like copy (bytearray when batched)
+        """
+        batch = []
+        if not self.batched:
+            while True:
+                try:
+                    batch.append(self.sock.recvfrom(self.max_datagram, RECV_NOWAIT))
+                except (BlockingIOError, InterruptedError):
+                    break
+                self.stats["recv_calls"] += 1
+                if not RECV_NOWAIT:
+                    break
+            self.stats["received"] += len(batch)
+            return batch
+
+        area = self.recv_area
+        size = self.max_datagram
+        name_size = ctypes.sizeof(SockAddrIn)
+        words = self.recv_msg_words
+        while True:
+            count = MMSG[1](self.sock.fileno(), ctypes.addressof(self.recv_msgs), self.max_batch, RECV_NOWAIT, None)
+            self.stats["recv_calls"] += 1
+            if count < 0:
+                code = ctypes.get_errno()
+                if code in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                if code == errno.EINTR:
+                    continue
+                raise OSError(code, "recvmmsg: " + errno.errorcode.get(code, str(code)))
+            names = bytes(self.recv_names)
+            for i in range(count):
+                # port and address of sockaddr_in, both in network order
+                raw = names[i * name_size + 2:i * name_size + 8]
+                addr = self.senders.get(raw)
+                if addr is None:
+                    addr = self.senders[raw] = (socket.inet_ntoa(raw[2:]), int.from_bytes(raw[:2], "big"))
+                length = words[i * self.msg_words + self.msg_len_word]
+                batch.append((area[i * size:i * size + length], addr))
+            if count < self.max_batch:
+                break
+        self.stats["received"] += len(batch)
+        return batch
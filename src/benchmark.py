@@ -0,0 +1,1442 @@
+#
+# Mini Reliable Transport (MRT) - Benchmarks
+#
+# Loopback benchmarks for the MRT client and server. Each benchmark runs
+# the code under test against a minimal in-process peer so that the number
+# reported reflects the MRT implementation and not the peer.
+#
+# usage: python benchmark.py send [--segments 200] [--segment-size 1460] [--window 64] [--log-level debug]
+#        python benchmark.py retransmit [--rounds 2000] [--segment-size 1460] [--window 64]
+#        python benchmark.py receive [--segments 100] [--segment-size 1460] [--window 32] [--log-level debug]
+#        python benchmark.py goodput [--size 5000] [--segment-size 48] [--loss-file ../loss_example.txt]
+#        python benchmark.py recovery [--size 5000] [--segment-size 48] [--loss-file ../loss_example.txt]
+#        python benchmark.py congestion [--size 5000000] [--loss-file ../loss_example.txt] [--trace cwnd.csv]
+#        python benchmark.py pacing [--size 2000000] [--loss-file ../bottleneck_example.txt] [--congestion reno]
+#        python benchmark.py sizing [--bit-errors 0 0.00001 0.00003 0.0001] [--segment-sizes 256 512 1460]
+#        python benchmark.py fec [--size 5000] [--loss-file ../loss_example.txt] [--delay 100] [--fec 4:1 4:2 8:4]
+#        python benchmark.py acks [--size 100000000] [--ack-every 1 2 4]
+#        python benchmark.py connections [--clients 200] [--size 100000] [--backlog 64]
+#        python benchmark.py async [--clients 2000] [--size 20000]
+#        python benchmark.py buffer [--size 1073741824] [--call-sizes 4096 1048576] [--buffer-size 4194304]
+#        python benchmark.py segment [--payload-sizes 64 1460 65536] [--duration 1.0]
+#        python benchmark.py checksum [--payload-sizes 64 1460 8192] [--gigabytes 0.25]
+#        python benchmark.py batch [--segment-size 1452] [--burst 1000] [--duration 1.0]
+#        python benchmark.py network [--bit-errors 0 0.0001 0.001 0.01] [--seed 1]
+#        python benchmark.py suite [--sizes 1000000] [--schedules none 0.01:0.000001 ../wan_example.txt] [--out suite.json]
+#        python benchmark.py compare base.json new.json [--threshold 0.1]
+#
+
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import math
+import os
+import platform
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from Segment import Segment
+from batch_io import BatchSocket
+from congestion import CONTROLLERS
+
+
+class AckResponder:
+    """
+    minimal MRT receiver used as the peer of the client benchmarks
+
+    it completes the handshake, acknowledges in-order DATA segments
+    immediately with an always open window (unless ack_data is False, then
+    DATA is ignored), and answers FIN with FIN-ACK
+    """
+    def __init__(self, port, window):
+        """
+        bind the responder socket and start its thread
+
+        arguments:
+        port -- the port to listen on
+        window -- the window advertised in the SYN-ACK
+        """
+        self.window = window
+        self.expected = 0
+        self.ack_data = True
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', port))
+        self.sock.settimeout(0.5)
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        """
+        answer every segment received until stopped
+        """
+        while self.running:
+            try:
+                seg_bytes, addr = self.sock.recvfrom(65535)
+            except socket.timeout:
+                continue
+            seg = Segment.parse_seg(seg_bytes)
+            if not seg["valid"]:
+                continue
+            version = seg["version"]
+            if seg["FIN"] and not seg["ACK"]:
+                reply = Segment.create_seg(0, 0, 0, a_flag=True, f_flag=True, version=version)
+            elif seg["SYN"]:
+                reply = Segment.create_seg(0, seg["seq"] + 1, self.window, a_flag=True, s_flag=True, version=version)
+            elif seg["DATA"]:
+                if not self.ack_data:
+                    continue
+                if Segment.seq_diff(seg["seq"], self.expected, version) == 0:
+                    self.expected += 1
+                reply = Segment.create_seg(0, self.expected, self.window, a_flag=True, version=version)
+            else:
+                continue
+            self.sock.sendto(reply, addr)
+
+    def stop(self):
+        """
+        stop the responder thread and close its socket
+        """
+        self.running = False
+        self.thread.join()
+        self.sock.close()
+
+
+def bench_send(segments, segment_size, window, client_port, peer_port, version=2, log_level="debug"):
+    """
+    measure how many DATA segments per second Client.send() pushes
+
+    arguments:
+    segments -- the number of segments to send
+    segment_size -- the client segment size (including the header)
+    window -- the window advertised by the responder
+    version -- the segment header version requested by the client
+    log_level -- the event log level of the client
+
+    returns:
+    dict -- elapsed time and segments/s of the send() call
+    """
+    from mrt_client import Client
+
+    responder = AckResponder(peer_port, window)
+    payload = os.urandom(segments * (segment_size - Segment.header_size(version)))
+    client = Client()
+    with contextlib.redirect_stdout(io.StringIO()):
+        client.init(client_port, '127.0.0.1', peer_port, segment_size, version, log_level=log_level)
+        client.connect()
+        start = time.perf_counter()
+        client.send(payload)
+        elapsed = time.perf_counter() - start
+        client.close()
+    responder.stop()
+    return {"segments": segments, "elapsed": elapsed, "segments_per_s": segments / elapsed}
+
+
+def bench_retransmit(rounds, segment_size, window, client_port, peer_port, version=2):
+    """
+    measure the CPU time Client.retransmit() spends per MB resent: the
+    responder stops acknowledging, the client fills the window, and the
+    whole window is resent rounds times, as Go-Back-N does on each timeout
+
+    arguments:
+    rounds -- the number of times the window is resent
+    segment_size -- the client segment size (including the header)
+    window -- the window advertised by the responder
+    version -- the segment header version requested by the client
+
+    returns:
+    dict -- MB resent, CPU seconds and CPU ms per MB of the resending thread
+    """
+    from mrt_client import Client
+
+    responder = AckResponder(peer_port, window)
+    responder.ack_data = False
+    payload_size = segment_size - Segment.header_size(version)
+    client = Client()
+    with contextlib.redirect_stdout(io.StringIO()):
+        client.init(client_port, '127.0.0.1', peer_port, segment_size, version, congestion="none",
+                    log_level="off")
+        client.connect()
+        sender = threading.Thread(target=client.send, args=(os.urandom(window * payload_size),))
+        sender.start()
+        while client.next_seq < window:
+            time.sleep(0.001)
+        resent = 0
+        start = time.thread_time()
+        for _ in range(rounds):
+            with client.send_cond:
+                seqs = list(range(client.send_base, client.next_seq))
+                client.retransmit(seqs, "retransmitted")
+            resent += len(seqs) * payload_size
+        cpu = time.thread_time() - start
+        responder.ack_data = True
+        sender.join()
+        client.close()
+    responder.stop()
+    return {"mb": resent / 1e6, "cpu": cpu, "cpu_ms_per_mb": cpu * 1000 / (resent / 1e6)}
+
+
+def percentile(values, q):
+    """
+    nearest-rank percentile of a list of numbers
+
+    arguments:
+    values -- the samples
+    q -- the percentile in [0, 100]
+    """
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def bench_receive(segments, segment_size, window, server_port, peer_port, version=2, log_level="debug"):
+    """
+    measure the ACK latency and the ingest rate of the server pipeline
+
+    a raw UDP peer performs the handshake, then sends DATA segments
+    one at a time to time each ACK, then keeps `window` segments in
+    flight to measure datagrams/s
+
+    arguments:
+    segments -- the number of segments sent in each phase
+    segment_size -- the segment size announced in the SYN (including the header)
+    window -- the number of segments kept in flight in the throughput phase
+    version -- the segment header version used by the peer
+    log_level -- the event log level of the server
+
+    returns:
+    dict -- ACK latency percentiles (ms) and datagrams/s
+    """
+    from mrt_server import Server
+
+    payload_size = segment_size - Segment.header_size(version)
+    payload = os.urandom(payload_size)
+    server = Server()
+    result = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        server.init(server_port, 64 * segment_size, log_level=log_level)
+        accepted = []
+        acceptor = threading.Thread(target=lambda: accepted.append(server.accept()))
+        acceptor.start()
+
+        peer = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        peer.bind(('127.0.0.1', peer_port))
+        peer.settimeout(2.0)
+        server_addr = ('127.0.0.1', server_port)
+        peer.sendto(Segment.create_seg(0, 0, 0, s_flag=True, payload=str(segment_size).encode(), version=version),
+                    server_addr)
+        peer.recvfrom(65535)
+        peer.sendto(Segment.create_seg(0, 1, 0, a_flag=True, version=version), server_addr)
+        acceptor.join()
+
+        conn = accepted[0]
+        reader = threading.Thread(target=server.receive, args=(conn, 2 * segments * payload_size))
+        reader.start()
+
+        # phase 1: stop-and-wait, one ACK latency sample per segment
+        latencies = []
+        seq = 0
+        for _ in range(segments):
+            start = time.perf_counter()
+            peer.sendto(Segment.create_seg(seq, 0, 0, d_flag=True, payload=payload, version=version), server_addr)
+            while Segment.seq_diff(Segment.parse_seg(peer.recvfrom(65535)[0])["ack"], seq + 1, version) != 0:
+                pass
+            latencies.append((time.perf_counter() - start) * 1000)
+            seq += 1
+
+        # phase 2: keep `window` segments in flight, count datagrams/s
+        first = seq
+        last = seq + segments
+        next_seq = seq
+        acked = seq
+        start = time.perf_counter()
+        while acked < last:
+            while next_seq < last and next_seq < acked + window:
+                peer.sendto(Segment.create_seg(next_seq, 0, 0, d_flag=True, payload=payload, version=version),
+                            server_addr)
+                next_seq += 1
+            ack = Segment.parse_seg(peer.recvfrom(65535)[0])["ack"]
+            acked += max(0, Segment.seq_diff(ack, acked, version))
+        elapsed = time.perf_counter() - start
+
+        reader.join()
+        conn.fin_ack_received = True
+        server.close()
+        peer.close()
+
+    result["ack_latency_p50_ms"] = percentile(latencies, 50)
+    result["ack_latency_p99_ms"] = percentile(latencies, 99)
+    result["datagrams_per_s"] = (last - first) / elapsed
+    return result
+
+
+# seconds run_transfer() waits for the server to finish closing
+CLOSE_TIMEOUT = 30
+
+
+def run_transfer(size, segment_size, buffer_size, port, loss_file=None, client_kwargs=None, server_kwargs=None,
+                 seed=None):
+    """
+    transfer `size` random bytes from a Client to a Server on loopback
+
+    the Server and the Client run in this process; with a loss file the
+    segments go through the network.py forwarder, which also runs here
+
+    arguments:
+    size -- the number of bytes to transfer
+    segment_size -- the client segment size (including the header)
+    buffer_size -- the server receive buffer size
+    port -- the server port, the client uses port + 1 and the forwarder port + 2
+    loss_file -- the network.py loss file, None to connect directly
+    client_kwargs, server_kwargs -- extra arguments of Client.init() and Server.init()
+    seed -- the seed of the forwarder's loss and bit errors, None for a random one
+
+    returns:
+    dict -- elapsed seconds until the server received everything, goodput in
+            bytes/s, whether the data arrived intact, the CPU seconds of the
+            server threads (receive loop, protocol loop and the reader), the
+            server's ack_stats() and stats() and the Client object
+    """
+    import network
+    from mrt_client import Client
+    from mrt_server import Server
+
+    data = os.urandom(size)
+    received = {}
+    server = Server()
+    client = Client()
+
+    def serve():
+        conn = received["conn"] = server.accept()
+        chunks = []
+        remaining = size
+        while remaining > 0:
+            chunk = server.receive(conn, min(remaining, 1 << 20))
+            chunks.append(chunk)
+            remaining -= len(chunk)
+        received["end"] = time.perf_counter()
+        received["data"] = b"".join(chunks)
+        received["server_cpu"] = (thread_cpu(server.rcv_thread) + thread_cpu(server.sgmnt_thread)
+                                  + time.thread_time())
+        received["acks"] = server.ack_stats(conn)
+        received["server_stats"] = server.stats(conn)
+        server.close()
+
+    server_thread = forwarder = None
+    with contextlib.redirect_stdout(io.StringIO()):
+        server.init(port, buffer_size, **(server_kwargs or {}))
+        try:
+            destination = port
+            if loss_file:
+                network.loss.clear()
+                network.setUpLoss(loss_file)
+                network.setSeed(seed)
+                net_socket = network.createSocket(port + 2)
+                stop = threading.Event()
+                forwarder = threading.Thread(target=network.handleMessage,
+                                             args=(net_socket, ('127.0.0.1', port + 1), ('127.0.0.1', port),
+                                                   time.time(), stop),
+                                             daemon=True)
+                forwarder.start()
+                destination = port + 2
+            client.init(port + 1, '127.0.0.1', destination, segment_size, **(client_kwargs or {}))
+            server_thread = threading.Thread(target=serve)
+            server_thread.start()
+            start = time.perf_counter()
+            client.connect()
+            client.send(data)
+            server_thread.join(CLOSE_TIMEOUT)
+            if server_thread.is_alive():
+                # every FIN-ACK of the lingering client was lost, the server would retransmit FIN forever
+                received["conn"].fin_ack_received = True
+                server_thread.join()
+            client.close()
+        finally:
+            if server_thread is None:
+                # the setup failed, serve() is not there to close the server and its threads
+                server.close()
+            if forwarder is not None:
+                network.stopForwarder(net_socket, stop, forwarder)
+
+    elapsed = received["end"] - start
+    return {"elapsed": elapsed, "goodput": size / elapsed, "ok": received["data"] == data,
+            "server_cpu": received["server_cpu"], "acks": received["acks"],
+            "server_stats": received["server_stats"], "client": client}
+
+
+def thread_cpu(thread):
+    """
+    return the CPU seconds used so far by a running thread (Linux and other POSIX systems)
+    """
+    return time.clock_gettime(time.pthread_getcpuclockid(thread.ident))
+
+
+def compare_modes(modes, size, segment_size, buffer_size, loss_file, runs, port):
+    """
+    run the same transfers through network.py with different client settings
+
+    arguments:
+    modes -- list of (name, client_kwargs) pairs
+    size -- the number of bytes of each transfer
+    segment_size -- the client segment size (including the header)
+    buffer_size -- the server receive buffer size, which sets the window
+    loss_file -- the network.py loss file
+    runs -- the number of transfers per mode
+    port -- the first port, every transfer uses three ports from there
+
+    returns:
+    dict -- mode name to the list of run_transfer() results of its runs
+    """
+    results = {}
+    for mode, client_kwargs in modes:
+        results[mode] = []
+        for _ in range(runs):
+            run = run_transfer(size, segment_size, buffer_size, port, loss_file, client_kwargs)
+            assert run["ok"], "data corrupted in transfer"
+            results[mode].append(run)
+            port += 3
+    return results
+
+
+def bench_goodput(size, segment_size, buffer_size, loss_file, runs, port):
+    """
+    compare the goodput of Go-Back-N and Selective Repeat through network.py
+
+    returns:
+    dict -- mode name to the list of run_transfer() results of its runs
+    """
+    modes = [("gbn", {"sack": False}), ("sr", {"sack": True})]
+    return compare_modes(modes, size, segment_size, buffer_size, loss_file, runs, port)
+
+
+def bench_recovery(size, segment_size, buffer_size, loss_file, runs, port):
+    """
+    compare loss recovery by RTO only with fast retransmit after 3 duplicate ACKs
+
+    returns:
+    dict -- mode name to the list of run_transfer() results of its runs
+    """
+    modes = [("gbn rto-only", {"sack": False, "dupack_threshold": 0}),
+             ("gbn fast-retransmit", {"sack": False}),
+             ("sr rto-only", {"sack": True, "dupack_threshold": 0}),
+             ("sr fast-retransmit", {"sack": True})]
+    return compare_modes(modes, size, segment_size, buffer_size, loss_file, runs, port)
+
+
+def bench_congestion(size, segment_size, buffer_size, loss_file, runs, port):
+    """
+    compare the congestion controllers of the client
+
+    without a loss file the transfers go straight over loopback, where a
+    window larger than the socket buffers is the bottleneck
+
+    returns:
+    dict -- mode name to the list of run_transfer() results of its runs
+    """
+    modes = [(name, {"sack": True, "congestion": name}) for name in CONTROLLERS]
+    return compare_modes(modes, size, segment_size, buffer_size, loss_file, runs, port)
+
+
+def bench_pacing(size, segment_size, buffer_size, loss_file, congestion, runs, port):
+    """
+    compare window bursts with paced sending through a bottleneck
+
+    returns:
+    dict -- mode name to the list of run_transfer() results of its runs
+    """
+    modes = [("burst", {"sack": True, "congestion": congestion}),
+             ("paced", {"sack": True, "congestion": congestion, "pacing": True})]
+    return compare_modes(modes, size, segment_size, buffer_size, loss_file, runs, port)
+
+
+def bench_sizing(size, buffer_size, bit_errors, segment_sizes, ceiling, runs, seed, port):
+    """
+    goodput through network.py at several bit error rates, with fixed segment
+    sizes and with probe_mtu and adaptive_size up to a ceiling; run i of every
+    case seeds the forwarder with seed + i
+
+    arguments:
+    size -- the number of bytes of each transfer
+    buffer_size -- the server receive buffer size
+    bit_errors -- the bit error rates, without packet loss
+    segment_sizes -- the fixed segment sizes (including the header)
+    ceiling -- the segment size the adaptive client starts probing from
+    runs -- the transfers per case
+    seed -- the seed of the first run
+    port -- the first port, every transfer uses three ports from there
+
+    returns:
+    dict -- bit error rate to a dict of mode name to the list of run_transfer() results of its runs
+    """
+    modes = [(str(segment_size), segment_size, {"sack": True}) for segment_size in segment_sizes]
+    modes.append(("adaptive", ceiling, {"sack": True, "probe_mtu": True, "adaptive_size": True}))
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="mrt_loss_") as directory:
+        for bit_error in bit_errors:
+            loss_file = schedule_file(f"0:{bit_error}", directory)
+            results[bit_error] = {}
+            for mode, segment_size, client_kwargs in modes:
+                results[bit_error][mode] = []
+                for i in range(runs):
+                    run = run_transfer(size, segment_size, buffer_size, port, loss_file,
+                                       dict(client_kwargs, log_level="off"), seed=seed + i)
+                    assert run["ok"], "data corrupted in transfer"
+                    results[bit_error][mode].append(run)
+                    port += 3
+    return results
+
+
+def delayed_file(loss_file, delay, directory):
+    """
+    return a copy of a loss file with the one-way delay of every period set to delay ms
+
+    arguments:
+    loss_file -- the network.py loss file
+    delay -- the delay in ms
+    directory -- where to write the copy, a temporary directory of the caller
+    """
+    lines = []
+    with open(loss_file) as f:
+        for line in f:
+            columns = line.split()
+            if not columns:
+                continue
+            columns += ["0"] * (4 - len(columns))
+            columns[3] = f"{delay:g}"
+            lines.append(" ".join(columns))
+    path = os.path.join(directory, f"delayed_{delay:g}_{os.path.basename(loss_file)}")
+    with open(path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+    return path
+
+
+def bench_fec(size, segment_size, buffer_size, loss_file, delay, fec_settings, runs, port):
+    """
+    compare plain Go-Back-N with Go-Back-N and FEC parity groups through
+    network.py, with the delay added to every period of the loss file
+
+    arguments:
+    fec_settings -- the (k, m) of each FEC mode
+    delay -- the one-way delay of the link in ms
+    the other arguments are those of compare_modes()
+
+    returns:
+    dict -- mode name to the list of run_transfer() results of its runs
+    """
+    modes = [("gbn", {"sack": False})]
+    modes += [(f"gbn fec {k}:{m}", {"sack": False, "fec": (k, m)}) for k, m in fec_settings]
+    with tempfile.TemporaryDirectory(prefix="mrt_loss_") as directory:
+        return compare_modes(modes, size, segment_size, buffer_size, delayed_file(loss_file, delay, directory),
+                             runs, port)
+
+
+def bench_acks(size, segment_size, buffer_size, ack_every_values, runs, port):
+    """
+    reverse-path packets and server CPU of loopback transfers with delayed
+    ACKs every k segments, k = 1 being an ACK per segment
+
+    arguments:
+    size -- the number of bytes of each transfer
+    segment_size -- the client segment size (including the header)
+    buffer_size -- the server receive buffer size
+    ack_every_values -- the values of Server.init(ack_every=...) to compare
+    runs -- the number of transfers per value
+    port -- the first port, every transfer uses three ports from there
+
+    returns:
+    dict -- ack_every to the list of run_transfer() results of its runs
+    """
+    results = {}
+    for ack_every in ack_every_values:
+        results[ack_every] = []
+        for _ in range(runs):
+            run = run_transfer(size, segment_size, buffer_size, port, server_kwargs={"ack_every": ack_every})
+            assert run["ok"], "data corrupted in transfer"
+            results[ack_every].append(run)
+            port += 3
+    return results
+
+
+def bench_connections(clients, size, segment_size, buffer_size, backlog, port):
+    """
+    load test of one server port with many concurrent clients
+
+    every client connects, sends `size` random bytes and closes; the server
+    accepts them all and receives each connection in its own thread
+
+    arguments:
+    clients -- the number of concurrent clients
+    size -- the number of bytes each client sends
+    segment_size -- the client segment size (including the header)
+    buffer_size -- the server receive buffer size of each connection
+    backlog -- the server accept backlog
+    port -- the server port, the clients use the ports after it
+
+    returns:
+    dict -- aggregate goodput (bytes/s), connect time percentiles (ms) and
+            the number of connections whose data arrived intact
+    """
+    from mrt_client import Client
+    from mrt_server import Server
+
+    payloads = {port + 1 + i: os.urandom(size) for i in range(clients)}
+    connect_times = []
+    intact = []
+    server = Server()
+
+    def collect(conn):
+        data = server.receive(conn, size)
+        intact.append(data == payloads[conn.addr[1]])
+
+    def serve():
+        collectors = []
+        for _ in range(clients):
+            collector = threading.Thread(target=collect, args=(server.accept(),))
+            collector.start()
+            collectors.append(collector)
+        for collector in collectors:
+            collector.join()
+
+    def run_client(client_port):
+        client = Client()
+        client.init(client_port, '127.0.0.1', port, segment_size)
+        start = time.perf_counter()
+        client.connect()
+        connect_times.append((time.perf_counter() - start) * 1000)
+        client.send(payloads[client_port])
+        client.close()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        server.init(port, buffer_size, backlog=backlog)
+        server_thread = threading.Thread(target=serve)
+        server_thread.start()
+        start = time.perf_counter()
+        senders = [threading.Thread(target=run_client, args=(client_port,)) for client_port in payloads]
+        for sender in senders:
+            sender.start()
+        server_thread.join()
+        elapsed = time.perf_counter() - start
+        for sender in senders:
+            sender.join()
+        server.close()
+
+    return {
+        "goodput": clients * size / elapsed,
+        "elapsed": elapsed,
+        "connect_p50_ms": percentile(connect_times, 50),
+        "connect_p99_ms": percentile(connect_times, 99),
+        "intact": sum(intact),
+    }
+
+
+def bench_async(clients, size, segment_size, buffer_size, port):
+    """
+    load test of the asyncio transport: one server port and many clients on one event loop
+
+    arguments:
+    clients -- the number of concurrent clients
+    size -- the number of bytes each client sends
+    segment_size -- the client segment size (including the header)
+    buffer_size -- the server receive buffer size of each connection
+    port -- the server port, the clients use free ports
+
+    returns:
+    dict -- aggregate goodput (bytes/s), connect time percentiles (ms), the
+            number of connections whose data arrived intact and the number
+            of threads of the process during the transfers
+    """
+    import asyncio
+    from mrt_async import AsyncClient, AsyncServer
+
+    payloads = {}
+    connect_times = []
+    intact = []
+
+    async def run_client(server_ready):
+        await server_ready
+        client = AsyncClient()
+        await client.init(0, '127.0.0.1', port, segment_size, log=False)
+        payloads[client.src_port] = data = os.urandom(size)
+        start = time.perf_counter()
+        await client.connect()
+        connect_times.append((time.perf_counter() - start) * 1000)
+        await client.send(data)
+        await client.close()
+
+    async def collect(server, conn):
+        data = await server.receive(conn, size)
+        intact.append(data == payloads[conn.addr[1]])
+
+    async def main():
+        server = AsyncServer()
+        await server.init(port, buffer_size, backlog=clients, log=False)
+        server_ready = asyncio.get_running_loop().create_future()
+        senders = [asyncio.ensure_future(run_client(server_ready)) for _ in range(clients)]
+        start = time.perf_counter()
+        server_ready.set_result(None)
+        collectors = [asyncio.ensure_future(collect(server, await server.accept())) for _ in range(clients)]
+        threads = threading.active_count()
+        await asyncio.gather(*collectors)
+        elapsed = time.perf_counter() - start
+        await asyncio.gather(*senders)
+        await server.close()
+        return elapsed, threads
+
+    elapsed, threads = asyncio.run(main())
+    return {
+        "goodput": clients * size / elapsed,
+        "elapsed": elapsed,
+        "connect_p50_ms": percentile(connect_times, 50),
+        "connect_p99_ms": percentile(connect_times, 99),
+        "intact": sum(intact),
+        "threads": threads,
+    }
+
+
+def bench_buffer(size, call_sizes, segment_size, buffer_size, port):
+    """
+    throughput of Server.receive() and Server.receive_into() draining a connection,
+    against the former bytearray receive buffer that copied its remainder on every read
+
+    a producer thread feeds the connection payloads of segment_size bytes the
+    way process_data() does, waiting while the buffer is full, so both buffers
+    are bounded by buffer_size and only the buffer handling differs
+
+    arguments:
+    size -- the number of bytes received per run
+    call_sizes -- the lengths asked for per receive call
+    segment_size -- the payload size of the producer
+    buffer_size -- the receive buffer size of the connection
+    port -- the server port
+
+    returns:
+    dict -- MB/s per (method, call size)
+    """
+    from mrt_server import Connection, ReceiveBuffer, Server
+    from Timer import RTTEstimator
+
+    payload = os.urandom(segment_size)
+    segments = size // segment_size
+    size = segments * segment_size
+
+    def slice_copy(call_size):
+        # the receive buffer before ReceiveBuffer: one bytearray, extended by
+        # the producer and sliced by the reader
+        state = {"buffer": bytearray(), "done": False}
+        cond = threading.Condition()
+
+        def produce():
+            for _ in range(segments):
+                with cond:
+                    while len(state["buffer"]) + segment_size > buffer_size:
+                        cond.wait()
+                    state["buffer"].extend(payload)
+                    cond.notify_all()
+
+        producer = threading.Thread(target=produce)
+        start = time.perf_counter()
+        producer.start()
+        total = 0
+        while total < size:
+            data = bytearray()
+            with cond:
+                while len(data) < call_size and total + len(data) < size:
+                    if state["buffer"]:
+                        needed = call_size - len(data)
+                        data.extend(state["buffer"][:needed])
+                        state["buffer"] = state["buffer"][needed:]
+                        cond.notify_all()
+                    else:
+                        cond.wait()
+            total += len(data)
+        elapsed = time.perf_counter() - start
+        producer.join()
+        return elapsed
+
+    def server_read(server, call_size, into):
+        conn = Connection(('127.0.0.1', 0), RTTEstimator(*server.rto_bounds))
+        conn.data_buffer = ReceiveBuffer(buffer_size)
+
+        def produce():
+            for _ in range(segments):
+                with conn.cond:
+                    while not conn.data_buffer.write(payload):
+                        conn.cond.wait()
+                    conn.nextseqnum += 1
+                    conn.cond.notify_all()
+            with conn.cond:
+                conn.fin_reached = True
+                conn.cond.notify_all()
+
+        buffer = bytearray(call_size)
+        producer = threading.Thread(target=produce)
+        start = time.perf_counter()
+        producer.start()
+        total = 0
+        while total < size:
+            if into:
+                received = server.receive_into(conn, buffer)
+            else:
+                received = len(server.receive(conn, call_size))
+            if not received:
+                break
+            total += received
+        elapsed = time.perf_counter() - start
+        producer.join()
+        return elapsed
+
+    results = {}
+    server = Server()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        # one log line per call would measure the log, not the buffer
+        server.init(port, buffer_size, log_level="off")
+        for call_size in call_sizes:
+            results[("slice-copy", call_size)] = size / slice_copy(call_size) / 1e6
+            results[("receive", call_size)] = size / server_read(server, call_size, False) / 1e6
+            results[("receive_into", call_size)] = size / server_read(server, call_size, True) / 1e6
+        server.close()
+    return results
+
+
+def ops_per_second(operation, duration):
+    """
+    call operation repeatedly for about duration seconds
+
+    returns:
+    float -- calls per second
+    """
+    calls = 0
+    start = time.perf_counter()
+    while True:
+        for _ in range(1000):
+            operation()
+        calls += 1000
+        elapsed = time.perf_counter() - start
+        if elapsed >= duration:
+            return calls / elapsed
+
+
+def bench_segment(payload_sizes, duration, version=2):
+    """
+    encode and decode ops/s of Segment: create_seg() (a new bytes object per
+    segment), encode_into() (a reused buffer) and parse_seg() (with checksum check)
+
+    arguments:
+    payload_sizes -- the payload sizes to measure
+    duration -- seconds spent on each operation and size
+    version -- the header version
+
+    returns:
+    dict -- ops/s per (operation, payload size)
+    """
+    results = {}
+    for size in payload_sizes:
+        payload = os.urandom(size)
+        buffer = memoryview(bytearray(Segment.header_size(version) + size))
+        segment = Segment.create_seg(7, 0, 64, d_flag=True, payload=payload, version=version)
+        operations = {
+            "create_seg": lambda: Segment.create_seg(7, 0, 64, d_flag=True, payload=payload, version=version),
+            "encode_into": lambda: Segment.encode_into(buffer, 7, 0, 64, d_flag=True, payload=payload,
+                                                      version=version),
+            "parse_seg": lambda: Segment.parse_seg(segment),
+        }
+        for name, operation in operations.items():
+            results[(name, size)] = ops_per_second(operation, duration)
+    return results
+
+
+def bench_checksum(payload_sizes, gigabytes, version=2):
+    """
+    CPU seconds per GB of payload of encode_into() and parse_seg() for DATA
+    segments with every checksum algorithm of Segment.CHECKSUMS, and the
+    CPU time of parsing a header-only ACK
+
+    arguments:
+    payload_sizes -- the payload sizes to measure
+    gigabytes -- the GB of payload encoded and parsed per algorithm and size
+    version -- the header version
+
+    returns:
+    dict -- algorithm to a dict of payload size to {"encode": s/GB, "parse": s/GB},
+            and "ack" to the ns per ACK parse
+    """
+    results = {}
+    for checksum in Segment.CHECKSUMS:
+        results[checksum] = {}
+        for size in payload_sizes:
+            payload = os.urandom(size)
+            buffer = memoryview(bytearray(Segment.header_size(version) + size))
+            segment = Segment.create_seg(7, 0, 64, d_flag=True, payload=payload, version=version, checksum=checksum)
+            count = max(int(gigabytes * 1e9 / size), 1)
+            start = time.process_time()
+            for _ in range(count):
+                Segment.encode_into(buffer, 7, 0, 64, d_flag=True, payload=payload, version=version,
+                                    checksum=checksum)
+            encode = time.process_time() - start
+            start = time.process_time()
+            for _ in range(count):
+                Segment.parse_seg(segment, checksum)
+            parse = time.process_time() - start
+            scale = 1e9 / (count * size)
+            results[checksum][size] = {"encode": encode * scale, "parse": parse * scale}
+        # ACKs arrive in the client's receive buffer, parsed through a memoryview of it
+        ack = bytearray(Segment.create_seg(0, 7, 64, a_flag=True, version=version, checksum=checksum))
+        view = memoryview(ack)
+        count = 200000
+        start = time.process_time()
+        for _ in range(count):
+            Segment.parse_seg(view, checksum)
+        results[checksum]["ack"] = (time.process_time() - start) / count * 1e9
+    return results
+
+
+def bench_batch(segment_size, burst, duration, port):
+    """
+    packets/s of BatchSocket with batching on (sendmmsg()/recvmmsg()) and off
+    (one sendto()/recvfrom() per datagram); sending fills every slot per call,
+    receiving drains bursts of datagrams queued on the socket beforehand
+
+    arguments:
+    segment_size -- the datagram size
+    burst -- datagrams queued before each timed drain
+    duration -- seconds spent on each measurement
+    port -- the receiving port, the sender binds port + 1
+
+    returns:
+    dict -- packets/s per (direction, batched)
+    """
+    results = {}
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 8 << 20)
+    receiver.bind(("127.0.0.1", port))
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sender.bind(("127.0.0.1", port + 1))
+    datagram = os.urandom(segment_size)
+    for batched in (True, False):
+        batch_sender = BatchSocket(sender, batched, segment_size)
+        lengths = [segment_size] * batch_sender.max_batch
+        # nobody reads the receiver while sending, loopback drops what does not fit
+        sent = 0
+        start = time.perf_counter()
+        while time.perf_counter() - start < duration:
+            batch_sender.send_slots(lengths, ("127.0.0.1", port))
+            sent += len(lengths)
+        results[("send", batched)] = sent / (time.perf_counter() - start)
+        while BatchSocket(receiver, False).recvmany():
+            pass
+
+        batch_receiver = BatchSocket(receiver, batched)
+        received = 0
+        elapsed = 0.0
+        while elapsed < duration:
+            for _ in range(burst):
+                sender.sendto(datagram, ("127.0.0.1", port))
+            start = time.perf_counter()
+            received += len(batch_receiver.recvmany())
+            elapsed += time.perf_counter() - start
+        results[("receive", batched)] = received / elapsed
+    sender.close()
+    receiver.close()
+    return results
+
+
+def bench_network(bit_errors, packet_size, window, duration, seed, port):
+    """
+    packets/s forwarded by network.py at several bit error rates (no loss),
+    and the packets/s of the former bit error loop (a random number per bit)
+    at the same rates, CPU only
+
+    a client socket keeps `window` packets in flight through the forwarder
+    to a server socket, sending one more for each that arrives
+
+    arguments:
+    bit_errors -- the bit error rates to measure
+    packet_size -- the datagram size
+    window -- the packets kept in flight
+    duration -- seconds spent on each rate
+    seed -- the seed of the forwarder's random number generator
+    port -- the forwarder port, the client uses port + 1 and the server port + 2
+
+    returns:
+    dict -- packets/s per (implementation, bit error rate)
+    """
+    import network
+
+    def former_flip_bits(d, bit_error):
+        for i in range(len(d)):
+            for j in range(8):
+                if random.random() <= bit_error:
+                    d[i] = d[i] ^ (1 << j)
+
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    client.bind(('127.0.0.1', port + 1))
+    server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server.bind(('127.0.0.1', port + 2))
+    server.settimeout(2.0)
+    network.setSeed(seed)
+    net_socket = network.createSocket(port)
+    stop = threading.Event()
+    forwarder = threading.Thread(target=network.handleMessage,
+                                 args=(net_socket, ('127.0.0.1', port + 1), ('127.0.0.1', port + 2),
+                                       time.time() - 1, stop), daemon=True)
+    forwarder.start()
+
+    results = {}
+    packet = os.urandom(packet_size)
+    loss_file = os.path.abspath('network_bench_loss.txt')
+    for bit_error in bit_errors:
+        with open(loss_file, 'w') as f:
+            f.write(f"0 0 {bit_error}\n")
+        network.loss.clear()
+        network.setUpLoss(loss_file)
+
+        for _ in range(window):
+            client.sendto(packet, ('127.0.0.1', port))
+        forwarded = 0
+        start = time.perf_counter()
+        while time.perf_counter() - start < duration:
+            server.recvfrom(65535)
+            forwarded += 1
+            client.sendto(packet, ('127.0.0.1', port))
+        results[("network.py", bit_error)] = forwarded / (time.perf_counter() - start)
+        for _ in range(window):
+            server.recvfrom(65535)
+
+        buffer = bytearray(packet)
+        results[("former", bit_error)] = ops_per_second(lambda: former_flip_bits(buffer, bit_error),
+                                                        duration)
+    network.stopForwarder(net_socket, stop, forwarder)
+    client.close()
+    server.close()
+    return results
+
+
+def schedule_file(schedule, directory):
+    """
+    return the loss file of a suite schedule, None for plain loopback
+
+    arguments:
+    schedule -- "none", "loss:bitError" for a constant schedule, or the path of a loss file
+    directory -- where to write the loss file of a constant schedule, a temporary directory of the caller
+    """
+    if schedule == "none":
+        return None
+    if ":" in schedule and not os.path.exists(schedule):
+        pkt_loss, bit_error = (float(value) for value in schedule.split(":"))
+        path = os.path.join(directory, f"schedule_{pkt_loss:g}_{bit_error:g}.txt")
+        with open(path, "w") as f:
+            f.write(f"0 {pkt_loss} {bit_error}\n")
+        return path
+    return schedule
+
+
+def bench_suite(sizes, segment_sizes, buffer_sizes, schedules, runs, seed, port):
+    """
+    sweep transfers over payload size, segment size, receive buffer size and
+    loss schedule; run i of every case seeds the forwarder with seed + i
+
+    arguments:
+    sizes -- the transfer sizes in bytes
+    segment_sizes -- the client segment sizes (including the header)
+    buffer_sizes -- the server receive buffer sizes
+    schedules -- see schedule_file()
+    runs -- the transfers per case
+    seed -- the seed of the first run
+    port -- the first port, every transfer uses three ports from there
+
+    returns:
+    list -- one dict per case: its parameters, the median goodput (bytes/s) and
+            completion time (s), the retransmission ratio (segments resent per
+            segment of data), the p50/p99 ACK latency (ms, DATA sent to its
+            ACK, all runs pooled), whether every transfer was intact, and the
+            goodput of each run
+    """
+    cases = []
+    with tempfile.TemporaryDirectory(prefix="mrt_loss_") as directory:
+        for schedule in schedules:
+            loss_file = schedule_file(schedule, directory)
+            for size in sizes:
+                for segment_size in segment_sizes:
+                    for buffer_size in buffer_sizes:
+                        transfers = []
+                        for i in range(runs):
+                            transfers.append(run_transfer(size, segment_size, buffer_size, port, loss_file,
+                                                          seed=seed + i))
+                            port += 3
+                        segments = math.ceil(size / (segment_size - Segment.header_size(2))) * runs
+                        resent = 0
+                        latencies = []
+                        for run in transfers:
+                            counts = run["client"].retransmit_stats()
+                            resent += counts["fast"] + counts["timeout"] + counts["probes"]
+                            latencies.extend(run["client"].rtt.history)
+                        cases.append({
+                            "size": size, "segment_size": segment_size, "buffer_size": buffer_size,
+                            "schedule": schedule, "runs": runs,
+                            "goodput": statistics.median(run["goodput"] for run in transfers),
+                            "completion": statistics.median(run["elapsed"] for run in transfers),
+                            "retransmit_ratio": resent / segments,
+                            "ack_p50_ms": percentile(latencies, 50) * 1000 if latencies else None,
+                            "ack_p99_ms": percentile(latencies, 99) * 1000 if latencies else None,
+                            "ok": all(run["ok"] for run in transfers),
+                            "goodput_runs": [run["goodput"] for run in transfers],
+                        })
+    return cases
+
+
+def suite_metadata():
+    """
+    return where and when a suite ran: time, commit, Python and platform
+    """
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {"created": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+            "commit": commit, "python": platform.python_version(), "platform": platform.platform()}
+
+
+def compare_suites(base, new, threshold):
+    """
+    compare the cases two suite runs have in common
+
+    arguments:
+    base, new -- the loaded JSON of two suite runs
+    threshold -- the relative goodput drop counted as a regression, e.g. 0.1
+
+    returns:
+    list -- (case key, base case, new case, relative goodput change, regressed) per common case
+    """
+    def key(case):
+        return case["size"], case["segment_size"], case["buffer_size"], case["schedule"]
+
+    base_cases = {key(case): case for case in base["cases"]}
+    rows = []
+    for case in new["cases"]:
+        old = base_cases.get(key(case))
+        if old is None:
+            continue
+        change = case["goodput"] / old["goodput"] - 1
+        rows.append((key(case), old, case, change, change < -threshold or not case["ok"]))
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+                    prog='benchmark.py',
+                    description='benchmark.py runs loopback benchmarks of the MRT implementation.')
+    sub = parser.add_subparsers(dest='bench', required=True)
+
+    send_parser = sub.add_parser('send', help='segments/s of Client.send() against an immediate ACK responder')
+    send_parser.add_argument('--segments', type=int, default=200)
+    send_parser.add_argument('--segment-size', type=int, default=1460)
+    send_parser.add_argument('--window', type=int, default=64)
+    send_parser.add_argument('--client-port', type=int, default=50100)
+    send_parser.add_argument('--peer-port', type=int, default=50101)
+    send_parser.add_argument('--header-version', type=int, choices=(1, 2), default=2)
+    send_parser.add_argument('--log-level', type=str, choices=('debug', 'info', 'off'), default='debug')
+
+    retransmit_parser = sub.add_parser('retransmit', help='CPU time per MB of Go-Back-N window retransmissions')
+    retransmit_parser.add_argument('--rounds', type=int, default=2000)
+    retransmit_parser.add_argument('--segment-size', type=int, default=1460)
+    retransmit_parser.add_argument('--window', type=int, default=64)
+    retransmit_parser.add_argument('--client-port', type=int, default=50104)
+    retransmit_parser.add_argument('--peer-port', type=int, default=50105)
+    retransmit_parser.add_argument('--header-version', type=int, choices=(1, 2), default=2)
+
+    receive_parser = sub.add_parser('receive', help='ACK latency and datagrams/s of the server receive pipeline')
+    receive_parser.add_argument('--segments', type=int, default=100)
+    receive_parser.add_argument('--segment-size', type=int, default=1460)
+    receive_parser.add_argument('--window', type=int, default=32)
+    receive_parser.add_argument('--server-port', type=int, default=50102)
+    receive_parser.add_argument('--peer-port', type=int, default=50103)
+    receive_parser.add_argument('--header-version', type=int, choices=(1, 2), default=2)
+    receive_parser.add_argument('--log-level', type=str, choices=('debug', 'info', 'off'), default='debug')
+
+    goodput_parser = sub.add_parser('goodput', help='goodput of Go-Back-N vs Selective Repeat through network.py')
+    goodput_parser.add_argument('--size', type=int, default=5000)
+    goodput_parser.add_argument('--segment-size', type=int, default=48)
+    goodput_parser.add_argument('--buffer-size', type=int, default=2048)
+    goodput_parser.add_argument('--loss-file', type=str, default=os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'loss_example.txt'))
+    goodput_parser.add_argument('--runs', type=int, default=3)
+    goodput_parser.add_argument('--port', type=int, default=50110)
+
+    recovery_parser = sub.add_parser('recovery', help='transfer time with and without fast retransmit through network.py')
+    recovery_parser.add_argument('--size', type=int, default=5000)
+    recovery_parser.add_argument('--segment-size', type=int, default=48)
+    recovery_parser.add_argument('--buffer-size', type=int, default=2048)
+    recovery_parser.add_argument('--loss-file', type=str, default=os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'loss_example.txt'))
+    recovery_parser.add_argument('--runs', type=int, default=3)
+    recovery_parser.add_argument('--port', type=int, default=50150)
+
+    congestion_parser = sub.add_parser('congestion', help='goodput and retransmissions of the congestion controllers')
+    congestion_parser.add_argument('--size', type=int, default=5000000)
+    congestion_parser.add_argument('--segment-size', type=int, default=1400)
+    congestion_parser.add_argument('--buffer-size', type=int, default=2000000)
+    congestion_parser.add_argument('--loss-file', type=str, default=None)
+    congestion_parser.add_argument('--runs', type=int, default=3)
+    congestion_parser.add_argument('--port', type=int, default=50190)
+    congestion_parser.add_argument('--trace', type=str, default=None, help='write the cwnd traces to this CSV file')
+
+    pacing_parser = sub.add_parser('pacing', help='goodput and retransmissions with and without pacing through a bottleneck')
+    pacing_parser.add_argument('--size', type=int, default=2000000)
+    pacing_parser.add_argument('--segment-size', type=int, default=1400)
+    pacing_parser.add_argument('--buffer-size', type=int, default=200000)
+    pacing_parser.add_argument('--loss-file', type=str, default=os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bottleneck_example.txt'))
+    pacing_parser.add_argument('--congestion', type=str, default='reno', choices=sorted(CONTROLLERS))
+    pacing_parser.add_argument('--runs', type=int, default=5)
+    pacing_parser.add_argument('--port', type=int, default=50250)
+
+    sizing_parser = sub.add_parser('sizing', help='goodput vs bit error rate of fixed and adaptive segment sizes')
+    sizing_parser.add_argument('--size', type=int, default=500000)
+    sizing_parser.add_argument('--buffer-size', type=int, default=200000)
+    sizing_parser.add_argument('--bit-errors', type=float, nargs='+', default=[0, 0.00001, 0.00003, 0.0001])
+    sizing_parser.add_argument('--segment-sizes', type=int, nargs='+', default=[256, 512, 1460])
+    sizing_parser.add_argument('--ceiling', type=int, default=8972)
+    sizing_parser.add_argument('--runs', type=int, default=3)
+    sizing_parser.add_argument('--seed', type=int, default=1)
+    sizing_parser.add_argument('--port', type=int, default=50270)
+
+    fec_parser = sub.add_parser('fec', help='completion time of Go-Back-N with and without FEC parity over a delayed lossy link')
+    fec_parser.add_argument('--size', type=int, default=5000)
+    fec_parser.add_argument('--segment-size', type=int, default=48)
+    fec_parser.add_argument('--buffer-size', type=int, default=2048)
+    fec_parser.add_argument('--loss-file', type=str, default=os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'loss_example.txt'))
+    fec_parser.add_argument('--delay', type=float, default=100, help='one-way delay added to every period, in ms')
+    fec_parser.add_argument('--fec', type=str, nargs='+', default=['4:1', '4:2', '8:4'], help='k:m of each FEC mode')
+    fec_parser.add_argument('--runs', type=int, default=3)
+    fec_parser.add_argument('--port', type=int, default=50290)
+
+    acks_parser = sub.add_parser('acks', help='ACKs per DATA segment and server CPU per GB with delayed ACKs')
+    acks_parser.add_argument('--size', type=int, default=100000000)
+    acks_parser.add_argument('--segment-size', type=int, default=1400)
+    acks_parser.add_argument('--buffer-size', type=int, default=2000000)
+    acks_parser.add_argument('--ack-every', type=int, nargs='+', default=[1, 2, 4])
+    acks_parser.add_argument('--runs', type=int, default=3)
+    acks_parser.add_argument('--port', type=int, default=50240)
+
+    connections_parser = sub.add_parser('connections', help='aggregate goodput of many concurrent clients on one server port')
+    connections_parser.add_argument('--clients', type=int, default=200)
+    connections_parser.add_argument('--size', type=int, default=100000)
+    connections_parser.add_argument('--segment-size', type=int, default=1400)
+    connections_parser.add_argument('--buffer-size', type=int, default=65536)
+    connections_parser.add_argument('--backlog', type=int, default=64)
+    connections_parser.add_argument('--port', type=int, default=50200)
+
+    async_parser = sub.add_parser('async', help='aggregate goodput of many asyncio clients and one asyncio server')
+    async_parser.add_argument('--clients', type=int, default=2000)
+    async_parser.add_argument('--size', type=int, default=20000)
+    async_parser.add_argument('--segment-size', type=int, default=1400)
+    async_parser.add_argument('--buffer-size', type=int, default=65536)
+    async_parser.add_argument('--port', type=int, default=50210)
+
+    buffer_parser = sub.add_parser('buffer', help='MB/s of Server.receive()/receive_into() vs the former slice-and-copy buffer')
+    buffer_parser.add_argument('--size', type=int, default=1 << 30)
+    buffer_parser.add_argument('--call-sizes', type=int, nargs='+', default=[4096, 1 << 20])
+    buffer_parser.add_argument('--segment-size', type=int, default=1452)
+    buffer_parser.add_argument('--buffer-size', type=int, default=4 << 20)
+    buffer_parser.add_argument('--port', type=int, default=50220)
+
+    segment_parser = sub.add_parser('segment', help='encode/decode ops/s of Segment at several payload sizes')
+    segment_parser.add_argument('--payload-sizes', type=int, nargs='+', default=[64, 1460, 65536])
+    segment_parser.add_argument('--duration', type=float, default=1.0)
+    segment_parser.add_argument('--header-version', type=int, choices=[1, 2], default=2)
+
+    checksum_parser = sub.add_parser('checksum', help='CPU per GB of encoding and parsing with each checksum algorithm')
+    checksum_parser.add_argument('--payload-sizes', type=int, nargs='+', default=[64, 1460, 8192])
+    checksum_parser.add_argument('--gigabytes', type=float, default=0.25)
+    checksum_parser.add_argument('--header-version', type=int, choices=[1, 2], default=2)
+
+    batch_parser = sub.add_parser('batch', help='packets/s of batched (sendmmsg/recvmmsg) vs per-datagram socket I/O')
+    batch_parser.add_argument('--segment-size', type=int, default=1452)
+    batch_parser.add_argument('--burst', type=int, default=1000)
+    batch_parser.add_argument('--duration', type=float, default=1.0)
+    batch_parser.add_argument('--port', type=int, default=50230)
+
+    network_parser = sub.add_parser('network', help='packets/s forwarded by network.py at several bit error rates')
+    network_parser.add_argument('--bit-errors', type=float, nargs='+', default=[0, 0.0001, 0.001, 0.01])
+    network_parser.add_argument('--packet-size', type=int, default=1460)
+    network_parser.add_argument('--window', type=int, default=32)
+    network_parser.add_argument('--duration', type=float, default=1.0)
+    network_parser.add_argument('--seed', type=int, default=1)
+    network_parser.add_argument('--port', type=int, default=50500)
+
+    suite_parser = sub.add_parser('suite', help='sweep of transfers through network.py, results as JSON')
+    suite_parser.add_argument('--sizes', type=int, nargs='+', default=[1000000])
+    suite_parser.add_argument('--segment-sizes', type=int, nargs='+', default=[1460])
+    suite_parser.add_argument('--buffer-sizes', type=int, nargs='+', default=[65536])
+    suite_parser.add_argument('--schedules', type=str, nargs='+', default=['none', '0.01:0.000001'],
+                              help='"none" (plain loopback), "loss:bitError", or a loss file')
+    suite_parser.add_argument('--runs', type=int, default=3)
+    suite_parser.add_argument('--seed', type=int, default=1)
+    suite_parser.add_argument('--out', type=str, default='suite.json')
+    suite_parser.add_argument('--port', type=int, default=50300)
+
+    compare_parser = sub.add_parser('compare', help='goodput change between two suite results, fails on a regression')
+    compare_parser.add_argument('base', type=str)
+    compare_parser.add_argument('new', type=str)
+    compare_parser.add_argument('--threshold', type=float, default=0.1)
+
+    args = parser.parse_args()
+    # every path is resolved before the benchmark changes into its temporary directory
+    if getattr(args, 'loss_file', None):
+        args.loss_file = os.path.abspath(args.loss_file)
+    if args.bench == 'congestion' and args.trace:
+        args.trace = os.path.abspath(args.trace)
+    if args.bench == 'suite':
+        args.out = os.path.abspath(args.out)
+        args.schedules = [os.path.abspath(schedule) if os.path.exists(schedule) else schedule
+                          for schedule in args.schedules]
+    if args.bench == 'compare':
+        with open(args.base) as base_file, open(args.new) as new_file:
+            rows = compare_suites(json.load(base_file), json.load(new_file), args.threshold)
+        for (size, segment_size, buffer_size, schedule), old, case, change, regressed in rows:
+            print(f"{size} B, segment {segment_size}, buffer {buffer_size}, {os.path.basename(schedule)}: "
+                  f"{old['goodput'] / 1e6:.2f} -> {case['goodput'] / 1e6:.2f} MB/s ({change:+.1%}), "
+                  f"completion {old['completion']:.2f} -> {case['completion']:.2f}s, "
+                  f"retransmit ratio {old['retransmit_ratio']:.3f} -> {case['retransmit_ratio']:.3f}"
+                  f"{'  REGRESSION' if regressed else ''}")
+        sys.exit(1 if any(row[4] for row in rows) else 0)
+
+    # log files are written to the working directory, keep them out of the tree
+    os.chdir(tempfile.mkdtemp(prefix='mrt_bench_'))
+
+    if args.bench == 'send':
+        result = bench_send(args.segments, args.segment_size, args.window, args.client_port, args.peer_port,
+                            args.header_version, args.log_level)
+        print(f"send: {result['segments']} segments in {result['elapsed']:.3f}s "
+              f"-> {result['segments_per_s']:.1f} segments/s")
+    elif args.bench == 'retransmit':
+        result = bench_retransmit(args.rounds, args.segment_size, args.window, args.client_port, args.peer_port,
+                                  args.header_version)
+        print(f"retransmit: {result['mb']:.1f} MB resent with {result['cpu']:.3f}s CPU "
+              f"-> {result['cpu_ms_per_mb']:.2f} ms CPU per MB")
+    elif args.bench == 'receive':
+        result = bench_receive(args.segments, args.segment_size, args.window, args.server_port, args.peer_port,
+                               args.header_version, args.log_level)
+        print(f"receive: ACK latency p50 {result['ack_latency_p50_ms']:.2f} ms, "
+              f"p99 {result['ack_latency_p99_ms']:.2f} ms, "
+              f"{result['datagrams_per_s']:.1f} datagrams/s")
+    elif args.bench == 'goodput':
+        results = bench_goodput(args.size, args.segment_size, args.buffer_size, args.loss_file,
+                                args.runs, args.port)
+        for mode, runs in results.items():
+            goodputs = [run["goodput"] for run in runs]
+            print(f"goodput {mode}: median {statistics.median(goodputs) / 1000:.1f} KB/s "
+                  f"over {len(goodputs)} runs ({', '.join(f'{g / 1000:.1f}' for g in goodputs)})")
+    elif args.bench == 'recovery':
+        results = bench_recovery(args.size, args.segment_size, args.buffer_size, args.loss_file,
+                                 args.runs, args.port)
+        for mode, runs in results.items():
+            stats = [run["client"].retransmit_stats() for run in runs]
+            print(f"recovery {mode}: median {statistics.median(run['elapsed'] for run in runs):.2f}s, "
+                  f"{sum(s['fast'] for s in stats) / len(stats):.1f} fast and "
+                  f"{sum(s['timeout'] for s in stats) / len(stats):.1f} timeout retransmits per transfer")
+    elif args.bench == 'congestion':
+        results = bench_congestion(args.size, args.segment_size, args.buffer_size, args.loss_file,
+                                   args.runs, args.port)
+        for mode, runs in results.items():
+            stats = [run["client"].retransmit_stats() for run in runs]
+            print(f"congestion {mode}: median {statistics.median(run['goodput'] for run in runs) / 1e6:.2f} MB/s, "
+                  f"{sum(s['fast'] + s['timeout'] for s in stats) / len(stats):.1f} retransmits per transfer")
+        if args.trace:
+            with open(args.trace, "w") as trace_file:
+                trace_file.write("mode,run,time,cwnd,ssthresh\n")
+                for mode, runs in results.items():
+                    for i, run in enumerate(runs):
+                        for t, cwnd, ssthresh in run["client"].cwnd_trace():
+                            trace_file.write(f"{mode},{i},{t:.6f},{cwnd:.3f},{ssthresh:.3f}\n")
+    elif args.bench == 'pacing':
+        results = bench_pacing(args.size, args.segment_size, args.buffer_size, args.loss_file, args.congestion,
+                               args.runs, args.port)
+        for mode, runs in results.items():
+            stats = [run["client"].stats()["counters"] for run in runs]
+            ratio = sum(s["segments_retransmitted"] for s in stats) / sum(s["segments_sent"] for s in stats)
+            print(f"pacing {mode}: median {statistics.median(run['goodput'] for run in runs) / 1e6:.2f} MB/s, "
+                  f"{sum(s['segments_retransmitted'] for s in stats) / len(stats):.1f} retransmits per transfer, "
+                  f"retransmit ratio {ratio:.3f}")
+    elif args.bench == 'sizing':
+        results = bench_sizing(args.size, args.buffer_size, args.bit_errors, args.segment_sizes, args.ceiling,
+                               args.runs, args.seed, args.port)
+        for bit_error, modes in results.items():
+            line = ", ".join(f"{mode} {statistics.median(run['goodput'] for run in runs) / 1000:.1f}"
+                             for mode, runs in modes.items())
+            sizes = sorted(run["client"].stats()["gauges"]["segment_size"] for run in modes["adaptive"])
+            print(f"sizing BER {bit_error:g}: {line} KB/s (adaptive ended at {', '.join(map(str, sizes))} bytes)")
+    elif args.bench == 'fec':
+        fec_settings = [tuple(int(value) for value in setting.split(":")) for setting in args.fec]
+        results = bench_fec(args.size, args.segment_size, args.buffer_size, args.loss_file, args.delay,
+                            fec_settings, args.runs, args.port)
+        for mode, runs in results.items():
+            stats = [run["client"].stats()["counters"] for run in runs]
+            rebuilt = [run["server_stats"]["counters"]["fec_recovered"] for run in runs]
+            print(f"fec {mode}: median {statistics.median(run['elapsed'] for run in runs):.2f}s, "
+                  f"{statistics.median(run['goodput'] for run in runs) / 1000:.2f} KB/s, "
+                  f"{sum(s['segments_retransmitted'] for s in stats) / len(stats):.1f} retransmits, "
+                  f"{sum(s['parity_sent'] for s in stats) / len(stats):.1f} parity segments and "
+                  f"{sum(rebuilt) / len(rebuilt):.1f} segments rebuilt per transfer")
+    elif args.bench == 'acks':
+        results = bench_acks(args.size, args.segment_size, args.buffer_size, args.ack_every, args.runs, args.port)
+        for ack_every, runs in results.items():
+            segments = sum(run["acks"]["segments"] for run in runs)
+            acks = sum(run["acks"]["acks"] for run in runs)
+            delayed = sum(run["acks"]["delayed"] for run in runs)
+            print(f"acks every {ack_every}: {acks / segments:.3f} ACKs per segment ({delayed} by timer), "
+                  f"median {statistics.median(run['goodput'] for run in runs) / 1e6:.2f} MB/s, "
+                  f"server CPU {statistics.median(run['server_cpu'] / args.size * 1e9 for run in runs):.1f} s/GB")
+    elif args.bench == 'connections':
+        result = bench_connections(args.clients, args.size, args.segment_size, args.buffer_size, args.backlog,
+                                   args.port)
+        print(f"connections: {args.clients} clients x {args.size} bytes in {result['elapsed']:.2f}s "
+              f"-> {result['goodput'] / 1e6:.2f} MB/s aggregate, {result['intact']}/{args.clients} intact, "
+              f"connect p50 {result['connect_p50_ms']:.1f} ms, p99 {result['connect_p99_ms']:.1f} ms")
+    elif args.bench == 'async':
+        result = bench_async(args.clients, args.size, args.segment_size, args.buffer_size, args.port)
+        print(f"async: {args.clients} clients x {args.size} bytes in {result['elapsed']:.2f}s "
+              f"-> {result['goodput'] / 1e6:.2f} MB/s aggregate, {result['intact']}/{args.clients} intact, "
+              f"connect p50 {result['connect_p50_ms']:.1f} ms, p99 {result['connect_p99_ms']:.1f} ms, "
+              f"{result['threads']} thread(s)")
+    elif args.bench == 'buffer':
+        results = bench_buffer(args.size, args.call_sizes, args.segment_size, args.buffer_size, args.port)
+        for (method, call_size), mb_per_s in results.items():
+            print(f"buffer {method} in {call_size} byte calls: {mb_per_s:.1f} MB/s")
+    elif args.bench == 'segment':
+        results = bench_segment(args.payload_sizes, args.duration, args.header_version)
+        for (operation, size), ops in results.items():
+            print(f"segment {operation} {size} byte payload: {ops:,.0f} ops/s")
+    elif args.bench == 'checksum':
+        results = bench_checksum(args.payload_sizes, args.gigabytes, args.header_version)
+        for checksum, sizes in results.items():
+            line = ", ".join(f"{size} bytes {cpu['encode']:.2f}/{cpu['parse']:.2f}"
+                             for size, cpu in sizes.items() if size != "ack")
+            print(f"checksum {checksum}: encode/parse CPU s per GB {line}; ACK parse {sizes['ack']:.0f} ns")
+    elif args.bench == 'batch':
+        results = bench_batch(args.segment_size, args.burst, args.duration, args.port)
+        for (direction, batched), packets in results.items():
+            print(f"batch {direction} {'sendmmsg/recvmmsg' if batched else 'per datagram'}: "
+                  f"{packets:,.0f} packets/s")
+    elif args.bench == 'suite':
+        cases = bench_suite(args.sizes, args.segment_sizes, args.buffer_sizes, args.schedules, args.runs,
+                            args.seed, args.port)
+        with open(args.out, "w") as out:
+            json.dump({"metadata": suite_metadata(), "cases": cases}, out, indent=2)
+        for case in cases:
+            latency = (f"ACK latency p50 {case['ack_p50_ms']:.2f} ms, p99 {case['ack_p99_ms']:.2f} ms"
+                       if case["ack_p50_ms"] is not None else "no ACK latency samples")
+            print(f"suite {case['size']} B, segment {case['segment_size']}, buffer {case['buffer_size']}, "
+                  f"{os.path.basename(case['schedule'])}: {case['goodput'] / 1e6:.2f} MB/s, "
+                  f"{case['completion']:.2f}s, retransmit ratio {case['retransmit_ratio']:.3f}, {latency}"
+                  f"{'' if case['ok'] else ', DATA CORRUPTED'}")
+        print(f"results written to {args.out}")
+    elif args.bench == 'network':
+        results = bench_network(args.bit_errors, args.packet_size, args.window, args.duration, args.seed, args.port)
+        for (implementation, bit_error), packets in results.items():
+            print(f"network {implementation} bit error {bit_error:g}: {packets:,.0f} packets/s")
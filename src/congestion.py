@@ -0,0 +1,187 @@
+#
+# Mini Reliable Transport - Congestion Control
+# Congestion window controllers for the client sender
+#
+# The client sends at most min(N, cwnd) unacknowledged segments, where N is
+# the window advertised by the server and cwnd is kept by a controller. A
+# controller only sees ACKs, losses and timeouts, so a new algorithm is a
+# subclass of CongestionController registered in CONTROLLERS.
+#
+
+import time
+
+# slow start grows the window by at most this many segments per ACK (the L of
+# RFC 3465), so a cumulative ACK that jumps many segments, e.g. one that
+# follows a filled hole, does not release a burst twice its size
+ABC_LIMIT = 2
+
+
+class CongestionController:
+    """
+    base class of the congestion controllers, also the "none" controller
+
+    the window is counted in segments and never limits the sender here;
+    every change of the window is appended to the trace
+    """
+    name = "none"
+
+    def __init__(self, initial_cwnd=2, min_cwnd=1):
+        """
+        initialize the window
+
+        arguments:
+        initial_cwnd -- the window before any ACK, in segments
+        min_cwnd -- the window never drops below this many segments
+        """
+        self.start_time = time.monotonic()
+        self.min_cwnd = min_cwnd
+        self.cwnd = float("inf")
+        self.ssthresh = float("inf")
+        self.trace = []
+
+    def window(self):
+        """
+        return the number of unacknowledged segments the sender may have in flight
+        """
+        return self.cwnd
+
+    def record(self):
+        """
+        append the current window to the trace as (seconds since start, cwnd, ssthresh)
+        """
+        self.trace.append((time.monotonic() - self.start_time, self.cwnd, self.ssthresh))
+
+    def on_ack(self, acked, rtt=None):
+        """
+        new data was acknowledged
+
+        arguments:
+        acked -- the number of segments the ACK acknowledged for the first time
+        rtt -- the RTT sample of the ACK, None if it gave none
+        """
+        pass
+
+    def on_loss(self):
+        """
+        a loss was detected by duplicate ACKs, called once per fast recovery
+        """
+        pass
+
+    def on_timeout(self):
+        """
+        the retransmission timer expired
+        """
+        pass
+
+
+class Reno(CongestionController):
+    """
+    slow start, congestion avoidance (one segment per window per RTT) and
+    halving of the window on loss, in the style of RFC 5681
+    """
+    name = "reno"
+
+    def __init__(self, initial_cwnd=2, min_cwnd=1):
+        super().__init__(initial_cwnd, min_cwnd)
+        self.cwnd = float(initial_cwnd)
+        self.record()
+
+    def window(self):
+        return max(self.min_cwnd, int(self.cwnd))
+
+    def on_ack(self, acked, rtt=None):
+        if self.cwnd < self.ssthresh:
+            self.cwnd += min(acked, ABC_LIMIT)
+        else:
+            self.cwnd += acked / self.cwnd
+        self.record()
+
+    def on_loss(self):
+        self.ssthresh = max(self.cwnd / 2, 2)
+        self.cwnd = self.ssthresh
+        self.record()
+
+    def on_timeout(self):
+        self.ssthresh = max(self.cwnd / 2, 2)
+        self.cwnd = self.min_cwnd
+        self.record()
+
+
+class Cubic(Reno):
+    """
+    CUBIC window growth in the style of RFC 8312
+
+    after a loss the window follows C * (t - K)^3 + W_max, which is flat
+    around the window of the last loss and probes faster away from it; it
+    never grows slower than Reno would (TCP-friendly region)
+    """
+    name = "cubic"
+    C = 0.4
+    BETA = 0.7
+
+    def __init__(self, initial_cwnd=2, min_cwnd=1):
+        super().__init__(initial_cwnd, min_cwnd)
+        self.w_max = 0
+        self.k = 0
+        self.epoch_start = None
+        self.w_est = 0
+        self.srtt = None
+
+    def on_ack(self, acked, rtt=None):
+        if rtt is not None:
+            self.srtt = rtt if self.srtt is None else 0.875 * self.srtt + 0.125 * rtt
+        if self.cwnd < self.ssthresh:
+            self.cwnd += min(acked, ABC_LIMIT)
+            self.record()
+            return
+        now = time.monotonic()
+        if self.epoch_start is None:
+            # first congestion avoidance ACK after a loss (or after slow start)
+            self.epoch_start = now
+            self.w_max = max(self.w_max, self.cwnd)
+            self.k = ((self.w_max - self.cwnd) / self.C) ** (1 / 3)
+            self.w_est = self.cwnd
+        t = now - self.epoch_start + (self.srtt or 0)
+        target = self.C * (t - self.k) ** 3 + self.w_max
+        self.w_est += 3 * (1 - self.BETA) / (1 + self.BETA) * acked / self.cwnd
+        target = max(target, self.w_est)
+        if target > self.cwnd:
+            self.cwnd += (target - self.cwnd) / self.cwnd * acked
+        else:
+            self.cwnd += 0.01 * acked / self.cwnd
+        self.record()
+
+    def on_loss(self):
+        self.w_max = self.cwnd
+        self.epoch_start = None
+        self.ssthresh = max(self.cwnd * self.BETA, 2)
+        self.cwnd = self.ssthresh
+        self.record()
+
+    def on_timeout(self):
+        self.w_max = self.cwnd
+        self.epoch_start = None
+        self.ssthresh = max(self.cwnd * self.BETA, 2)
+        self.cwnd = self.min_cwnd
+        self.record()
+
+
+CONTROLLERS = {
+    CongestionController.name: CongestionController,
+    Reno.name: Reno,
+    Cubic.name: Cubic,
+}
+
+
+def create_controller(congestion):
+    """
+    return a controller for the client
+
+    arguments:
+    congestion -- a name in CONTROLLERS or a CongestionController instance
+    """
+    if isinstance(congestion, CongestionController):
+        return congestion
+    if congestion not in CONTROLLERS:
+        raise ValueError(f"unknown congestion controller {congestion!r}, expected one of {sorted(CONTROLLERS)}")
+    return CONTROLLERS[congestion]()
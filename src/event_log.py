@@ -0,0 +1,224 @@
+#
+# Mini Reliable Transport - Event Log
+# Structured, level-filtered logging of protocol events
+#
+# Writing log_<port>.txt used to format a timestamp and flush the file for
+# every line, on the thread handling the segment. An EventLog appends the
+# raw fields of an event to a bounded ring buffer instead, and one
+# background writer thread drains every open log in batches as JSON lines
+# (log_<port>.jsonl). Per-segment events are logged at DEBUG; callers
+# check EventLog.enabled(DEBUG) once and skip them entirely below it.
+#
+# Each line is a JSON array, positional to keep encoding cheap:
+#   [time, level, src_port, dst_port, seq, ack, type, length, extra]  a segment event
+#   [time, level, message]                                            a free text line
+#
+# usage: python event_log.py log_50000.jsonl [--level info] > log_50000.txt
+#
+
+import argparse
+import atexit
+import collections
+import datetime
+import json
+import sys
+import threading
+import time
+
+# per-segment events (DATA and ACKs sent and received)
+DEBUG = 10
+# handshake, teardown, retransmissions, drops and everything else
+INFO = 20
+# no log file at all
+OFF = 100
+LEVELS = {"debug": DEBUG, "info": INFO, "off": OFF}
+
+# events buffered per log; when the writer falls this far behind the oldest are dropped
+DEFAULT_CAPACITY = 1 << 16
+# seconds between two drains of the writer, it is woken earlier when a ring is half full
+FLUSH_INTERVAL = 0.2
+
+
+class EventLog:
+    """
+    ring buffer of the events of one endpoint, written to a JSON lines file
+    by the shared writer thread
+
+    event() and message() only append a tuple to a deque, which is safe
+    from any thread; formatting and file I/O happen in drain()
+    """
+    def __init__(self, path, level=DEBUG, capacity=DEFAULT_CAPACITY):
+        """
+        open the log
+
+        arguments:
+        path -- the JSON lines file, appended to
+        level -- the lowest level written, DEBUG, INFO or OFF (or their names)
+        capacity -- the most events buffered before the oldest are dropped
+        """
+        self.level = LEVELS[level] if isinstance(level, str) else level
+        self.path = path
+        self.ring = collections.deque(maxlen=capacity)
+        self.high_water = capacity // 2
+        self.dropped = 0
+        self.file = None
+        if self.level < OFF:
+            self.file = open(path, "a")
+            WRITER.add(self)
+
+    def enabled(self, level):
+        """
+        return whether events of a level are written
+        """
+        return level >= self.level
+
+    def event(self, level, src_port, dst_port, seq, ack, seg_type, payload_length, extra=""):
+        """
+        log a segment event, rendered as the fields of a log_<port>.txt line
+
+        arguments:
+        level -- DEBUG or INFO
+        src_port, dst_port, seq, ack, seg_type, payload_length, extra="" -- input info
+        """
+        if level < self.level:
+            return
+        self.append((time.time(), level, src_port, dst_port, seq, ack, seg_type, payload_length, extra))
+
+    def message(self, level, text):
+        """
+        log a line of free text
+
+        arguments:
+        level -- DEBUG or INFO
+        text -- the message
+        """
+        if level < self.level:
+            return
+        self.append((time.time(), level, text))
+
+    def append(self, record):
+        if len(self.ring) == self.ring.maxlen:
+            self.dropped += 1
+        self.ring.append(record)
+        if len(self.ring) >= self.high_water:
+            WRITER.wakeup.set()
+
+    def drain(self):
+        """
+        write every buffered event to the file in one write
+        called by the writer thread, and by close()
+        """
+        lines = []
+        while True:
+            try:
+                record = self.ring.popleft()
+            except IndexError:
+                break
+            lines.append(encode(record))
+        if self.dropped:
+            lines.append(encode((time.time(), INFO, f"event log dropped {self.dropped} events, writer behind")))
+            self.dropped = 0
+        if lines and self.file:
+            self.file.write("\n".join(lines) + "\n")
+            self.file.flush()
+
+    def close(self):
+        """
+        write what is buffered and close the file
+        """
+        if not self.file:
+            return
+        WRITER.remove(self)
+        with WRITER.lock:
+            self.drain()
+            self.file.close()
+            self.file = None
+
+
+# the handshake events log the SYN payload (bytes) as their length, written as its str()
+encode = json.JSONEncoder(separators=(",", ":"), default=str).encode
+
+
+class Writer:
+    """
+    the background thread draining every open EventLog, started with the first one
+    """
+    def __init__(self):
+        self.logs = set()
+        # held while a log is drained, so close() never races the thread on a file
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+
+    def add(self, log):
+        with self.lock:
+            self.logs.add(log)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+
+    def remove(self, log):
+        with self.lock:
+            self.logs.discard(log)
+
+    def run(self):
+        while True:
+            self.wakeup.wait(FLUSH_INTERVAL)
+            self.wakeup.clear()
+            self.drain_all()
+
+    def drain_all(self):
+        with self.lock:
+            for log in list(self.logs):
+                log.drain()
+
+
+WRITER = Writer()
+# the writer is a daemon thread, write what is still buffered when the interpreter exits
+atexit.register(WRITER.drain_all)
+
+
+def render(lines, level=DEBUG):
+    """
+    turn JSON lines of an event log back into the text layout of log_<port>.txt
+
+    arguments:
+    lines -- an iterable of JSON lines
+    level -- the lowest level rendered
+
+    returns:
+    generator -- the text lines, without newlines
+    """
+    for line in lines:
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        if record[1] < level:
+            continue
+        if len(record) == 3:
+            yield record[2]
+            continue
+        t, _, src_port, dst_port, seq, ack, seg_type, payload_length, extra = record
+        now = datetime.datetime.fromtimestamp(t, datetime.timezone.utc).strftime("%H:%M:%S.%f")[:-3]
+        log_line = f"{now} {src_port} {dst_port} {seq} {ack} {seg_type} {payload_length}"
+        if extra:
+            log_line += f' "{extra}"'
+        yield log_line
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+                    prog='event_log.py',
+                    description='event_log.py renders MRT event logs (log_<port>.jsonl) in the text log layout.')
+    parser.add_argument('logs', type=str, nargs='+')
+    parser.add_argument('--level', type=str, choices=['debug', 'info'], default='debug')
+    args = parser.parse_args()
+
+    try:
+        for path in args.logs:
+            with open(path) as log_file:
+                for text in render(log_file, LEVELS[args.level]):
+                    sys.stdout.write(text + "\n")
+    except BrokenPipeError:
+        # piped into head or similar
+        sys.stderr.close()
@@ -0,0 +1,290 @@
+#
+# Mini Reliable Transport - Forward Error Correction
+# Parity segments over groups of DATA segments, and the receiver's
+# reconstruction of the segments a group lost
+#
+# With fec=(k, m) the client follows every k DATA segments with m PARITY
+# segments. The group is an erasure code over GF(256): parity j is the sum
+# of coef(j, i) * symbol i, where symbol i is the 2-byte length of DATA
+# segment i followed by its payload, zero-padded to the longest symbol of
+# the group. The coefficients are a Cauchy matrix scaled so that parity 0
+# is the plain XOR of the symbols. Every square submatrix of a Cauchy
+# matrix is invertible, so any m segments lost from a group of k + m are
+# rebuilt from the rest.
+#
+# A product by a constant is one bytes.translate() through its 256-byte
+# table and a sum is an XOR of the symbols read as little-endian integers,
+# so the per-byte work runs in C; with m = 1 there is no product at all.
+#
+
+# the generator polynomial of GF(256), x^8 + x^4 + x^3 + x^2 + 1
+POLYNOMIAL = 0x11d
+# the length field that leads every symbol
+LENGTH_SIZE = 2
+# the bytes a PARITY segment carries beyond the longest payload of its group;
+# the client cuts payloads that much shorter so parity fits the segment size
+PARITY_OVERHEAD = LENGTH_SIZE
+
+EXP = [0] * 512
+LOG = [0] * 256
+value = 1
+for power in range(255):
+    EXP[power] = EXP[power + 255] = value
+    LOG[value] = power
+    value <<= 1
+    if value & 0x100:
+        value ^= POLYNOMIAL
+del value, power
+
+
+def mul(a, b):
+    """
+    return the product of two elements of GF(256)
+    """
+    if not a or not b:
+        return 0
+    return EXP[LOG[a] + LOG[b]]
+
+
+def inverse(a):
+    """
+    return the multiplicative inverse of a nonzero element of GF(256)
+    """
+    return EXP[255 - LOG[a]]
+
+
+# translate() tables of the products by each constant, built when first used
+MUL_TABLES = {}
+
+
+def mul_table(c):
+    """
+    return the bytes.translate() table multiplying every byte by c
+    """
+    table = MUL_TABLES.get(c)
+    if table is None:
+        table = MUL_TABLES[c] = bytes(mul(c, b) for b in range(256))
+    return table
+
+
+# coefficient rows of each (k, m)
+COEFFICIENTS = {}
+
+
+def coefficients(k, m):
+    """
+    return the m rows of k coefficients of the parity segments of a group
+
+    row j, column i is 1 / (x_j + y_i) with x_j = k + j and y_i = i, the
+    columns divided by their row-0 entry so that row 0 is all ones
+    """
+    rows = COEFFICIENTS.get((k, m))
+    if rows is None:
+        if not 1 <= k or not 1 <= m or k + m > 256:
+            raise ValueError(f"FEC needs k >= 1, m >= 1 and k + m <= 256, got k={k}, m={m}")
+        cauchy = [[inverse((k + j) ^ i) for i in range(k)] for j in range(m)]
+        rows = COEFFICIENTS[(k, m)] = [[mul(cauchy[j][i], inverse(cauchy[0][i])) for i in range(k)]
+                                       for j in range(m)]
+    return rows
+
+
+def symbol(payload):
+    """
+    return the symbol of a DATA payload: its length, then the payload
+    """
+    return len(payload).to_bytes(LENGTH_SIZE, "little") + bytes(payload)
+
+
+def scaled(sym, c):
+    """
+    return a symbol multiplied by c, as a little-endian integer
+    """
+    if c != 1:
+        sym = sym.translate(mul_table(c))
+    return int.from_bytes(sym, "little")
+
+
+class ParityEncoder:
+    """
+    the parity of the group the client is sending, accumulated one DATA
+    segment at a time so that the group's payloads need not be kept
+    """
+    def __init__(self, k, m):
+        """
+        arguments:
+        k -- the DATA segments per group
+        m -- the PARITY segments per group
+        """
+        self.k = k
+        self.m = m
+        self.rows = coefficients(k, m)
+        self.start = 0
+        self.count = 0
+        self.length = 0
+        self.sums = [0] * m
+
+    def add(self, seq, payload):
+        """
+        add a DATA segment to the group
+
+        arguments:
+        seq -- its sequence number, which starts the group if it is the first one
+        payload -- its payload
+
+        returns:
+        bool -- True once the group has k segments and its parity is due
+        """
+        if not self.count:
+            self.start = seq
+        sym = symbol(payload)
+        self.length = max(self.length, len(sym))
+        i = self.count
+        for j, row in enumerate(self.rows):
+            self.sums[j] ^= scaled(sym, row[i])
+        self.count += 1
+        return self.count == self.k
+
+    def flush(self):
+        """
+        return the parity of the group and start the next one
+
+        returns:
+        tuple -- (first seq, number of DATA segments, list of the m parity payloads)
+        """
+        parity = [total.to_bytes(self.length, "little") for total in self.sums]
+        group = (self.start, self.count, parity)
+        self.count = 0
+        self.length = 0
+        self.sums = [0] * self.m
+        return group
+
+
+def solve(matrix, columns):
+    """
+    invert a square matrix over GF(256) and apply it to columns of symbols
+
+    arguments:
+    matrix -- n rows of n coefficients, invertible
+    columns -- n symbols as little-endian integers, the right-hand side
+
+    returns:
+    list -- the n solved symbols as little-endian integers
+    """
+    n = len(matrix)
+    # Gauss-Jordan on [matrix | identity], the inverse then multiplies the symbols
+    rows = [list(row) + [int(i == j) for j in range(n)] for i, row in enumerate(matrix)]
+    for col in range(n):
+        pivot = next(r for r in range(col, n) if rows[r][col])
+        rows[col], rows[pivot] = rows[pivot], rows[col]
+        scale = inverse(rows[col][col])
+        rows[col] = [mul(scale, v) for v in rows[col]]
+        for r in range(n):
+            if r != col and rows[r][col]:
+                factor = rows[r][col]
+                rows[r] = [v ^ mul(factor, p) for v, p in zip(rows[r], rows[col])]
+    length = max((column.bit_length() + 7) // 8 for column in columns)
+    sources = [column.to_bytes(length, "little") for column in columns]
+    solved = []
+    for i in range(n):
+        total = 0
+        for j in range(n):
+            total ^= scaled(sources[j], rows[i][n + j])
+        solved.append(total)
+    return solved
+
+
+class ParityGroups:
+    """
+    the receiver's view of the parity groups of a connection: the recent
+    DATA payloads and the PARITY payloads of the groups that may still
+    lose a segment, and the reconstruction of the missing ones
+    """
+    def __init__(self, k, m):
+        """
+        arguments:
+        k -- the DATA segments per group
+        m -- the PARITY segments per group
+        """
+        self.k = k
+        self.m = m
+        self.rows = coefficients(k, m)
+        # payloads by absolute seq, from floor on
+        self.data = {}
+        self.floor = 0
+        # first seq -> [number of DATA segments, {parity index: payload}]
+        self.groups = {}
+
+    def add_data(self, seq, payload):
+        """
+        keep a DATA payload for the reconstruction of its group
+
+        returns:
+        dict -- the seqs rebuilt by this segment's arrival and their payloads
+        """
+        if seq < self.floor or seq in self.data:
+            return {}
+        self.data[seq] = payload
+        for start, (count, _) in self.groups.items():
+            if start <= seq < start + count:
+                return self.recover(start)
+        return {}
+
+    def add_parity(self, start, count, index, payload):
+        """
+        keep a PARITY payload of the group of count DATA segments from start
+
+        returns:
+        dict -- the seqs rebuilt and their payloads
+        """
+        if start + count <= self.floor or not 0 < count <= self.k or not 0 <= index < self.m:
+            return {}
+        group = self.groups.setdefault(start, [count, {}])
+        group[1][index] = payload
+        return self.recover(start)
+
+    def recover(self, start):
+        """
+        rebuild the missing DATA segments of a group if it has enough parity
+
+        returns:
+        dict -- the seqs rebuilt and their payloads
+        """
+        count, parity = self.groups[start]
+        missing = [i for i in range(count) if start + i not in self.data]
+        if not missing:
+            del self.groups[start]
+            return {}
+        if len(missing) > len(parity):
+            return {}
+        used = sorted(parity)[:len(missing)]
+        known = [(i, symbol(self.data[start + i])) for i in range(count) if start + i in self.data]
+        columns = []
+        for j in used:
+            total = int.from_bytes(parity[j], "little")
+            row = self.rows[j]
+            for i, sym in known:
+                total ^= scaled(sym, row[i])
+            columns.append(total)
+        matrix = [[self.rows[j][i] for i in missing] for j in used]
+        rebuilt = {}
+        for i, total in zip(missing, solve(matrix, columns)):
+            sym = total.to_bytes(max((total.bit_length() + 7) // 8, LENGTH_SIZE), "little")
+            length = int.from_bytes(sym[:LENGTH_SIZE], "little")
+            payload = sym[LENGTH_SIZE:LENGTH_SIZE + length].ljust(length, b"\0")
+            self.data[start + i] = rebuilt[start + i] = payload
+        del self.groups[start]
+        return rebuilt
+
+    def advance(self, next_seq):
+        """
+        forget what no group can need any more once everything before
+        next_seq is delivered: the groups that end before it, and the
+        payloads more than k segments before it
+        """
+        floor = next_seq - self.k
+        if floor > self.floor:
+            for seq in range(self.floor, floor):
+                self.data.pop(seq, None)
+            self.floor = floor
+        for start in [start for start, (count, _) in self.groups.items() if start + count <= next_seq]:
+            del self.groups[start]
@@ -0,0 +1,253 @@
+#
+# Mini Reliable Transport - Metrics
+# Counters, histograms and phase timings of a connection, exported as
+# Prometheus text over a local HTTP endpoint
+#
+# Counters are plain dict entries incremented by the thread that sends or
+# handles the segment, and the RTT histogram is updated once per sample.
+# The segments sent are counted under the connection's lock (the client's
+# send_cond, the server's conn.cond), since more than one thread sends.
+# Everything else (windows, SRTT, RTO) is read only when stats() is
+# called, so the data path pays a few integer additions per segment.
+#
+
+import bisect
+import http.server
+import itertools
+import threading
+import time
+
+# counters of every connection, see Metrics
+COUNTERS = ("segments_sent", "bytes_sent", "segments_received", "bytes_received",
+            "segments_retransmitted", "bytes_retransmitted", "corrupt_dropped", "duplicates", "out_of_order",
+            "parity_sent", "fec_recovered")
+# the phases of a connection, in order
+PHASES = ("handshake", "transfer", "teardown")
+# upper bounds (seconds) of the RTT histogram buckets, the last bucket is +Inf
+RTT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# help text of the exported metrics, by the key in stats()
+HELP = {
+    "segments_sent": "segments sent, retransmissions included",
+    "bytes_sent": "payload bytes sent, retransmissions included",
+    "segments_received": "valid segments received",
+    "bytes_received": "payload bytes of the valid segments received",
+    "segments_retransmitted": "DATA segments sent again",
+    "bytes_retransmitted": "payload bytes of the DATA segments sent again",
+    "corrupt_dropped": "segments dropped for a bad checksum",
+    "duplicates": "DATA segments received again",
+    "out_of_order": "DATA segments received ahead of a hole",
+    "parity_sent": "FEC parity segments sent",
+    "fec_recovered": "DATA segments rebuilt from FEC parity",
+    "fast": "segments resent after duplicate ACKs",
+    "timeout": "segments resent after the RTO expired",
+    "recoveries": "fast recovery phases entered",
+    "dup_acks": "duplicate ACKs received",
+    "probes": "zero window probes sent",
+    "acks": "data ACKs sent",
+    "delayed": "data ACKs sent by the delayed-ACK timer",
+    "window": "segments that may be in flight",
+    "rwnd": "window advertised by the receiver, in segments",
+    "cwnd": "congestion window, in segments",
+    "ssthresh": "slow start threshold, in segments",
+    "in_flight": "unacknowledged segments",
+    "buffered": "bytes waiting in the receive buffer",
+    "srtt": "smoothed round-trip time, in seconds",
+    "rttvar": "round-trip time variation, in seconds",
+    "rto": "retransmission timeout, in seconds",
+    "pacing_rate": "rate of paced sending, in bytes per second",
+    "segment_size": "size new DATA segments are cut to, header included",
+}
+
+
+class Histogram:
+    """
+    counts of samples per bucket, their sum and their number, like a Prometheus histogram
+    """
+    def __init__(self, buckets=RTT_BUCKETS):
+        """
+        arguments:
+        buckets -- the increasing upper bounds of the buckets, without +Inf
+        """
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        """
+        add a sample
+        """
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def snapshot(self):
+        """
+        return the histogram as a dict
+
+        returns:
+        dict -- buckets (list of (upper bound, samples up to it)), sum and count
+        """
+        cumulative = list(itertools.accumulate(self.counts))
+        return {"buckets": list(zip(self.buckets + (float("inf"),), cumulative)),
+                "sum": self.sum, "count": self.count}
+
+
+class Metrics:
+    """
+    the counters and phase timings of one connection
+
+    counts is incremented in place by the protocol code; the owner of the
+    connection adds its gauges and RTT histogram in its stats()
+    """
+    def __init__(self):
+        self.counts = dict.fromkeys(COUNTERS, 0)
+        self.started = {}
+        self.ended = {}
+
+    def sent(self, payload_length):
+        """
+        count a segment sent
+        """
+        self.counts["segments_sent"] += 1
+        self.counts["bytes_sent"] += payload_length
+
+    def received(self, payload_length):
+        """
+        count a valid segment received
+        """
+        self.counts["segments_received"] += 1
+        self.counts["bytes_received"] += payload_length
+
+    def enter(self, phase):
+        """
+        start a phase, which ends the ones before it; a phase is only entered once
+
+        arguments:
+        phase -- one of PHASES
+        """
+        if phase in self.started:
+            return
+        now = time.monotonic()
+        for earlier in self.started:
+            self.ended.setdefault(earlier, now)
+        self.started[phase] = now
+
+    def finish(self):
+        """
+        end the current phase, the connection is closed
+        """
+        now = time.monotonic()
+        for phase in self.started:
+            self.ended.setdefault(phase, now)
+
+    def phase_seconds(self):
+        """
+        return the seconds spent in each phase entered so far, the current one up to now
+        """
+        now = time.monotonic()
+        return {phase: self.ended.get(phase, now) - start for phase, start in self.started.items()}
+
+
+def format_value(value):
+    """
+    return a number in the Prometheus text format
+    """
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def format_labels(labels):
+    return ",".join(f'{name}="{value}"' for name, value in labels.items())
+
+
+def render_prometheus(connections, prefix="mrt"):
+    """
+    render the stats of connections in the Prometheus text exposition format
+
+    arguments:
+    connections -- list of (labels, stats) pairs: a dict of label values
+                   identifying the connection, and its stats() dict
+    prefix -- the prefix of every metric name
+
+    returns:
+    str -- the exposition, one family per metric
+    """
+    families = {}
+
+    def add(name, kind, help_text, line):
+        family = families.setdefault(name, (kind, help_text, []))
+        family[2].append(line)
+
+    for labels, stats in connections:
+        label_text = format_labels(labels)
+        for key, value in stats["counters"].items():
+            name = f"{prefix}_{key}_total"
+            add(name, "counter", HELP.get(key, key), f"{name}{{{label_text}}} {format_value(value)}")
+        for key, value in stats["gauges"].items():
+            if value is None:
+                continue
+            name = f"{prefix}_{key}"
+            add(name, "gauge", HELP.get(key, key), f"{name}{{{label_text}}} {format_value(value)}")
+        for phase, seconds in stats["phases"].items():
+            name = f"{prefix}_phase_seconds"
+            add(name, "gauge", "seconds spent in each connection phase",
+                f'{name}{{{format_labels(dict(labels, phase=phase))}}} {format_value(seconds)}')
+        name = f"{prefix}_rtt_seconds"
+        histogram = stats["rtt"]
+        for bound, count in histogram["buckets"]:
+            add(name, "histogram", "round-trip time samples",
+                f'{name}_bucket{{{format_labels(dict(labels, le=format_value(bound)))}}} {count}')
+        add(name, "histogram", "", f"{name}_sum{{{label_text}}} {format_value(histogram['sum'])}")
+        add(name, "histogram", "", f"{name}_count{{{label_text}}} {histogram['count']}")
+
+    lines = []
+    for name, (kind, help_text, samples) in families.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        lines.extend(samples)
+    return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """
+    a local HTTP endpoint serving render_prometheus() at /metrics, on its own thread
+    """
+    def __init__(self, port, collect, host="127.0.0.1"):
+        """
+        start serving
+
+        arguments:
+        port -- the TCP port, 0 for any free one (see self.port)
+        collect -- called on every request, returns the list of (labels, stats) to render
+        host -- the address to listen on
+        """
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/metrics", "/"):
+                    self.send_error(404)
+                    return
+                body = render_prometheus(collect()).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = http.server.ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        """
+        stop serving and close the listening socket
+        """
+        self.httpd.shutdown()
+        self.httpd.server_close()
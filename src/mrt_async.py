@@ -0,0 +1,801 @@
+#
+# Mini Reliable Transport Protocol - asyncio Module
+# Client and server APIs of the MRT protocol for one asyncio event loop
+#
+# Same wire protocol as mrt_client/mrt_server (3-way handshake, Go-Back-N
+# data transfer, FIN/FIN-ACK teardown), but every endpoint is a
+# DatagramProtocol driven by the event loop: retransmission and linger
+# timers are loop.call_later() handles, waiting is done on futures and
+# events, and no thread is started, so thousands of connections can share
+# one loop. Only handshake, teardown and retransmission events are logged,
+# not every DATA/ACK segment.
+#
+
+import asyncio
+import datetime
+import socket
+import time
+from Segment import Segment
+from Timer import RTTEstimator, INITIAL_RTO, MIN_RTO, MAX_RTO, LINGER_RTOS
+from mrt_server import ReceiveBuffer
+
+# connections that may wait for accept(), counting the ones still in the handshake
+DEFAULT_BACKLOG = 1024
+
+# receive buffer requested for the server socket (the kernel caps it at net.core.rmem_max)
+SERVER_SOCKET_BUFFER = 4 << 20
+
+
+class AsyncEndpoint(asyncio.DatagramProtocol):
+    """
+    logging and the retransmission timer shared by AsyncClient and AsyncServer
+    """
+    def open_log(self, log):
+        """
+        open the log file of the endpoint, named after its port like the threaded modules
+
+        arguments:
+        log -- False to write no log file
+        """
+        self.src_port = self.transport.get_extra_info("sockname")[1]
+        self.log_file = open(f"log_{self.src_port}.txt", "a") if log else None
+        self.start_time = time.time()
+
+    def log(self, message):
+        """
+        write a line of log
+
+        arguments:
+        message -- the message to write
+        """
+        if self.log_file:
+            self.log_file.write(message + "\n")
+            self.log_file.flush()
+
+    def log_event(self, src_port, dst_port, seq, ack, seg_type, payload_length, extra=""):
+        """
+        write a line of formatted log
+
+        arguments:
+        src_port, dst_port, seq, ack, seg_type, payload_length, extra="" -- input info
+        """
+        if not self.log_file:
+            return
+        now = datetime.datetime.utcnow().strftime("%H:%M:%S.%f")[:-3]
+        log_line = f"{now} {src_port} {dst_port} {seq} {ack} {seg_type} {payload_length}"
+        if extra:
+            log_line += f' "{extra}"'
+        self.log(log_line)
+
+
+class AsyncClient(AsyncEndpoint):
+    async def init(self, src_port, dst_addr, dst_port, segment_size, header_version=2,
+                   initial_rto=INITIAL_RTO, min_rto=MIN_RTO, max_rto=MAX_RTO, log=True):
+        """
+        initialize the client and open its UDP endpoint on the running loop
+
+        arguments:
+        src_port -- the port the client is using to send segments, 0 for any free port
+        dst_addr -- the address of the server/network simulator
+        dst_port -- the port of the server/network simulator
+        segment_size -- the maximum size of a segment (including the header)
+        header_version -- the segment header format requested in the SYN
+        initial_rto, min_rto, max_rto -- retransmission timeout before the first RTT sample and its bounds
+        log -- write the log_<port>.txt file
+        """
+        self.loop = asyncio.get_running_loop()
+        self.dst = (dst_addr, dst_port)
+        self.segment_size = segment_size
+        self.version = header_version
+
+        self.handshake_state = False
+        self.data_transfer_state = False
+
+        self.rtt = RTTEstimator(initial_rto, min_rto, max_rto)
+        self.timer = None
+        self.client_isn = 0
+        self.N = 0
+        # the window the server advertised last
+        self.rwnd = 0
+        # the unacknowledged DATA segments by seq, encoded once from payloads cut
+        # lazily from the data of send() and released as send_base advances
+        self.send_buffer = {}
+        self.segments = iter(())
+        self.send_base = 0
+        self.next_seq = 0
+        self.total_packets = 0
+        self.send_times = {}
+        self.retransmitted = set()
+        self.syn_seg = None
+        self.syn_sent_time = 0
+        self.syn_retransmitted = False
+        self.fin_seg = None
+        self.fin_sent_time = 0
+        self.fin_retransmitted = False
+
+        self.connected = self.loop.create_future()
+        self.sent = None
+        self.closed = self.loop.create_future()
+
+        self.transport, _ = await self.loop.create_datagram_endpoint(lambda: self, local_addr=('0.0.0.0', src_port))
+        self.open_log(log)
+
+    def start_timer(self, callback, scale=1):
+        """
+        (re)start the single timer of the client
+
+        arguments:
+        callback -- called when the current RTO (times scale) elapses
+        scale -- multiple of the RTO to wait for
+        """
+        self.stop_timer()
+        self.timer = self.loop.call_later(self.rtt.rto * scale, callback)
+
+    def stop_timer(self):
+        """
+        cancel the timer if it is running
+        """
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+
+    def datagram_received(self, seg_bytes, addr):
+        """
+        run one raw segment through the client state machine
+
+        arguments:
+        seg_bytes -- the raw segment
+        addr -- the address the segment came from
+        """
+        segment = Segment.parse_seg(seg_bytes)
+        if not segment["valid"]:
+            self.log_event(self.dst[1], self.src_port, 0, 0, "CORRUPT", 0, "client received corrupted seg")
+            return
+
+        if segment["FIN"]:
+            self.process_fin(segment)
+        elif segment["SYN"] and segment["ACK"]:
+            self.process_syn_ack(segment)
+        elif self.data_transfer_state and segment["ACK"]:
+            self.process_ack(segment)
+
+    def process_syn_ack(self, segment):
+        """
+        finish the handshake, or ACK a SYN-ACK again if the first ACK was lost
+
+        arguments:
+        segment -- the SYN-ACK segment
+        """
+        if self.handshake_state:
+            self.stop_timer()
+            self.rtt.add_sample(time.monotonic() - self.syn_sent_time, self.syn_retransmitted)
+            self.log_event(self.dst[1], self.src_port, segment["ack"], self.client_isn + 1, "SYN-ACK",
+                           0, "client received SYN-ACK")
+            self.N = int(segment["window"])
+            self.rwnd = self.N
+            self.version = segment["version"]
+            self.handshake_state = False
+        ack_segment = Segment.create_seg(
+            seq=segment["ack"],
+            ack=self.client_isn + 1,
+            window=0,
+            a_flag=True,
+            version=self.version)
+        self.transport.sendto(ack_segment, self.dst)
+        self.log_event(self.src_port, self.dst[1], segment["ack"], self.client_isn + 1, "ACK", 0, "client sent ACK")
+        if not self.connected.done():
+            self.connected.set_result(None)
+
+    def process_ack(self, segment):
+        """
+        slide the window on a cumulative ACK and push the segments it lets in
+
+        arguments:
+        segment -- the ACK segment
+        """
+        # the wire ACK wraps, map it back next to send_base and ignore stale ones
+        n = self.send_base + Segment.seq_diff(segment["ack"], self.send_base, self.version)
+        if n < self.send_base or n > self.next_seq:
+            return
+        reopened = self.rwnd == 0 and segment["window"] > 0
+        self.rwnd = segment["window"]
+        if n == self.send_base:
+            if reopened:
+                # a window update: what was sent into the closed window was dropped
+                self.retransmit(self.next_seq, "re-sent after a window update, packet")
+            self.fill_window()
+            return
+
+        self.rtt.add_sample(time.monotonic() - self.send_times[n - 1], (n - 1) in self.retransmitted)
+        for i in range(self.send_base, n):
+            del self.send_buffer[i]
+            del self.send_times[i]
+            self.retransmitted.discard(i)
+        self.send_base = n
+
+        if self.send_base >= self.total_packets:
+            self.stop_timer()
+            self.data_transfer_state = False
+            self.sent.set_result(None)
+            return
+        self.start_timer(self.data_timeout)
+        self.fill_window()
+
+    def process_fin(self, segment):
+        """
+        answer the server's FIN with FIN-ACK and linger, or finish close() on FIN-ACK
+
+        arguments:
+        segment -- the FIN or FIN-ACK segment
+        """
+        if not segment["ACK"]:
+            self.log_event(self.dst[1], self.src_port, 0, 0, "FIN", 0, "client received FIN")
+            self.handshake_state = False
+            self.data_transfer_state = False
+            # a blocked send() returns, the server does not want more data
+            if self.sent and not self.sent.done():
+                self.sent.set_result(None)
+            fin_ack_seg = Segment.create_seg(
+                seq=0,
+                ack=0,
+                window=0,
+                a_flag=True,
+                f_flag=True,
+                version=self.version)
+            self.transport.sendto(fin_ack_seg, self.dst)
+            self.log_event(self.src_port, self.dst[1], 0, 0, "FIN-ACK", 0, "client sent FIN-ACK")
+            # answer retransmitted FINs for a while, then finish
+            self.start_timer(self.finish, LINGER_RTOS)
+        elif self.fin_seg and not self.closed.done():
+            self.log_event(self.dst[1], self.src_port, 0, 0, "FIN-ACK", 0, "client received FIN-ACK")
+            self.rtt.add_sample(time.monotonic() - self.fin_sent_time, self.fin_retransmitted)
+            self.finish()
+
+    def finish(self):
+        """
+        close the endpoint and wake up close()
+        """
+        self.stop_timer()
+        self.transport.close()
+        if self.log_file:
+            self.log("client closed")
+            self.log_file.close()
+            self.log_file = None
+        if not self.closed.done():
+            self.closed.set_result(None)
+
+    async def connect(self):
+        """
+        connect to the server
+        waiting until the connection is established
+        """
+        self.handshake_state = True
+        self.syn_seg = Segment.create_seg(
+            seq=self.client_isn,
+            ack=0,
+            window=0,
+            s_flag=True,
+            payload=str(self.segment_size).encode(),
+            version=self.version)
+        self.transport.sendto(self.syn_seg, self.dst)
+        self.syn_sent_time = time.monotonic()
+        self.log_event(self.src_port, self.dst[1], self.client_isn, 0, "SYN", 0, "client sent SYN")
+        self.start_timer(self.syn_timeout)
+        await self.connected
+
+    def syn_timeout(self):
+        """
+        retransmit the SYN with a doubled RTO
+        """
+        self.rtt.backoff()
+        self.syn_retransmitted = True
+        self.transport.sendto(self.syn_seg, self.dst)
+        self.log_event(self.src_port, self.dst[1], self.client_isn, 0, "SYN", 0, "client re-sent SYN (timeout)")
+        self.start_timer(self.syn_timeout)
+
+    async def send(self, data):
+        """
+        send a chunk of data of arbitrary size to the server
+        waiting until all data is acknowledged
+
+        arguments:
+        data -- the bytes to be sent to the server
+
+        return:
+        the number of bytes sent
+        """
+        seg_size = self.segment_size - Segment.header_size(self.version)
+        view = memoryview(data).cast("B")
+        self.segments = (view[i:i + seg_size] for i in range(0, len(view), seg_size))
+        self.total_packets = self.next_seq + -(-len(view) // seg_size)
+        if self.send_base >= self.total_packets:
+            return len(data)
+        self.data_transfer_state = True
+        self.sent = self.loop.create_future()
+        self.fill_window()
+        await self.sent
+        return len(data)
+
+    def fill_window(self):
+        """
+        send every new segment the window allows
+        """
+        # a closed window still lets one segment through, the zero window probe
+        window = max(min(self.N, self.rwnd), 1)
+        while self.next_seq < self.send_base + window and self.next_seq < self.total_packets:
+            seg = self.send_buffer[self.next_seq] = Segment.create_seg(
+                seq=self.next_seq,
+                ack=0,
+                window=self.N,
+                d_flag=True,
+                payload=next(self.segments),
+                version=self.version)
+            self.transport.sendto(seg, self.dst)
+            self.send_times[self.next_seq] = time.monotonic()
+            # the timer stops when everything is acknowledged, restart it for new data
+            if self.timer is None:
+                self.start_timer(self.data_timeout)
+            self.next_seq += 1
+
+    def data_timeout(self):
+        """
+        Go-Back-N: resend every unacknowledged segment with a doubled RTO;
+        with a closed window only the first one, as a zero window probe
+        """
+        self.rtt.backoff()
+        if self.rwnd == 0:
+            self.retransmit(self.send_base + 1, "probed with packet")
+        else:
+            self.retransmit(self.next_seq, "retransmitted packet")
+        self.start_timer(self.data_timeout)
+
+    def retransmit(self, end, reason):
+        """
+        resend the unacknowledged segments before end
+
+        arguments:
+        end -- the seq after the last segment to resend
+        reason -- what the log says the client did with each segment
+        """
+        header_size = Segment.header_size(self.version)
+        for i in range(self.send_base, end):
+            # sent as encoded the first time, the header and checksum do not change
+            self.transport.sendto(self.send_buffer[i], self.dst)
+            self.retransmitted.add(i)
+            self.log_event(self.src_port, self.dst[1], i, 0, "DATA", len(self.send_buffer[i]) - header_size,
+                           f"client {reason} seq={i}")
+
+    async def close(self):
+        """
+        request to close the connection with the server
+        waiting until the connection is closed
+        """
+        if self.closed.done():
+            return
+        self.fin_seg = Segment.create_seg(
+            seq=0,
+            ack=0,
+            window=0,
+            f_flag=True,
+            version=self.version)
+        self.transport.sendto(self.fin_seg, self.dst)
+        self.fin_sent_time = time.monotonic()
+        self.log_event(self.src_port, self.dst[1], 0, 0, "FIN", 0, "client sent FIN")
+        self.start_timer(self.fin_timeout)
+        await self.closed
+
+    def fin_timeout(self):
+        """
+        retransmit the FIN with a doubled RTO
+        """
+        self.rtt.backoff()
+        self.fin_retransmitted = True
+        self.transport.sendto(self.fin_seg, self.dst)
+        self.log_event(self.src_port, self.dst[1], 0, 0, "FIN", 0, "client re-sent FIN")
+        self.start_timer(self.fin_timeout)
+
+    def rtt_stats(self):
+        """
+        return the RTT/RTO statistics of the connection
+        """
+        return self.rtt.stats()
+
+
+class AsyncConnection:
+    """
+    state of one client connection of the AsyncServer, keyed by the client address
+    """
+    def __init__(self, addr, rtt, loop):
+        """
+        initialize a connection for a client that sent a SYN
+
+        arguments:
+        addr -- the (ip, port) address of the client
+        rtt -- the RTTEstimator of the connection
+        loop -- the event loop of the server
+        """
+        self.addr = addr
+        self.version = 1
+        self.N = 0
+        self.segment_size = 0
+        self.nextseqnum = 0
+        # in-order payloads not received yet, and the window the last ACK advertised
+        self.data_buffer = ReceiveBuffer(0)
+        self.last_window = 0
+        self.data_event = asyncio.Event()
+
+        self.rtt = rtt
+        self.timer = None
+        self.syn_ack_segment = None
+        self.syn_ack_sent_time = 0
+        self.syn_ack_retransmitted = False
+        self.fin_seg = None
+        self.fin_sent_time = 0
+        self.fin_retransmitted = False
+
+        self.handshake_state = True
+        self.data_transfer_state = False
+        self.fin_reached = False
+        self.closed = loop.create_future()
+
+    def __repr__(self):
+        return f"AsyncConnection{self.addr}"
+
+
+class AsyncServer(AsyncEndpoint):
+    async def init(self, src_port, receive_buffer_size, initial_rto=INITIAL_RTO, min_rto=MIN_RTO, max_rto=MAX_RTO,
+                   backlog=DEFAULT_BACKLOG, log=True):
+        """
+        initialize the server and open its UDP endpoint on the running loop
+
+        arguments:
+        src_port -- the port the server is using to receive segments
+        receive_buffer_size -- the maximum size of the receive buffer of each connection
+        initial_rto, min_rto, max_rto -- retransmission timeout before the first RTT sample and its bounds
+        backlog -- the most connections waiting for accept(), including the ones in the handshake;
+                   SYNs of new clients beyond it are dropped and retransmitted by the client
+        log -- write the log_<port>.txt file
+        """
+        self.loop = asyncio.get_running_loop()
+        self.receive_buffer_size = receive_buffer_size
+        self.rto_bounds = (initial_rto, min_rto, max_rto)
+        self.backlog = backlog
+        self.server_isn = 0
+
+        # every open connection by client address, and the established ones not accepted yet
+        self.connections = {}
+        self.handshaking = 0
+        self.accept_queue = asyncio.Queue()
+
+        self.transport, _ = await self.loop.create_datagram_endpoint(lambda: self, local_addr=('0.0.0.0', src_port))
+        # every client's window lands on this one socket
+        self.transport.get_extra_info("socket").setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SERVER_SOCKET_BUFFER)
+        self.open_log(log)
+
+    def start_timer(self, conn, callback, scale=1):
+        """
+        (re)start the timer of a connection
+
+        arguments:
+        conn -- the connection
+        callback -- called with the connection when its RTO (times scale) elapses
+        scale -- multiple of the RTO to wait for
+        """
+        self.stop_timer(conn)
+        conn.timer = self.loop.call_later(conn.rtt.rto * scale, callback, conn)
+
+    def stop_timer(self, conn):
+        """
+        cancel the timer of a connection if it is running
+
+        arguments:
+        conn -- the connection
+        """
+        if conn.timer:
+            conn.timer.cancel()
+            conn.timer = None
+
+    def datagram_received(self, seg_bytes, client_addr):
+        """
+        run one raw segment through the protocol state machine of its connection
+
+        arguments:
+        seg_bytes -- the raw segment
+        client_addr -- the address the segment came from
+        """
+        try:
+            segment = Segment.parse_seg(seg_bytes)
+        except ValueError:
+            # shorter than a header: dropped like a corrupted segment
+            segment = None
+        if segment is None or not segment["valid"]:
+            self.log_event(client_addr[1], self.src_port, 0, 0, "CORRUPT", 0, "server received corrupted seg")
+            return
+
+        conn = self.connections.get(client_addr)
+        if conn is None:
+            if segment["SYN"] and not segment["ACK"] and not segment["FIN"]:
+                self.open_connection(segment, client_addr)
+            return
+
+        if segment["FIN"]:
+            self.process_fin(conn, segment)
+            return
+
+        if conn.handshake_state:
+            if segment["SYN"] and not segment["ACK"]:
+                # the SYN-ACK was lost, answer the retransmitted SYN again
+                self.transport.sendto(conn.syn_ack_segment, client_addr)
+                conn.syn_ack_retransmitted = True
+                self.log_event(self.src_port, client_addr[1], self.server_isn, 0, "SYN-ACK",
+                               0, "server re-sent SYN-ACK")
+                return
+            if segment["ACK"] and not segment["SYN"]:
+                self.establish(conn)
+                return
+            if segment["DATA"]:
+                # the ACK was lost, the first DATA segment completes the handshake and is processed below
+                self.establish(conn)
+
+        if conn.data_transfer_state and segment["DATA"]:
+            self.process_data(conn, segment)
+
+    def open_connection(self, segment, client_addr):
+        """
+        answer the SYN of a new client with a SYN-ACK, unless the backlog is full
+
+        arguments:
+        segment -- the parsed SYN
+        client_addr -- the address of the client
+        """
+        client_segment_size = Segment.announced_size(segment["payload"])
+        if not client_segment_size:
+            self.log_event(client_addr[1], self.src_port, segment["seq"], 0, "SYN",
+                           len(segment["payload"]), "server dropped SYN without a segment size")
+            return
+        if self.handshaking + self.accept_queue.qsize() >= self.backlog:
+            self.log_event(client_addr[1], self.src_port, segment["seq"], 0, "SYN",
+                           len(segment["payload"]), "server dropped SYN, backlog full")
+            return
+        conn = AsyncConnection(client_addr, RTTEstimator(*self.rto_bounds), self.loop)
+        self.connections[client_addr] = conn
+        self.handshaking += 1
+        self.log_event(client_addr[1], self.src_port, segment["seq"], 0, "SYN",
+                       len(segment["payload"]), "server received SYN")
+
+        # the SYN's header format picks the format of the whole connection
+        conn.version = segment["version"]
+        conn.segment_size = client_segment_size
+        conn.N = max(4, min(self.receive_buffer_size // client_segment_size, Segment.WINDOW_MAX[conn.version]))
+        conn.data_buffer = ReceiveBuffer(max(self.receive_buffer_size, conn.N * client_segment_size))
+        conn.last_window = conn.N
+        accepted = {}
+        if Segment.decode_options(segment["payload"]).get("probe") == "1":
+            # the client pads its SYNs to the size they announce, tell it which one was taken
+            accepted["mss"] = client_segment_size
+        conn.syn_ack_segment = Segment.create_seg(
+            seq=self.server_isn,
+            ack=segment["seq"] + 1,
+            window=conn.N,
+            a_flag=True,
+            s_flag=True,
+            payload=Segment.encode_options(accepted),
+            version=conn.version)
+        self.transport.sendto(conn.syn_ack_segment, client_addr)
+        conn.syn_ack_sent_time = time.monotonic()
+        self.log_event(self.src_port, client_addr[1], self.server_isn, segment["seq"] + 1, "SYN-ACK",
+                       0, "server sent SYN-ACK")
+
+    def establish(self, conn):
+        """
+        finish the handshake of a connection and queue it for accept()
+
+        arguments:
+        conn -- the connection whose ACK (or first DATA segment) arrived
+        """
+        conn.rtt.add_sample(time.monotonic() - conn.syn_ack_sent_time, conn.syn_ack_retransmitted)
+        conn.handshake_state = False
+        conn.data_transfer_state = True
+        self.handshaking -= 1
+        self.log_event(conn.addr[1], self.src_port, 0, 0, "ACK", 0, "server received ACK")
+        self.accept_queue.put_nowait(conn)
+
+    def process_data(self, conn, segment):
+        """
+        deliver an in-order DATA segment and ACK the next expected one (Go-Back-N)
+
+        arguments:
+        conn -- the connection the segment belongs to
+        segment -- the parsed DATA segment
+        """
+        if Segment.seq_diff(segment["seq"], conn.nextseqnum, conn.version) == 0:
+            if conn.data_buffer.write(segment["payload"]):
+                conn.nextseqnum += 1
+                conn.data_event.set()
+            else:
+                # a zero window probe, or a segment sent past the window: the client resends it once there is room
+                self.log_event(conn.addr[1], self.src_port, segment["seq"], 0, "DATA", len(segment["payload"]),
+                               f"server dropped seg, receive buffer full, seq={conn.nextseqnum}")
+        self.send_ack(conn)
+
+    def send_ack(self, conn):
+        """
+        acknowledge the next expected segment and advertise the room left in the receive buffer
+
+        arguments:
+        conn -- the connection
+        """
+        conn.last_window = self.advertised_window(conn)
+        ack_seg = Segment.create_seg(
+            seq=0,
+            ack=conn.nextseqnum,
+            window=conn.last_window,
+            a_flag=True,
+            version=conn.version)
+        self.transport.sendto(ack_seg, conn.addr)
+
+    def advertised_window(self, conn):
+        """
+        return the window to advertise: the segments the receive buffer
+        still has room for after the next expected one, at most N
+
+        arguments:
+        conn -- the connection
+        """
+        return min(conn.data_buffer.free() // conn.segment_size, conn.N, Segment.WINDOW_MAX[conn.version])
+
+    def freed_space(self, conn):
+        """
+        after the application read data, send a window update if the window
+        reopened or grew by half of N
+
+        arguments:
+        conn -- the connection
+        """
+        window = self.advertised_window(conn)
+        if window - conn.last_window >= max(conn.N // 2, 1) or (window and not conn.last_window):
+            self.send_ack(conn)
+            self.log_event(self.src_port, conn.addr[1], 0, conn.nextseqnum, "ACK", 0,
+                           f"server sent window update after the application read, "
+                           f"ack={conn.nextseqnum}, window={window}")
+
+    def process_fin(self, conn, segment):
+        """
+        answer a client's FIN with FIN-ACK and linger, or finish close() on FIN-ACK
+
+        arguments:
+        conn -- the connection the segment belongs to
+        segment -- the FIN or FIN-ACK segment
+        """
+        if not segment["ACK"]:
+            self.log_event(conn.addr[1], self.src_port, 0, 0, "FIN", 0, "server received FIN")
+            if conn.handshake_state:
+                self.handshaking -= 1
+            conn.handshake_state = False
+            conn.data_transfer_state = False
+            conn.fin_reached = True
+            conn.data_event.set()
+            fin_ack_seg = Segment.create_seg(
+                seq=0,
+                ack=0,
+                window=0,
+                a_flag=True,
+                f_flag=True,
+                version=conn.version)
+            self.transport.sendto(fin_ack_seg, conn.addr)
+            self.log_event(self.src_port, conn.addr[1], 0, 0, "FIN-ACK", 0, "server sent FIN-ACK")
+            # answer retransmitted FINs for a while, then forget the connection
+            self.start_timer(conn, self.finish, LINGER_RTOS)
+        elif conn.fin_seg and not conn.closed.done():
+            self.log_event(conn.addr[1], self.src_port, 0, 0, "FIN-ACK", 0, "server received FIN-ACK, server closed")
+            conn.rtt.add_sample(time.monotonic() - conn.fin_sent_time, conn.fin_retransmitted)
+            self.finish(conn)
+
+    def finish(self, conn):
+        """
+        forget a finished connection and wake up close()
+        a connection waiting for accept() stays queued, its data can still be received
+
+        arguments:
+        conn -- the connection
+        """
+        self.stop_timer(conn)
+        if self.connections.get(conn.addr) is conn:
+            del self.connections[conn.addr]
+        if not conn.closed.done():
+            conn.closed.set_result(None)
+
+    async def accept(self):
+        """
+        accept a client request
+        waiting until a client completed the handshake
+
+        return:
+        the connection to the client
+        """
+        conn = await self.accept_queue.get()
+        self.log("3-way handshake completed on server.")
+        return conn
+
+    async def receive(self, conn, length):
+        """
+        receive data from the given client
+        waiting until the requested amount of data is received,
+        or less if the client closes the connection first
+
+        arguments:
+        conn -- the connection to the client
+        length -- the number of bytes to receive
+
+        return:
+        data -- the bytes received from the client, in its original order
+        """
+        views = []
+        received = 0
+        while received < length:
+            if len(conn.data_buffer) > 0:
+                for view in conn.data_buffer.read_views(length - received):
+                    views.append(view)
+                    received += len(view)
+                if not conn.fin_reached:
+                    self.freed_space(conn)
+            elif conn.fin_reached:
+                break
+            else:
+                conn.data_event.clear()
+                await conn.data_event.wait()
+        return b"".join(views)
+
+    async def close(self, conn=None):
+        """
+        close one connection, or the server and every client still connected
+        waiting until the connection(s) are closed
+
+        arguments:
+        conn -- the connection to close, None to close all of them and the endpoint
+        """
+        targets = [conn] if conn is not None else list(self.connections.values())
+        for target in targets:
+            if target.fin_reached or target.closed.done():
+                continue
+            target.fin_seg = Segment.create_seg(
+                seq=0,
+                ack=0,
+                window=0,
+                f_flag=True,
+                version=target.version)
+            self.transport.sendto(target.fin_seg, target.addr)
+            target.fin_sent_time = time.monotonic()
+            self.log_event(self.src_port, target.addr[1], 0, 0, "FIN", 0, "server sent FIN")
+            self.start_timer(target, self.fin_timeout)
+        # connections their client closed finish with their linger
+        await asyncio.gather(*(target.closed for target in targets))
+
+        if conn is None:
+            self.transport.close()
+            if self.log_file:
+                self.log("server closed")
+                self.log_file.close()
+                self.log_file = None
+
+    def fin_timeout(self, conn):
+        """
+        retransmit the FIN of a connection with a doubled RTO
+
+        arguments:
+        conn -- the connection
+        """
+        conn.rtt.backoff()
+        conn.fin_retransmitted = True
+        self.transport.sendto(conn.fin_seg, conn.addr)
+        self.log_event(self.src_port, conn.addr[1], 0, 0, "FIN", 0, "server re-sent FIN")
+        self.start_timer(conn, self.fin_timeout)
+
+    def rtt_stats(self, conn):
+        """
+        return the RTT/RTO statistics of a connection
+
+        arguments:
+        conn -- the connection
+        """
+        return conn.rtt.stats()
@@ -7,13 +7,50 @@
 import socket
 import threading
 import time
-import datetime
 from Segment import Segment
-from Timer import Timer
+from Timer import Timer, RTTEstimator, INITIAL_RTO, MIN_RTO, MAX_RTO, LINGER_RTOS
+from congestion import create_controller
+from batch_io import BatchSocket
+from event_log import EventLog, DEBUG, INFO
+from metrics import Metrics, MetricsServer
+from pacing import TokenBucket, PACING_GAIN, SLOW_START_GAIN, PACING_QUANTUM, MIN_BURST
+from sizing import SegmentSizer, probe_sizes, PROBE_TRIES
+from fec import ParityEncoder, coefficients, PARITY_OVERHEAD
+
+
+class SegmentRing:
+    """
+    the unacknowledged DATA segments of the window, kept in their encoded form
+
+    segment seq is encoded into slot seq % capacity of one preallocated
+    area when it is first sent, and a retransmission sends those bytes
+    again without rebuilding the header or recomputing the checksum; a
+    slot is free once send_base passed its segment and is overwritten by
+    the segment capacity seqs later, so capacity must cover the window
+
+    the spare slots after them hold FEC parity segments, which are sent once
+    """
+    def __init__(self, capacity, slot_size, spare=0):
+        """
+        arguments:
+        capacity -- the number of slots, at least the largest window
+        slot_size -- the size of each slot, at least the largest encoded segment
+        spare -- the number of parity slots, from capacity on
+        """
+        self.capacity = capacity
+        self.slot_size = slot_size
+        self.spare = spare
+        self.area = bytearray((capacity + spare) * slot_size)
+        view = memoryview(self.area)
+        self.slots = [view[i * slot_size:(i + 1) * slot_size] for i in range(capacity + spare)]
+        self.lengths = [0] * capacity
 
 
 class Client:
-    def init(self, src_port, dst_addr, dst_port, segment_size):
+    def init(self, src_port, dst_addr, dst_port, segment_size, header_version=2,
+             initial_rto=INITIAL_RTO, min_rto=MIN_RTO, max_rto=MAX_RTO, sack=False, dupack_threshold=3,
+             congestion="reno", batch_io=True, pacing=False, pacing_rate=None, probe_mtu=False,
+             adaptive_size=False, fec=None, checksum="crc32", log_level="debug", metrics_port=None):
         """
         initialize the client and create the client UDP channel
 
@@ -22,24 +59,100 @@ class Client:
         dst_addr -- the address of the server/network simulator
         dst_port -- the port of the server/network simulator
         segment_size -- the maximum size of a segment (including the header)
+        header_version -- the segment header format requested in the SYN
+                          (1: 8-bit seq/ack/window, 2: 32-bit seq/ack, 16-bit window)
+        initial_rto, min_rto, max_rto -- retransmission timeout before the first RTT sample and its bounds
+        sack -- ask the server for Selective Repeat with SACK blocks instead of Go-Back-N
+        dupack_threshold -- duplicate ACKs that trigger a fast retransmit, 0 to wait for the RTO only
+        congestion -- the congestion controller, a name in congestion.CONTROLLERS
+                      ("none", "reno", "cubic") or a CongestionController instance
+        batch_io -- send window bursts with one sendmmsg() per batch where available (Linux)
+        pacing -- spread new DATA segments over the RTT with a token bucket instead of
+                  sending what the window allows back to back
+        pacing_rate -- the pacing rate in bytes/s, None to follow the window:
+                       PACING_GAIN * window * segment_size / SRTT
+        probe_mtu -- find the largest segment the path delivers at connect time: the SYN is
+                     padded to the size it announces, from segment_size down through
+                     sizing.PROBE_SIZES until one is answered
+        adaptive_size -- cut segments shorter than the negotiated size when the loss measured
+                         per segment length shows bit errors, see sizing.SegmentSizer
+        fec -- (k, m) to follow every k DATA segments with m PARITY segments from which the
+               server rebuilds up to m lost ones, if it accepts; payloads are cut PARITY_OVERHEAD
+               bytes shorter so that parity fits the segment size, see fec.py
+        checksum -- the checksum algorithm asked for in the SYN, a key of Segment.CHECKSUMS
+                    ("crc32", "adler32", "crc32c" with the crc32c package, or "none" to rely on
+                    the link); the connection keeps CRC32 if the server does not accept it
+        log_level -- "debug" logs every segment to log_<src_port>.jsonl, "info" only handshake,
+                     teardown, retransmissions and drops, "off" writes no log
+        metrics_port -- serve stats() in the Prometheus text format at
+                        http://127.0.0.1:<metrics_port>/metrics, None for no endpoint
         """
         self.handshake_complete = None
         self.src_port = src_port
         self.dst_port = dst_port
         self.dst_addr = dst_addr
         self.segment_size = segment_size
+        self.version = header_version
+        self.sack_requested = sack
+        self.sack = False
+        if checksum not in Segment.CHECKSUMS:
+            raise ValueError(f"unknown checksum {checksum!r}, expected one of {', '.join(Segment.CHECKSUMS)}")
+        self.checksum_requested = checksum
+        self.checksum = "crc32"
 
         self.handshake_state = False
         self.data_transfer_state = False
         self.finish_state = False
 
-        self.send_buffer = []
+        # the unacknowledged DATA segments, encoded, allocated once the SYN-ACK gives the window
+        self.ring = None
         self.send_complete = False
-        self.send_timer = Timer()
-        self.syn_send_timer = Timer()
-        self.send_fin_timer = Timer()
-        self.send_fin_ack_timer = Timer()
-        self.syn_ack_received = False
+        self.send_cond = threading.Condition()
+        self.rtt = RTTEstimator(initial_rto, min_rto, max_rto)
+        self.send_timer = Timer(self.rtt)
+        self.syn_send_timer = Timer(self.rtt)
+        self.send_fin_timer = Timer(self.rtt)
+        self.send_fin_ack_timer = Timer(self.rtt, LINGER_RTOS)
+        # first transmission time of every unacknowledged DATA segment, and
+        # the ones sent more than once (their ACKs give no RTT sample)
+        self.send_times = {}
+        self.retransmitted = set()
+        # Selective Repeat: unacknowledged segments the server reported in SACK blocks
+        self.sacked = set()
+        # fast retransmit: duplicate ACKs in a row, the end of the window when fast
+        # recovery started (None outside of it), and the segments resent during it
+        self.dupack_threshold = dupack_threshold
+        self.dup_acks = 0
+        self.recover = None
+        self.recovery_sent = set()
+        self.fast_pending = []
+        self.retransmit_counts = {"fast": 0, "timeout": 0, "recoveries": 0, "dup_acks": 0, "probes": 0}
+        self.metrics = Metrics()
+        # congestion window, the sender keeps at most min(N, cwnd) segments in flight
+        self.cc = create_controller(congestion)
+        # the token bucket of paced sending, created at the first burst with a rate
+        self.pacing = pacing
+        self.pacing_rate = pacing_rate
+        self.pacer = None
+        # the size the SYN announces (probe_mtu lowers it), and the loss per segment
+        # length, created at the SYN-ACK with adaptive_size
+        self.probe_mtu = probe_mtu
+        self.syn_size = segment_size
+        self.adaptive_size = adaptive_size
+        self.sizer = None
+        # the unacknowledged segments the sizer already counted as lost
+        self.lost_recorded = set()
+        # the requested (k, m), and the parity of the group being sent once the server accepted it;
+        # parity segments are encoded into the ring's spare slots, used in turn from parity_slot
+        if fec is not None:
+            coefficients(*fec)
+        self.fec_requested = fec
+        self.fec = None
+        self.parity_slot = 0
+        self.syn_sent_time = 0
+        self.syn_retransmitted = False
+        self.fin_sent_time = 0
+        self.fin_retransmitted = False
         self.fin_ack_received = False
         self.fin_reached = False
         self.running = True
@@ -49,42 +162,52 @@ class Client:
         self.send_base = 0
         self.next_seq = 0
         self.N = 0
-        self.total_packets = 0
+        # the window the server advertised in its latest ACK, counted from send_base
+        self.rwnd = 0
 
         self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.client_socket.bind(('', src_port))
         self.client_socket.settimeout(0.5)
+        # every segment is received into the same buffer (the largest UDP payload) and parsed in place
+        self.recv_buffer = bytearray(65535)
+        self.recv_view = memoryview(self.recv_buffer)
+        # DATA segments are queued under send_cond and sent together from the ring when the
+        # burst ends or max_batch are queued; burst holds their (offset, length) in ring.area
+        self.batch_socket = BatchSocket(self.client_socket, batch_io)
+        self.burst = []
+
+        # per-segment events are only built when trace is on
+        self.events = EventLog(f"log_{src_port}.jsonl", log_level)
+        self.trace = self.events.enabled(DEBUG)
+        self.start_time = time.time()
 
         self.rcv_and_sgmnt_handler = threading.Thread(target=self.rcv_and_sgmnt_handler)
         self.rcv_and_sgmnt_handler.start()
 
-        self.log_file_name = f"log_{src_port}.txt"
-        self.log_file = open(self.log_file_name, "a")
-        self.start_time = time.time()
+        self.metrics_server = None
+        if metrics_port is not None:
+            self.metrics_server = MetricsServer(metrics_port, lambda: [(self.metric_labels(), self.stats())])
         pass
 
-    def log(self, message):
+    def log(self, message, level=INFO):
         """
         write a line of log
 
         arguments:
         message -- the message to write
+        level -- DEBUG or INFO
         """
-        self.log_file.write(message + "\n")
-        self.log_file.flush()
+        self.events.message(level, message)
 
-    def log_event(self, src_port, dst_port, seq, ack, seg_type, payload_length, extra=""):
+    def log_event(self, src_port, dst_port, seq, ack, seg_type, payload_length, extra="", level=INFO):
         """
         write a line of formatted log
 
         arguments:
         src_port, dst_port, seq, ack, seg_type, payload_length, extra="" -- input info
+        level -- DEBUG or INFO
         """
-        now = datetime.datetime.utcnow().strftime("%H:%M:%S.%f")[:-3]
-        log_line = f"{now} {src_port} {dst_port} {seq} {ack} {seg_type} {payload_length}"
-        if extra:
-            log_line += f' "{extra}"'
-        self.log(log_line)
+        self.events.event(level, src_port, dst_port, seq, ack, seg_type, payload_length, extra)
 
     def process_fin(self, segment):
         """
@@ -94,18 +217,23 @@ class Client:
         segment: FIN segment
         """
         if not segment["ACK"]:
+            self.fin_reached = True
             print("[Finish] client received FIN")
             self.log_event(
                 self.dst_port, self.src_port, 0, 0, "FIN",
                 0, "client received FIN")
+            self.metrics.enter("teardown")
             fin_ack_seg = Segment.create_seg(
                 seq=0,
                 ack=0,
                 window=0,
                 a_flag=True,
                 f_flag=True,
-                payload=b"")
+                payload=b"",
+                version=self.version,
+                checksum=self.checksum)
             self.client_socket.sendto(fin_ack_seg, (self.dst_addr, self.dst_port))
+            self.count_sent(0)
             self.send_fin_ack_timer.reset_timer()
             print("[Finish] client sent FIN-ACK")
             self.log_event(
@@ -116,8 +244,12 @@ class Client:
             self.log_event(
                 self.dst_port, self.src_port, 0, 0, "FIN-ACK",
                 0, "client received FIN-ACK")
-            self.fin_ack_received = True
-            self.running = False
+            if self.fin_sent_time and not self.fin_ack_received:
+                self.rtt.add_sample(time.monotonic() - self.fin_sent_time, self.fin_retransmitted)
+            with self.send_cond:
+                self.fin_ack_received = True
+                self.running = False
+                self.send_cond.notify_all()
 
 
     def rcv_and_sgmnt_handler(self):
@@ -128,11 +260,12 @@ class Client:
         checking ACK nums of received segments
         retransmitting segments when necessary
         """
+        counts = self.metrics.counts
         while self.running:
             try:
-                seg_bytes, addr = self.client_socket.recvfrom(self.segment_size + Segment.HEADER_SIZE)
+                nbytes, addr = self.client_socket.recvfrom_into(self.recv_buffer)
             except socket.timeout:
-                if self.send_fin_ack_timer.is_timeout_2s():
+                if self.send_fin_ack_timer.is_timeout():
                     print("client send fin_ack timeout, finished")
                     self.log_event(
                         self.src_port, self.dst_port, 0, 0, "FIN-ACK",
@@ -142,43 +275,73 @@ class Client:
                 else:
                     continue
 
-            rcv_segment = Segment.parse_seg(seg_bytes)
+            rcv_segment = Segment.parse_seg(self.recv_view[:nbytes], self.checksum)
             if not rcv_segment["valid"]:
-                print("client received corrupted seg")
+                counts["corrupt_dropped"] += 1
                 self.log_event(
                     self.dst_port, self.src_port, 0, 0, "CORRUPT",
                     0, "client received corrupted seg")
                 continue
+            # inline, once per ACK
+            counts["segments_received"] += 1
+            counts["bytes_received"] += len(rcv_segment.payload)
 
             if rcv_segment["FIN"]:
-                self.handshake_state = False
-                self.data_transfer_state = False
+                with self.send_cond:
+                    self.handshake_state = False
+                    self.data_transfer_state = False
+                    self.send_cond.notify_all()
                 self.process_fin(rcv_segment)
                 continue
 
             if self.handshake_state:
                 if rcv_segment["SYN"] and rcv_segment["ACK"]:
                     self.syn_send_timer.stop_timer()
+                    self.rtt.add_sample(time.monotonic() - self.syn_sent_time, self.syn_retransmitted)
                     print("[handshake] client received SYN-ACK")
                     self.log_event(
                         self.dst_port, self.src_port, int(rcv_segment["ack"]), self.client_isn + 1, "SYN-ACK",
                         0, "client received SYN-ACK")
                     self.N = int(rcv_segment["window"])
+                    self.rwnd = self.N
+                    # the server answers in the header format and with the options it accepted
+                    self.version = rcv_segment["version"]
+                    options = Segment.decode_options(rcv_segment["payload"])
+                    self.sack = self.sack_requested and options.get("sack") == "1"
+                    if options.get("checksum") == self.checksum_requested:
+                        self.checksum = self.checksum_requested
+                    if self.probe_mtu:
+                        # the size of the SYN the server took, the smallest one sent if it does not say
+                        self.segment_size = int(options.get("mss", self.syn_size))
+                    spare = 0
+                    if self.fec_requested is not None and options.get("fec") == "{},{}".format(*self.fec_requested):
+                        self.fec = ParityEncoder(*self.fec_requested)
+                        # enough parity slots that none is reused before its burst was sent
+                        k, m = self.fec_requested
+                        spare = m * (self.batch_socket.max_batch // (k + m) + 2)
+                    if self.ring is None:
+                        self.ring = SegmentRing(max(self.N, 1), self.segment_size, spare)
+                    if self.adaptive_size and self.sizer is None:
+                        self.sizer = SegmentSizer(self.payload_size(), Segment.header_size(self.version))
                     ack_num = int(rcv_segment["ack"])
                     ack_segment = Segment.create_seg(
                         seq=ack_num,
                         ack=self.client_isn + 1,
                         window=0,
                         a_flag=True,
-                        payload=b"")
+                        payload=b"",
+                        version=self.version,
+                        checksum=self.checksum)
                     self.client_socket.sendto(ack_segment, (self.dst_addr, self.dst_port))
+                    self.count_sent(0)
                     print("[handshake] client sent ACK")
                     self.log_event(
                         self.src_port, self.dst_port, ack_num, self.client_isn + 1, "ACK",
                         0, "client sent ACK")
-                    self.handshake_state = False
-
-                time.sleep(0.01)
+                    self.metrics.enter("transfer")
+                    with self.send_cond:
+                        self.handshake_state = False
+                        self.send_cond.notify_all()
 
             elif self.data_transfer_state:
                 if rcv_segment["SYN"]:
@@ -188,22 +351,115 @@ class Client:
                     continue
 
                 n = rcv_segment["ack"]
-                print(f"[Transfer] {round(time.time() - self.start_time, 2)}: client received ACK={n}")
-                self.log_event(
-                    self.src_port, self.dst_port, rcv_segment["seq"], rcv_segment["ack"], "ACK",
-                    0, f"client received ACK={n}")
+                if self.trace:
+                    self.log_event(
+                        self.src_port, self.dst_port, rcv_segment["seq"], rcv_segment["ack"], "ACK",
+                        0, f"client received ACK={n}", DEBUG)
 
-                self.send_base = n
-                if self.send_base == self.next_seq:
-                    self.send_timer.stop_timer()
-                else:
-                    self.send_timer.reset_timer()
+                # the wire ACK wraps, map it back next to send_base and ignore stale ones
+                with self.send_cond:
+                    n = self.send_base + Segment.seq_diff(n, self.send_base, self.version)
+                    now = time.monotonic()
+                    if self.sack and rcv_segment["payload"]:
+                        # a SACK of new segments acknowledges new data too
+                        newest = self.record_sack(rcv_segment["payload"])
+                        if newest is not None:
+                            self.rtt.add_sample(now - self.send_times[newest], newest in self.retransmitted)
+                    if n == self.send_base:
+                        # an ACK that changes the window is a window update, not a duplicate (RFC 5681)
+                        duplicate = self.send_base < self.next_seq and rcv_segment["window"] == self.rwnd != 0
+                        if rcv_segment["window"] != self.rwnd:
+                            self.rwnd = rcv_segment["window"]
+                            self.send_cond.notify_all()
+                        if not duplicate:
+                            continue
+                        self.dup_acks += 1
+                        self.retransmit_counts["dup_acks"] += 1
+                        if self.dup_acks == self.dupack_threshold and self.recover is None:
+                            # fast retransmit, recovery lasts until everything sent so far is acknowledged
+                            self.recover = self.next_seq
+                            self.recovery_sent = set()
+                            self.retransmit_counts["recoveries"] += 1
+                            self.cc.on_loss()
+                            self.queue_fast_retransmit()
+                        continue
+                    if n < self.send_base or n > self.next_seq:
+                        continue
+                    self.rwnd = rcv_segment["window"]
 
-                if self.send_base >= self.total_packets:
-                    self.data_transfer_state = False
-            else:
-                time.sleep(0.01)
+                    # RTT sample from the newest segment this ACK covers, unless a SACK already measured it
+                    rtt_sample = None
+                    if (n - 1) not in self.sacked:
+                        retransmitted = (n - 1) in self.retransmitted
+                        self.rtt.add_sample(now - self.send_times[n - 1], retransmitted)
+                        if not retransmitted:
+                            rtt_sample = now - self.send_times[n - 1]
+                    self.cc.on_ack(n - self.send_base, rtt_sample)
+                    if self.sizer is not None:
+                        # the resent ones were counted as lost if they were known lost, or not at all
+                        for i in range(self.send_base, n):
+                            if i not in self.retransmitted:
+                                self.sizer.record(self.ring.lengths[i % self.ring.capacity], False)
+                            self.lost_recorded.discard(i)
+                    for i in range(self.send_base, n):
+                        del self.send_times[i]
+                        self.retransmitted.discard(i)
+                        self.sacked.discard(i)
+
+                    # wake up send() so it can fill the window opened by this ACK
+                    self.send_base = n
+                    self.dup_acks = 0
+                    if self.recover is not None:
+                        if n >= self.recover:
+                            self.recover = None
+                        else:
+                            # partial ACK: the segment after the retransmitted one was lost too
+                            self.queue_fast_retransmit()
+                    if self.send_base == self.next_seq:
+                        self.send_timer.stop_timer()
+                    else:
+                        self.send_timer.reset_timer()
+                    self.send_cond.notify_all()
+
+    def queue_fast_retransmit(self):
+        """
+        hand the segments presumed lost during fast recovery to send()
+
+        Go-Back-N resends what was outstanding when recovery started, since
+        the server dropped everything after the hole; Selective Repeat resends
+        the holes below the highest SACKed segment. Segments already resent in
+        this recovery are left to the retransmission timer.
+        called with send_cond held
+        """
+        end = self.recover
+        if self.sack and self.sacked:
+            end = min(end, max(self.sacked))
+        if end <= self.send_base:
+            end = self.send_base + 1
+        lost = [i for i in range(self.send_base, end) if i not in self.sacked and i not in self.recovery_sent]
+        self.recovery_sent.update(lost)
+        self.fast_pending.extend(lost)
+        self.send_cond.notify_all()
 
+    def record_sack(self, payload):
+        """
+        mark the segments covered by the SACK blocks of an ACK as received
+
+        arguments:
+        payload -- the ACK payload carrying the SACK blocks
+
+        returns:
+        int -- the highest segment that was not SACKed before, None if there is none
+        """
+        newest = None
+        for start, end in Segment.decode_sack(payload):
+            start = self.send_base + Segment.seq_diff(start, self.send_base, self.version)
+            end = self.send_base + Segment.seq_diff(end, self.send_base, self.version)
+            for i in range(max(start, self.send_base), min(end, self.next_seq)):
+                if i not in self.sacked:
+                    self.sacked.add(i)
+                    newest = i if newest is None else max(newest, i)
+        return newest
 
     def connect(self):
         """
@@ -213,32 +469,87 @@ class Client:
         it should support protection against segment loss/corruption/reordering 
         """
         self.handshake_state = True
+        self.metrics.enter("handshake")
+        # with probe_mtu every size is tried PROBE_TRIES times before the next smaller one
+        sizes = [self.segment_size]
+        if self.probe_mtu:
+            sizes = probe_sizes(self.segment_size, (self.dst_addr, self.dst_port))
+        self.syn_size = sizes.pop(0)
+        syn_payload = self.syn_payload(self.syn_size)
         syn_seg = Segment.create_seg(
             seq=self.client_isn,
             ack=0,
             window=0,
             s_flag=True,
-            payload=str(self.segment_size).encode())
+            payload=syn_payload,
+            version=self.version)
+        tries = 1
+        # stamped before sending, the SYN-ACK may be handled before sendto() returns
+        self.syn_sent_time = time.monotonic()
         self.client_socket.sendto(syn_seg, (self.dst_addr, self.dst_port))
+        self.count_sent(len(syn_payload))
         print("[handshake] client sent SYN")
         self.log_event(
             self.src_port, self.dst_port, self.client_isn, 0, "SYN",
-            str(self.segment_size).encode(), "client sent SYN")
+            str(self.syn_size).encode(), "client sent SYN")
         self.syn_send_timer.reset_timer()
-        while self.handshake_state:
-            if self.syn_ack_received:
-                time.sleep(0.01)
-                continue
+        with self.send_cond:
+            # the SYN-ACK wakes this up, or the next SYN is due
+            while self.handshake_state:
+                if not self.syn_send_timer.is_timeout():
+                    self.send_cond.wait(self.syn_send_timer.time_left())
+                    continue
 
-            elif self.syn_send_timer.is_timeout():
+                self.syn_retransmitted = True
+                reason = "client re-sent SYN (timeout)"
+                if sizes and tries == PROBE_TRIES:
+                    # no answer at this size: too large for the path, or lost every time
+                    self.syn_size = sizes.pop(0)
+                    syn_payload = self.syn_payload(self.syn_size)
+                    syn_seg = Segment.create_seg(
+                        seq=self.client_isn,
+                        ack=0,
+                        window=0,
+                        s_flag=True,
+                        payload=syn_payload,
+                        version=self.version)
+                    tries = 0
+                    reason = f"client probed segment size {self.syn_size}"
+                elif not sizes:
+                    # the RTO only backs off once no smaller size is left to try
+                    self.rtt.backoff()
+                tries += 1
                 self.syn_send_timer.reset_timer()
                 self.client_socket.sendto(syn_seg, (self.dst_addr, self.dst_port))
-                print("[handshake] client re-sent SYN (timeout)")
+                self.count_sent(len(syn_payload))
+                print(f"[handshake] {reason}")
                 self.log_event(
                     self.src_port, self.dst_port, self.client_isn, 0, "SYN",
-                    str(self.segment_size).encode(), "client re-sent SYN (timeout)")
+                    str(self.syn_size).encode(), reason)
 
-            time.sleep(0.01)
+    def syn_payload(self, size):
+        """
+        return the SYN payload announcing a segment size, with the handshake options;
+        with probe_mtu padded with spaces so that the SYN is size bytes long
+
+        arguments:
+        size -- the segment size (including the header)
+        """
+        payload = str(size).encode()
+        options = {}
+        if self.sack_requested:
+            options["sack"] = 1
+        if self.probe_mtu:
+            options["probe"] = 1
+        if self.checksum_requested != "crc32":
+            options["checksum"] = self.checksum_requested
+        if self.fec_requested is not None:
+            options["fec"] = "{},{}".format(*self.fec_requested)
+        if options:
+            payload += b" " + Segment.encode_options(options)
+        if self.probe_mtu:
+            payload = payload.ljust(size - Segment.header_size(self.version), b" ")
+        return payload
 
     def send(self, data):
         """
@@ -250,75 +561,507 @@ class Client:
         arguments:
         data -- the bytes to be sent to the server
         """
-        seg_size = self.segment_size - Segment.HEADER_SIZE
-        packets = [data[i:i+seg_size] for i in range(0, len(data), seg_size)]
-        self.send_buffer.extend(packets)
-        self.total_packets = len(self.send_buffer)
+        # segments are memoryview slices of data, cut when the window lets them in
+        seg_size = self.payload_size()
+        view = memoryview(data).cast("B")
+        segments = (view[i:i + seg_size] for i in range(0, len(view), seg_size))
+        if self.sizer is not None:
+            segments = self.sized_segments(segments)
+        self.send_segments(segments)
+        return len(data)
+
+    def send_stream(self, source):
+        """
+        send everything read from a binary file object, or yielded by an
+        iterable of bytes-like chunks of any size, to the server
+        blocking until all of it is acknowledged
+
+        the source is read as the window opens and only the unacknowledged
+        segments are kept, so memory does not grow with the amount sent
+
+        arguments:
+        source -- a file object opened in binary mode, or an iterable of bytes-like chunks
+
+        return:
+        the number of bytes sent
+        """
+        segments = self.stream_segments(source, self.payload_size())
+        if self.sizer is not None:
+            segments = self.sized_segments(segments)
+        return self.send_segments(segments)
+
+    def payload_size(self):
+        """
+        return the payload of a segment of the negotiated size, less the
+        room the FEC length field needs in the parity segments
+        """
+        size = self.segment_size - Segment.header_size(self.version)
+        if self.fec is not None:
+            size -= PARITY_OVERHEAD
+        return size
+
+    def sized_segments(self, payloads):
+        """
+        cut every payload of the negotiated size into the number of pieces the sizer
+        picks for it, read as the window takes them
+
+        arguments:
+        payloads -- an iterator of bytes-like payloads, at most one segment each
+        """
+        sizer = self.sizer
+        for payload in payloads:
+            pieces = sizer.cut()
+            if pieces == 1:
+                yield payload
+                continue
+            view = memoryview(payload).cast("B")
+            step = -(-len(view) // pieces)
+            for i in range(0, len(view), step):
+                yield view[i:i + step]
+
+    @staticmethod
+    def stream_segments(source, seg_size):
+        """
+        cut a file object or an iterable of chunks into payloads of seg_size bytes (the last one may be shorter)
 
+        arguments:
+        source -- a file object opened in binary mode, or an iterable of bytes-like chunks
+        seg_size -- the payload size of a segment
+        """
+        if hasattr(source, "read"):
+            while True:
+                payload = source.read(seg_size)
+                if not payload:
+                    return
+                yield payload
+
+        # the chunks are copied, an iterator may reuse its buffer for the next one
+        pending = bytearray()
+        for chunk in source:
+            view = memoryview(chunk).cast("B")
+            start = 0
+            if pending:
+                start = min(seg_size - len(pending), len(view))
+                pending += view[:start]
+                if len(pending) < seg_size:
+                    continue
+                yield bytes(pending)
+                pending = bytearray()
+            end = start + (len(view) - start) // seg_size * seg_size
+            for i in range(start, end, seg_size):
+                yield bytes(view[i:i + seg_size])
+            pending += view[end:]
+        if pending:
+            yield bytes(pending)
+
+    def send_segments(self, segments):
+        """
+        send the payloads of an iterator as DATA segments, taking the next one
+        only when the window has room for it
+        blocking until all of them are acknowledged
+
+        arguments:
+        segments -- an iterator of bytes-like payloads, at most one segment each
+
+        return:
+        the number of bytes sent
+        """
         print(f"window size ={self.N}")
         self.log(f"window size ={self.N}")
-        self.send_timer.reset_timer()
-        self.data_transfer_state = True
-        while self.send_base < self.total_packets and self.data_transfer_state:
-            if self.next_seq < self.send_base + self.N and self.next_seq < self.total_packets:
-                seg = Segment.create_seg(
-                    seq=self.next_seq,
-                    ack=0,
-                    window=self.N,
-                    d_flag=True,
-                    payload=self.send_buffer[self.next_seq])
-                self.client_socket.sendto(seg, (self.dst_addr, self.dst_port))
-                self.log_event(
-                    self.src_port, self.dst_port, self.next_seq, 0, "DATA",
-                    len(self.send_buffer[self.next_seq]), f"client sent packet seq={self.next_seq}")
-                self.next_seq += 1
-
-            if self.send_timer.is_timeout():
-                self.send_timer.reset_timer()
-                for i in range(self.send_base, self.next_seq):
-                    seg = Segment.create_seg(
-                        seq=i,
-                        ack=0,
-                        window=self.N,
-                        d_flag=True,
-                        payload=self.send_buffer[i])
-                    self.client_socket.sendto(seg, (self.dst_addr, self.dst_port))
-                    self.log_event(
-                        self.src_port, self.dst_port, self.next_seq, 0, "DATA",
-                        len(self.send_buffer[i]), f"client retransmitted packet seq={i}")
+        sent = 0
+        exhausted = False
+        with self.send_cond:
+            self.send_timer.reset_timer()
+            self.data_transfer_state = True
+            while (not exhausted or self.send_base < self.next_seq) and self.data_transfer_state:
+                # push every segment the window currently allows in one burst, and
+                # with pacing only as many as the bucket has tokens for
+                pace_wait = 0
+                if self.pacing:
+                    self.update_pacer()
+                while not exhausted and self.next_seq < self.send_base + self.window():
+                    if self.pacer is not None:
+                        pace_wait = self.pacer.take(self.segment_size)
+                        if pace_wait:
+                            break
+                    payload = next(segments, None)
+                    if payload is None:
+                        exhausted = True
+                        # the last group of the data gets its parity without waiting for more
+                        self.queue_parity()
+                        break
+                    sent += len(payload)
+                    self.send_new(payload)
+                self.flush_burst()
+                if self.send_base == self.next_seq:
+                    if pace_wait:
+                        self.send_cond.wait(pace_wait)
+                        continue
+                    if exhausted or self.window():
+                        # nothing in flight and the timer is stopped, the source may have run out
+                        # after the last ACK: check the loop condition again instead of waiting
+                        continue
+                    # zero window and nothing in flight: the timer is the persist timer, whose
+                    # probe (the next segment) gets an ACK with the current window even if
+                    # the window update of the server was lost
+                    if not self.send_timer.running:
+                        self.send_timer.reset_timer()
+                    if self.send_timer.is_timeout():
+                        payload = next(segments, None)
+                        if payload is None:
+                            exhausted = True
+                            self.queue_parity()
+                            self.flush_burst()
+                            continue
+                        self.rtt.backoff()
+                        self.retransmit_counts["probes"] += 1
+                        sent += len(payload)
+                        self.send_new(payload)
+                        self.flush_burst()
+                        self.send_timer.reset_timer()
+                        continue
+                    self.send_cond.wait(self.send_timer.time_left())
+                    continue
 
-            time.sleep(0.01)
-        return len(data)
+                if self.fast_pending:
+                    # segments queued by duplicate or partial ACKs, the ones acknowledged meanwhile are skipped
+                    lost = [i for i in self.fast_pending if i >= self.send_base and i not in self.sacked]
+                    self.fast_pending = []
+                    self.retransmit_counts["fast"] += len(lost)
+                    self.retransmit(lost, "fast retransmitted", self.known_lost(lost))
+                    if lost:
+                        self.send_timer.reset_timer()
+
+                if self.send_timer.is_timeout() and self.rwnd == 0:
+                    # the server had no room for what is in flight: probe with the first
+                    # segment, a closed window is not a sign of congestion
+                    self.rtt.backoff()
+                    self.send_timer.reset_timer()
+                    self.retransmit_counts["probes"] += 1
+                    self.retransmit([self.send_base], "probed with")
+                    continue
+
+                if self.send_timer.is_timeout():
+                    self.rtt.backoff()
+                    self.send_timer.reset_timer()
+                    self.dup_acks = 0
+                    self.recover = None
+                    self.fast_pending = []
+                    self.cc.on_timeout()
+                    # Go-Back-N resends the whole window, Selective Repeat only the holes
+                    holes = [i for i in range(self.send_base, self.next_seq) if i not in self.sacked]
+                    self.retransmit_counts["timeout"] += len(holes)
+                    self.retransmit(holes, "retransmitted", self.known_lost(holes))
+                    continue
+
+                # block until an ACK opens the window, the retransmission timer expires
+                # or the bucket has the tokens of the next segment
+                timeout = self.send_timer.time_left()
+                if pace_wait and (timeout is None or pace_wait < timeout):
+                    timeout = pace_wait
+                self.send_cond.wait(timeout)
+            self.data_transfer_state = False
+        return sent
+
+    def send_new(self, payload):
+        """
+        queue the next new DATA segment of the burst and track it as unacknowledged
+        called with send_cond held
+
+        arguments:
+        payload -- the payload
+        """
+        # encoded into its slot of the ring once, for all its transmissions
+        ring = self.ring
+        index = self.next_seq % ring.capacity
+        ring.lengths[index] = Segment.encode_into(
+            ring.slots[index],
+            seq=self.next_seq,
+            ack=0,
+            window=self.N,
+            d_flag=True,
+            payload=payload,
+            version=self.version,
+            checksum=self.checksum)
+        self.queue_segment(self.next_seq)
+        self.send_times[self.next_seq] = time.monotonic()
+        # the timer stops when everything is acknowledged (or runs as the persist
+        # timer of a closed window), restart it for the first segment in flight
+        if self.send_base == self.next_seq or not self.send_timer.running:
+            self.send_timer.reset_timer()
+        if self.trace:
+            self.log_event(
+                self.src_port, self.dst_port, self.next_seq, 0, "DATA",
+                len(payload), f"client sent packet seq={self.next_seq}", DEBUG)
+        group_full = self.fec is not None and self.fec.add(self.next_seq, payload)
+        self.next_seq += 1
+        if group_full:
+            self.queue_parity()
+
+    def queue_parity(self):
+        """
+        queue the PARITY segments of the group being sent, if it has any DATA
+        segment, and start the next group; parity is sent once, outside of
+        the window, and is neither paced nor retransmitted
+        called with send_cond held
+        """
+        if self.fec is None or not self.fec.count:
+            return
+        start, count, parity = self.fec.flush()
+        ring = self.ring
+        for j, payload in enumerate(parity):
+            if len(self.burst) == self.batch_socket.max_batch:
+                self.flush_burst()
+            index = ring.capacity + self.parity_slot
+            self.parity_slot = (self.parity_slot + 1) % ring.spare
+            length = Segment.encode_into(
+                ring.slots[index],
+                seq=start,
+                ack=j,
+                window=count,
+                p_flag=True,
+                payload=payload,
+                version=self.version,
+                checksum=self.checksum)
+            self.burst.append((index * ring.slot_size, length))
+        self.metrics.counts["parity_sent"] += len(parity)
+        if self.trace:
+            self.log_event(
+                self.src_port, self.dst_port, start, 0, "PARITY",
+                len(parity[0]), f"client sent {len(parity)} parity segments for seq={start}..{start + count - 1}",
+                DEBUG)
+
+    def window(self):
+        """
+        return how many unacknowledged segments may be in flight:
+        the window the server advertised last, limited by the congestion window
+        """
+        # never more than N, the ring has a slot for each of N segments
+        return min(self.rwnd, self.cc.window(), self.N)
+
+    def update_pacer(self):
+        """
+        set the rate of the token bucket to pacing_rate, or to the window spread over the SRTT
+        (SLOW_START_GAIN or PACING_GAIN times window * segment_size / SRTT)
+        before the first RTT sample and with a closed window nothing is paced
+        called with send_cond held
+        """
+        rate = self.pacing_rate
+        if rate is None:
+            window = self.window()
+            if not self.rtt.srtt or not window:
+                self.pacer = None
+                return
+            gain = SLOW_START_GAIN if self.cc.cwnd < self.cc.ssthresh else PACING_GAIN
+            rate = gain * window * self.segment_size / self.rtt.srtt
+        burst = max(MIN_BURST * self.segment_size, rate * PACING_QUANTUM)
+        if self.pacer is None:
+            self.pacer = TokenBucket(rate, burst)
+        else:
+            self.pacer.set_rate(rate, burst)
+
+    def known_lost(self, seqs):
+        """
+        return the segments among seqs that are known to be lost: the first
+        hole, and with SACK every hole below the highest SACKed segment. The
+        rest of a Go-Back-N window is resent because the server dropped it
+        after the hole, which says nothing about its length.
+        called with send_cond held
+
+        arguments:
+        seqs -- the sequence numbers about to be resent, none of them SACKed
+        """
+        top = self.send_base + 1
+        if self.sacked:
+            top = max(top, max(self.sacked))
+        return [i for i in seqs if i < top]
+
+    def retransmit(self, seqs, reason, lost=()):
+        """
+        resend DATA segments, their ACKs no longer give RTT samples
+        called with send_cond held
+
+        arguments:
+        seqs -- the sequence numbers to resend
+        reason -- how the log describes the retransmission
+        lost -- the ones among them known to be lost, which the sizer counts
+                as losses of their length (see known_lost())
+        """
+        sizer = self.sizer
+        if sizer is not None:
+            for i in lost:
+                # once per segment, however often it is resent
+                if i not in self.lost_recorded:
+                    self.lost_recorded.add(i)
+                    sizer.record(self.ring.lengths[i % self.ring.capacity], True)
+        counts = self.metrics.counts
+        header_size = Segment.header_size(self.version)
+        for i in seqs:
+            length = self.queue_segment(i)
+            self.retransmitted.add(i)
+            payload_length = length - header_size
+            counts["segments_retransmitted"] += 1
+            counts["bytes_retransmitted"] += payload_length
+            self.log_event(
+                self.src_port, self.dst_port, i, 0, "DATA",
+                payload_length, f"client {reason} packet seq={i}")
+        self.flush_burst()
+
+    def queue_segment(self, seq):
+        """
+        queue the encoded DATA segment seq for the burst, sending the burst
+        first if max_batch segments are queued
+        called with send_cond held
+
+        arguments:
+        seq -- the sequence number, still in the ring
+
+        returns:
+        int -- the length of the encoded segment
+        """
+        if len(self.burst) == self.batch_socket.max_batch:
+            self.flush_burst()
+        ring = self.ring
+        index = seq % ring.capacity
+        length = ring.lengths[index]
+        self.burst.append((index * ring.slot_size, length))
+        return length
+
+    def count_sent(self, payload_length):
+        """
+        count a handshake or teardown segment sent; the receive thread and the
+        application thread send them, so they are counted under send_cond like
+        the DATA segments of flush_burst()
+
+        arguments:
+        payload_length -- the payload length of the segment
+        """
+        with self.send_cond:
+            self.metrics.sent(payload_length)
+
+    def flush_burst(self):
+        """
+        send the queued DATA segments straight from the ring, one system call
+        per batch where batching is available
+        called with send_cond held
+        """
+        if self.burst:
+            self.batch_socket.send_spans(self.ring.area, self.burst, (self.dst_addr, self.dst_port))
+            # DATA segments are counted per burst, not per segment
+            counts = self.metrics.counts
+            counts["segments_sent"] += len(self.burst)
+            counts["bytes_sent"] += sum(length for _, length in self.burst) \
+                - len(self.burst) * Segment.header_size(self.version)
+            self.burst = []
 
     def close(self):
         """
         request to close the connection with the server
-        blocking until the connection is closed
+        blocking until the connection is closed; if the server closed it
+        first, wait for the FIN-ACK linger to end and release the socket
         """
-        fin_seg = Segment.create_seg(
-            seq=0,
-            ack=0,
-            window=0,
-            f_flag=True,
-            payload=b"")
-        self.client_socket.sendto(fin_seg, (self.dst_addr, self.dst_port))
-        print(f"[Finish] client sent FIN")
-        self.log_event(
-            self.src_port, self.dst_port, 0, 0, "FIN",
-            0, "client sent FIN")
-        self.send_fin_timer.reset_timer()
-        while not self.fin_ack_received:
-            if self.send_fin_timer.is_timeout():
-                self.send_fin_timer.reset_timer()
-                self.client_socket.sendto(fin_seg, (self.dst_addr, self.dst_port))
-                print(f"[Finish] client re-sent FIN (timeout)")
-                self.log_event(
-                    self.src_port, self.dst_port, 0, 0, "FIN",
-                    0, "client re-sent FIN")
-            time.sleep(0.01)
+        if not self.fin_reached:
+            fin_seg = Segment.create_seg(
+                seq=0,
+                ack=0,
+                window=0,
+                f_flag=True,
+                payload=b"",
+                version=self.version,
+                checksum=self.checksum)
+            self.metrics.enter("teardown")
+            self.client_socket.sendto(fin_seg, (self.dst_addr, self.dst_port))
+            self.count_sent(0)
+            self.fin_sent_time = time.monotonic()
+            print(f"[Finish] client sent FIN")
+            self.log_event(
+                self.src_port, self.dst_port, 0, 0, "FIN",
+                0, "client sent FIN")
+            self.send_fin_timer.reset_timer()
+            with self.send_cond:
+                # the FIN-ACK wakes this up, or the next FIN is due
+                while not self.fin_ack_received:
+                    if not self.send_fin_timer.is_timeout():
+                        self.send_cond.wait(self.send_fin_timer.time_left())
+                        continue
+                    self.rtt.backoff()
+                    self.fin_retransmitted = True
+                    self.send_fin_timer.reset_timer()
+                    self.client_socket.sendto(fin_seg, (self.dst_addr, self.dst_port))
+                    self.count_sent(0)
+                    print(f"[Finish] client re-sent FIN (timeout)")
+                    self.log_event(
+                        self.src_port, self.dst_port, 0, 0, "FIN",
+                        0, "client re-sent FIN")
 
         print("client closed")
         self.log("client closed")
         self.rcv_and_sgmnt_handler.join()
         self.client_socket.close()
+        self.metrics.finish()
+        if self.metrics_server:
+            self.metrics_server.close()
+        self.events.close()
         pass
+
+    def rtt_stats(self):
+        """
+        return the RTT/RTO statistics of the connection
+
+        return:
+        dict -- srtt, rttvar, last_rtt, p50 and p99 (of the last 65536 samples), rto, min_rto,
+                max_rto (seconds), samples, karn_skipped and backoffs (counts)
+        """
+        return self.rtt.stats()
+
+    def retransmit_stats(self):
+        """
+        return the retransmission counters of the connection
+
+        return:
+        dict -- fast and timeout (segments resent after duplicate ACKs and
+                after RTO expiry), recoveries (fast recovery phases entered)
+                dup_acks (duplicate ACKs received) and probes (zero window probes sent)
+        """
+        with self.send_cond:
+            return dict(self.retransmit_counts)
+
+    def stats(self):
+        """
+        return the metrics of the connection
+
+        return:
+        dict -- counters (segments and payload bytes sent, received and retransmitted,
+                corrupt_dropped, parity_sent, and the retransmit_stats() counts), gauges (window, rwnd,
+                cwnd, ssthresh and in_flight in segments, srtt, rttvar and rto in seconds,
+                pacing_rate in bytes/s when paced, segment_size the size new segments are cut to),
+                rtt (histogram of every RTT sample, see metrics.Histogram.snapshot()) and
+                phases (seconds spent in handshake, transfer and teardown so far)
+        """
+        with self.send_cond:
+            counters = dict(self.metrics.counts)
+            counters.update(self.retransmit_counts)
+            gauges = {"window": self.window(), "rwnd": self.rwnd, "cwnd": self.cc.cwnd,
+                      "ssthresh": self.cc.ssthresh, "in_flight": self.next_seq - self.send_base,
+                      "srtt": self.rtt.srtt, "rttvar": self.rtt.rttvar, "rto": self.rtt.rto,
+                      "pacing_rate": self.pacer.rate if self.pacer is not None else None,
+                      "segment_size": self.sizer.length(self.sizer.pieces) if self.sizer is not None
+                      else self.segment_size}
+        return {"counters": counters, "gauges": gauges, "rtt": self.rtt.histogram.snapshot(),
+                "phases": self.metrics.phase_seconds()}
+
+    def metric_labels(self):
+        """
+        return the labels of the connection's metrics
+        """
+        return {"role": "client", "local_port": self.src_port, "peer": f"{self.dst_addr}:{self.dst_port}"}
+
+    def cwnd_trace(self):
+        """
+        return the congestion window over time
+
+        return:
+        list -- (seconds since init, cwnd, ssthresh) tuples, one per change of the window
+        """
+        with self.send_cond:
+            return list(self.cc.trace)
@@ -7,113 +7,319 @@
 import socket
 import threading
 import queue
+import collections
+import select
 import time
-import datetime
 from Segment import Segment
-from Timer import Timer
+from Timer import Timer, RTTEstimator, INITIAL_RTO, MIN_RTO, MAX_RTO, LINGER_RTOS
+from batch_io import BatchSocket
+from event_log import EventLog, DEBUG, INFO
+from metrics import Metrics, MetricsServer
+from fec import ParityGroups, coefficients
+
+# connections that may wait for accept(), counting the ones still in the handshake
+DEFAULT_BACKLOG = 64
+
+# seconds between two checks of the lingering connections
+LINGER_SWEEP_INTERVAL = 0.05
+
+# delayed ACKs: in-order segments are acknowledged every DEFAULT_ACK_EVERY segments,
+# or DEFAULT_ACK_DELAY seconds after the first unacknowledged one, well below MIN_RTO
+DEFAULT_ACK_EVERY = 2
+DEFAULT_ACK_DELAY = 0.01
+
+
+class ReceiveBuffer:
+    """
+    bounded FIFO of the in-order payloads of a connection
+
+    payloads are queued as they arrive, without copying them into one
+    growing buffer, and read out through memoryview slices, so every byte
+    is copied once, into the application's buffer; reads and writes are
+    O(1) per payload whatever amount is buffered
+    the buffer does not lock itself, Connection.cond guards it
+    """
+    def __init__(self, capacity):
+        """
+        create an empty buffer
+
+        arguments:
+        capacity -- the most bytes the buffer holds
+        """
+        self.capacity = capacity
+        self.chunks = collections.deque()
+        # bytes of chunks[0] already read
+        self.offset = 0
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def free(self):
+        """
+        return the number of bytes that can still be written
+        """
+        return self.capacity - self.size
+
+    def write(self, payload):
+        """
+        append a payload if it fits
+
+        arguments:
+        payload -- the bytes to append
+
+        returns:
+        bool -- False if the buffer has no room for the payload
+        """
+        if len(payload) > self.capacity - self.size:
+            return False
+        if payload:
+            self.chunks.append(memoryview(payload))
+            self.size += len(payload)
+        return True
+
+    def read_views(self, length):
+        """
+        remove up to length bytes from the front
+
+        arguments:
+        length -- the most bytes to remove
+
+        returns:
+        list -- memoryview slices of the payloads, in order
+        """
+        views = []
+        while length > 0 and self.chunks:
+            chunk = self.chunks[0]
+            piece = chunk[self.offset:self.offset + length]
+            views.append(piece)
+            length -= len(piece)
+            self.size -= len(piece)
+            self.offset += len(piece)
+            if self.offset == len(chunk):
+                self.chunks.popleft()
+                self.offset = 0
+        return views
+
+    def read_into(self, buffer):
+        """
+        move up to len(buffer) bytes from the front into buffer
+
+        arguments:
+        buffer -- a writable bytes-like object, e.g. a bytearray or a memoryview slice
+
+        returns:
+        int -- the number of bytes written
+        """
+        target = memoryview(buffer).cast("B")
+        written = 0
+        for view in self.read_views(len(target)):
+            target[written:written + len(view)] = view
+            written += len(view)
+        return written
+
+
+class Connection:
+    """
+    state of one client connection of the server, keyed by the client address
+
+    the server's sgmnt_handler thread runs the protocol for every connection,
+    receive() and close() only touch the connection they are given
+    """
+    def __init__(self, addr, rtt):
+        """
+        initialize a connection for a client that sent a SYN
+
+        arguments:
+        addr -- the (ip, port) address of the client
+        rtt -- the RTTEstimator of the connection
+        """
+        self.addr = addr
+        self.version = 1
+        self.N = 0
+        self.segment_size = 0
+        # the window (in segments) the last ACK advertised
+        self.last_window = 0
+        self.sack = False
+        # the checksum algorithm of every segment after the SYN and SYN-ACK
+        self.checksum = "crc32"
+        # the parity groups of a client that sends FEC parity, None without FEC
+        self.fec = None
+        self.nextseqnum = 0
+        # Selective Repeat and FEC: out-of-order segments within the window, by absolute seq
+        self.ooo_buffer = {}
+        # in-order data not received by the application yet, sized in open_connection()
+        self.data_buffer = ReceiveBuffer(0)
+        self.cond = threading.Condition()
+        # in-order segments received since the last ACK, and the counts of ack_stats()
+        self.pending_acks = 0
+        self.ack_counts = {"segments": 0, "acks": 0, "delayed": 0}
+        self.metrics = Metrics()
+        self.metrics.enter("handshake")
+
+        self.rtt = rtt
+        self.send_fin_timer = Timer(self.rtt)
+        self.send_fin_ack_timer = Timer(self.rtt, LINGER_RTOS)
+        self.syn_ack_segment = None
+        self.syn_ack_sent_time = 0
+        self.syn_ack_retransmitted = False
+        self.fin_sent_time = 0
+        self.fin_retransmitted = False
+
+        self.handshake_state = True
+        self.data_transfer_state = False
+        self.fin_reached = False
+        self.fin_ack_received = False
+
+    def __repr__(self):
+        return f"Connection{self.addr}"
 
 
 class Server:
-    def init(self, src_port, receive_buffer_size):
+    def init(self, src_port, receive_buffer_size, initial_rto=INITIAL_RTO, min_rto=MIN_RTO, max_rto=MAX_RTO,
+             sack=True, backlog=DEFAULT_BACKLOG, batch_io=False, ack_every=DEFAULT_ACK_EVERY,
+             ack_delay=DEFAULT_ACK_DELAY, fec=True, checksums=None, log_level="debug", metrics_port=None):
         """
         initialize the server, create the UDP connection, and configure the receive buffer
 
         arguments:
         src_port -- the port the server is using to receive segments
-        receive_buffer_size -- the maximum size of the receive buffer
+        receive_buffer_size -- the maximum size of the receive buffer of each connection
+        initial_rto, min_rto, max_rto -- retransmission timeout before the first RTT sample and its bounds
+        sack -- accept Selective Repeat with SACK blocks when the client asks for it
+        backlog -- the most connections waiting for accept(), including the ones in the handshake;
+                   SYNs of new clients beyond it are dropped and retransmitted by the client
+        batch_io -- drain the socket with recvmmsg() where available (Linux) instead of a recvfrom() per
+                    datagram; off by default, per-datagram Python work outweighs the saved system calls on loopback
+        ack_every -- acknowledge in-order data every ack_every segments, 1 to ACK every segment
+        ack_delay -- the most seconds an in-order segment waits for its ACK; out-of-order
+                     and duplicate segments and segments that fill a hole are ACKed at once
+        fec -- accept FEC parity groups when the client asks for them; out-of-order segments are
+               then kept for reassembly even without SACK, see fec.py
+        checksums -- the checksum algorithms a client may ask for instead of CRC32, keys of
+                     Segment.CHECKSUMS; None for all of them but "none", which turns off the
+                     integrity check and has to be listed explicitly
+        log_level -- "debug" logs every segment to log_<src_port>.jsonl, "info" only handshake,
+                     teardown, drops and window updates, "off" writes no log
+        metrics_port -- serve stats() of every open connection in the Prometheus text format at
+                        http://127.0.0.1:<metrics_port>/metrics, None for no endpoint
         """
         self.src_port = src_port
         self.receive_buffer_size = receive_buffer_size
-
-        self.handshake_state = False
-        self.data_transfer_state = False
-        self.finish_state = False
+        self.rto_bounds = (initial_rto, min_rto, max_rto)
+        self.sack_allowed = sack
+        self.fec_allowed = fec
+        if checksums is None:
+            checksums = [name for name in Segment.CHECKSUMS if name != "none"]
+        unknown = [name for name in checksums if name not in Segment.CHECKSUMS]
+        if unknown:
+            raise ValueError(f"unknown checksum {unknown[0]!r}, expected one of {', '.join(Segment.CHECKSUMS)}")
+        self.checksums = set(checksums)
+        self.backlog = backlog
+        self.ack_every = max(ack_every, 1)
+        self.ack_delay = ack_delay
 
         self.server_isn = 0
-        self.client_addr = None
-        self.syn_ack_segment = None
-        self.nextseqnum = 0
-        self.syn_ack_timer = Timer()
-        self.send_fin_timer = Timer()
-        self.send_fin_ack_timer = Timer()
         self.running = True
 
-        self.fin_reached = False
-        self.fin_ack_received = False
-        self.ack_timeout = True
+        # every open connection by client address, and the established ones not accepted yet
+        self.connections = {}
+        self.accept_queue = collections.deque()
+        self.state_cond = threading.Condition()
+        self.last_sweep = 0
+        # connections with a delayed ACK, by deadline; only sgmnt_handler touches it
+        self.delayed_acks = {}
 
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.server_socket.bind(('', src_port))
-        self.server_socket.settimeout(0.5)
+        self.batch_socket = BatchSocket(self.server_socket, batch_io)
 
         self.rcv_buffer = queue.Queue()
-        self.data_buffer = bytearray()
+        # the data ACKs of sgmnt_handler are encoded into the same buffer, header and SACK blocks
+        self.ack_view = memoryview(bytearray(Segment.HEADER_SIZE_V2 + Segment.MAX_SACK_BLOCKS * Segment.SACK_BLOCK.size))
+
+        # per-segment events are only built when trace is on
+        self.events = EventLog(f"log_{src_port}.jsonl", log_level)
+        self.trace = self.events.enabled(DEBUG)
+        self.start_time = time.time()
 
         self.rcv_thread = threading.Thread(target=self.rcv_handler)
         self.sgmnt_thread = threading.Thread(target=self.sgmnt_handler)
         self.rcv_thread.start()
         self.sgmnt_thread.start()
 
-        self.log_file_name = f"log_{src_port}.txt"
-        self.log_file = open(self.log_file_name, "a")
-        self.start_time = time.time()
+        self.metrics_server = None
+        if metrics_port is not None:
+            self.metrics_server = MetricsServer(metrics_port, self.collect_metrics)
         pass
 
-    def log(self, message):
+    def log(self, message, level=INFO):
         """
         write a line of log
 
         arguments:
         message -- the message to write
+        level -- DEBUG or INFO
         """
-        self.log_file.write(message + "\n")
-        self.log_file.flush()
+        self.events.message(level, message)
 
-    def log_event(self, src_port, dst_port, seq, ack, seg_type, payload_length, extra=""):
+    def log_event(self, src_port, dst_port, seq, ack, seg_type, payload_length, extra="", level=INFO):
         """
         write a line of formatted log
 
         arguments:
         src_port, dst_port, seq, ack, seg_type, payload_length, extra="" -- input info
+        level -- DEBUG or INFO
         """
-        now = datetime.datetime.utcnow().strftime("%H:%M:%S.%f")[:-3]
-        log_line = f"{now} {src_port} {dst_port} {seq} {ack} {seg_type} {payload_length}"
-        if extra:
-            log_line += f' "{extra}"'
-        self.log(log_line)
+        self.events.event(level, src_port, dst_port, seq, ack, seg_type, payload_length, extra)
 
-    def process_fin(self, segment):
+    def process_fin(self, conn, segment):
         """
         check the finish segment and respond with ACK
 
         arguments:
+        conn: the connection the segment belongs to
         segment: FIN segment
         """
         if not segment["ACK"]:
-            self.fin_reached = True
-            print("[Finish] server received FIN")
+            print("[Finish] server received FIN from:", conn.addr)
             self.log_event(
-                self.client_addr[1], self.src_port, 0, 0, "FIN",
+                conn.addr[1], self.src_port, 0, 0, "FIN",
                 0, "server received FIN")
+            conn.metrics.enter("teardown")
             fin_ack_seg = Segment.create_seg(
                 seq=0,
                 ack=0,
                 window=0,
                 a_flag=True,
                 f_flag=True,
-                payload=b"")
-            self.server_socket.sendto(fin_ack_seg, self.client_addr)
-            self.send_fin_ack_timer.reset_timer()
+                payload=b"",
+                version=conn.version,
+                checksum=conn.checksum)
+            # the connection is closed before the client can see the FIN-ACK, a close()
+            # that follows the client's must not send this connection a FIN of its own
+            with conn.cond:
+                conn.metrics.sent(0)
+                conn.fin_reached = True
+                conn.handshake_state = False
+                conn.data_transfer_state = False
+                conn.send_fin_ack_timer.reset_timer()
+                conn.cond.notify_all()
+            self.server_socket.sendto(fin_ack_seg, conn.addr)
             print("[Finish] server sent FIN-ACK")
             self.log_event(
-                self.src_port, self.client_addr[1], 0, 0, "FIN-ACK",
+                self.src_port, conn.addr[1], 0, 0, "FIN-ACK",
                 0, "server sent FIN-ACK")
         else:
-            print("server received FIN-ACK, server closed")
+            print("server received FIN-ACK, connection closed:", conn.addr)
             self.log_event(
-                self.client_addr[1], self.src_port, 0, 0, "FIN-ACK",
+                conn.addr[1], self.src_port, 0, 0, "FIN-ACK",
                 0, "server received FIN-ACK, server closed")
-            self.fin_ack_received = True
+            if conn.fin_sent_time and not conn.fin_ack_received:
+                conn.rtt.add_sample(time.monotonic() - conn.fin_sent_time, conn.fin_retransmitted)
+            with self.state_cond:
+                conn.fin_ack_received = True
+                self.state_cond.notify_all()
 
     def rcv_handler(self):
         """
@@ -121,15 +327,18 @@ class Server:
 
         all data in this buffer should be in order and intact
         handle all the logic of the transport protocol
+
+        block on the socket, then drain every datagram already queued
+        on it and hand them to sgmnt_handler as one batch
         """
         while self.running:
-            try:
-                seg_bytes, client_addr = self.server_socket.recvfrom(self.receive_buffer_size)
-            except socket.timeout:
-                    continue
-            print(f"{round(time.time() - self.start_time, 2)}: received seg from:", client_addr)
-            self.rcv_buffer.put((seg_bytes, client_addr))
-            time.sleep(0.01)
+            readable, _, _ = select.select([self.server_socket], [], [], 0.5)
+            if not readable:
+                continue
+            batch = self.batch_socket.recvmany()
+            if not batch:
+                continue
+            self.rcv_buffer.put(batch)
 
     def sgmnt_handler(self):
         """
@@ -140,126 +349,504 @@ class Server:
         retransmitting segments when necessary
         """
         while self.running:
-            if self.send_fin_ack_timer.is_timeout_2s():
-                print("server send fin_ack timout, finished")
-                self.log("server send fin_ack timout, finished")
-                self.fin_ack_received = True
-                break
-
-            if not self.rcv_buffer.empty():
-                seg_bytes, client_addr = self.rcv_buffer.get()
-                curr_segment = Segment.parse_seg(seg_bytes)
-                if not curr_segment["valid"]:
-                    print("server received corrupted seg")
-                    self.log_event(
-                        client_addr[1], self.src_port, 0, 0, "CORRUPT",
-                        0, "server received corrupted seg")
-                    continue
+            if time.monotonic() - self.last_sweep >= LINGER_SWEEP_INTERVAL:
+                self.last_sweep = time.monotonic()
+                self.expire_lingering()
+
+            timeout = LINGER_SWEEP_INTERVAL
+            if self.delayed_acks:
+                timeout = max(min(timeout, min(self.delayed_acks.values()) - time.monotonic()), 0)
+            try:
+                batch = self.rcv_buffer.get(timeout=timeout)
+            except queue.Empty:
+                batch = []
+            for seg_bytes, client_addr in batch:
+                self.process_segment(seg_bytes, client_addr)
+            if self.delayed_acks:
+                self.send_delayed_acks()
 
-                if curr_segment["FIN"]:
-                    self.handshake_state = False
-                    self.data_transfer_state = False
-                    self.process_fin(curr_segment)
+    def send_delayed_acks(self):
+        """
+        send the delayed ACKs whose deadline passed
+        """
+        now = time.monotonic()
+        for conn, deadline in list(self.delayed_acks.items()):
+            if deadline > now:
+                continue
+            del self.delayed_acks[conn]
+            with conn.cond:
+                # an ACK sent in the meantime covered the segments already
+                if not conn.pending_acks:
                     continue
+                conn.pending_acks = 0
+                conn.ack_counts["delayed"] += 1
+                ack_num = conn.nextseqnum
+                sack = self.sack_payload(conn)
+                window = conn.last_window = self.advertised_window(conn)
+                self.count_ack(conn, sack)
+            self.send_ack(conn, ack_num, sack, window)
+            if self.trace:
+                self.log_event(
+                    self.src_port, conn.addr[1], 0, ack_num, "ACK",
+                    0, f"server sent delayed ACK, ack={ack_num}", DEBUG)
 
-                if self.handshake_state:
-                    if curr_segment["SYN"] and not curr_segment["ACK"] and not curr_segment["FIN"]:
-                        print("[handshake] server received SYN from:", client_addr)
-                        self.log_event(
-                            client_addr[1], self.src_port, curr_segment["seq"], 0, "SYN",
-                            len(curr_segment["payload"]), "server received SYN")
-                        self.client_addr = client_addr
-                        client_isn = curr_segment["seq"]
-                        client_segment_size = int(curr_segment["payload"].decode().strip())
-                        self.N = self.receive_buffer_size // client_segment_size
-                        if self.N < 4:
-                            self.N = 4
-                        self.syn_ack_segment = Segment.create_seg(
-                            seq=self.server_isn,
-                            ack=client_isn + 1,
-                            window=self.N,
-                            a_flag=True,
-                            s_flag=True,
-                            payload=b""
-                        )
-                        self.server_socket.sendto(self.syn_ack_segment, client_addr)
-                        print("[handshake] server sent SYN-ACK")
-                        self.log_event(
-                            self.src_port, client_addr[1], self.server_isn, client_isn + 1, "SYN-ACK",
-                            0, "server sent SYN-ACK")
-                    elif curr_segment["ACK"] and not curr_segment["SYN"] and not curr_segment["FIN"]:
-                        print("[handshake] server received ACK:", client_addr)
-                        self.log_event(
-                            client_addr[1], self.src_port, curr_segment["seq"], curr_segment["ack"], "ACK",
-                            len(curr_segment["payload"]), "server received ACK")
-                        self.syn_ack_timer.stop_timer()
-                        self.nextseqnum = 0
-                        self.handshake_state = False
-
-                    elif curr_segment["DATA"] or curr_segment["FIN"]:
-                        print("[handshake] server received implicit ACK")
-                        self.log_event(
-                            client_addr[1], self.src_port, curr_segment["seq"], curr_segment["ack"], "DATA",
-                            len(curr_segment["payload"]), "server received implicit ACK")
-                        self.syn_ack_timer.stop_timer()
-                        self.nextseqnum = 0
-                        self.handshake_state = False
-
-                    time.sleep(0.01)
-
-                elif self.data_transfer_state:
-                    seq_num = curr_segment["seq"]
-                    if curr_segment["valid"] and seq_num == self.nextseqnum:
-                        self.log_event(
-                            client_addr[1], self.src_port, curr_segment["seq"], curr_segment["ack"], "DATA",
-                            len(curr_segment["payload"]), f"server received valid seg, seq={seq_num}")
-                        self.data_buffer.extend(curr_segment["payload"])
-                        ack_nextseqnum = Segment.create_seg(seq=0,
-                                                            ack=self.nextseqnum + 1,
-                                                            window=0,
-                                                            a_flag=True,
-                                                            payload=b"")
-                        self.server_socket.sendto(ack_nextseqnum, client_addr)
-                        print(f"[Transfer]: server sent ACK for data seq: {self.nextseqnum + 1}")
-                        self.log_event(
-                            self.src_port, client_addr[1], 0, self.nextseqnum + 1, "ACK",
-                            0, f"server sent ACK for valid seg, ack={self.nextseqnum}")
-                        self.nextseqnum += 1
-
-                    elif curr_segment["valid"] and seq_num < self.nextseqnum:
-                        print(f"[Transfer] server received duplicate seg with seq: {seq_num} from {client_addr}")
-                        self.log_event(
-                            client_addr[1], self.src_port, curr_segment["seq"], curr_segment["ack"], "DATA",
-                            len(curr_segment["payload"]), f"server received duplicate seg, seq={seq_num}")
-                        ack_seg = Segment.create_seg(seq=0,
-                                                     ack=self.nextseqnum,
-                                                     window=0,
-                                                     a_flag=True,
-                                                     payload=b"")
-                        self.server_socket.sendto(ack_seg, client_addr)
-                        print(f"[Transfer] {round(time.time() - self.start_time, 2)}: server sent ACK for data seq: {self.nextseqnum}")
-                        self.log_event(
-                            self.src_port, client_addr[1], 0, self.nextseqnum, "ACK",
-                            0, f"server sent ACK for duplicate seg, ack={self.nextseqnum}")
-
-                    elif curr_segment["valid"]:
-                        print(f"[Transfer] {round(time.time() - self.start_time, 2)}: server received out of order seg")
-                        self.log_event(
-                            client_addr[1], self.src_port, curr_segment["seq"], curr_segment["ack"], "DATA",
-                            len(curr_segment["payload"]), f"server received out of order seg, seq={seq_num}")
-                        ack_seg = Segment.create_seg(seq=0,
-                                                     ack=self.nextseqnum,
-                                                     window=0,
-                                                     a_flag=True,
-                                                     payload=b"")
-                        self.server_socket.sendto(ack_seg, client_addr)
-                        print(f"[Transfer] {round(time.time() - self.start_time, 2)}: server sent ACK for data seq: {self.nextseqnum}")
-                        self.log_event(self.src_port, client_addr[1], 0, self.nextseqnum, "ACK",
-                                       0, f"server sent ACK for out-of-order seg, ack={self.nextseqnum}")
-                    time.sleep(0.01)
+    def expire_lingering(self):
+        """
+        finish the connections closed by their client once the FIN-ACK linger is over
+        """
+        with self.state_cond:
+            lingering = [conn for conn in self.connections.values() if conn.fin_reached]
+        for conn in lingering:
+            if conn.send_fin_ack_timer.is_timeout():
+                print("server send fin_ack timout, finished:", conn.addr)
+                self.log("server send fin_ack timout, finished")
+                with self.state_cond:
+                    conn.fin_ack_received = True
+                    self.state_cond.notify_all()
+                self.remove_connection(conn)
 
-                else:
-                    time.sleep(0.01)
+    def remove_connection(self, conn):
+        """
+        forget a finished connection, a later SYN from its address opens a new one
+        a connection waiting for accept() stays queued, its data can still be received
+
+        arguments:
+        conn -- the connection to remove
+        """
+        with self.state_cond:
+            if self.connections.get(conn.addr) is conn:
+                del self.connections[conn.addr]
+        conn.metrics.finish()
+
+    def process_segment(self, seg_bytes, client_addr):
+        """
+        run one raw segment through the protocol state machine of its connection
+
+        arguments:
+        seg_bytes -- the raw segment
+        client_addr -- the address the segment came from
+        """
+        # the connection decides the checksum algorithm
+        with self.state_cond:
+            conn = self.connections.get(client_addr)
+        try:
+            curr_segment = Segment.parse_seg(seg_bytes, "crc32" if conn is None else conn.checksum)
+        except ValueError:
+            # shorter than a header: dropped like a corrupted segment
+            curr_segment = None
+        if curr_segment is None or not curr_segment["valid"]:
+            if conn is not None:
+                conn.metrics.counts["corrupt_dropped"] += 1
+            self.log_event(
+                client_addr[1], self.src_port, 0, 0, "CORRUPT",
+                0, "server received corrupted seg")
+            return
+
+        if conn is None:
+            if curr_segment["SYN"] and not curr_segment["ACK"] and not curr_segment["FIN"]:
+                self.open_connection(curr_segment, client_addr)
+            else:
+                self.log_event(
+                    client_addr[1], self.src_port, curr_segment["seq"], curr_segment["ack"], "UNKNOWN",
+                    len(curr_segment["payload"]), "server received seg without connection")
+            return
+        counts = conn.metrics.counts
+        counts["segments_received"] += 1
+        counts["bytes_received"] += len(curr_segment.payload)
+
+        if curr_segment["FIN"]:
+            self.process_fin(conn, curr_segment)
+            return
+
+        if conn.handshake_state:
+            if curr_segment["SYN"] and not curr_segment["ACK"]:
+                # the SYN-ACK was lost, answer the retransmitted SYN again
+                self.server_socket.sendto(conn.syn_ack_segment, client_addr)
+                with conn.cond:
+                    conn.metrics.sent(0)
+                conn.syn_ack_retransmitted = True
+                print("[handshake] server re-sent SYN-ACK to:", client_addr)
+                self.log_event(
+                    self.src_port, client_addr[1], self.server_isn, 0, "SYN-ACK",
+                    0, "server re-sent SYN-ACK")
+                return
+            elif curr_segment["ACK"] and not curr_segment["SYN"]:
+                print("[handshake] server received ACK:", client_addr)
+                self.log_event(
+                    client_addr[1], self.src_port, curr_segment["seq"], curr_segment["ack"], "ACK",
+                    len(curr_segment["payload"]), "server received ACK")
+                self.establish(conn)
+                return
+            elif curr_segment["DATA"]:
+                # the ACK was lost, the first DATA segment completes the handshake and is processed below
+                print("[handshake] server received implicit ACK")
+                self.log_event(
+                    client_addr[1], self.src_port, curr_segment["seq"], curr_segment["ack"], "DATA",
+                    len(curr_segment["payload"]), "server received implicit ACK")
+                self.establish(conn)
+
+        if conn.data_transfer_state and curr_segment["DATA"]:
+            self.process_data(conn, curr_segment)
+        elif conn.data_transfer_state and curr_segment.PARITY and conn.fec is not None:
+            self.process_parity(conn, curr_segment)
+        elif curr_segment["SYN"]:
+            self.log_event(
+                client_addr[1], self.src_port, curr_segment["seq"], curr_segment["ack"], "SYN",
+                0, "server received unexpected SYN on an open connection")
+
+    def open_connection(self, curr_segment, client_addr):
+        """
+        answer the SYN of a new client with a SYN-ACK, unless the backlog is full
+
+        arguments:
+        curr_segment -- the parsed SYN
+        client_addr -- the address of the client
+        """
+        segment_size = Segment.announced_size(curr_segment["payload"])
+        if not segment_size:
+            # checksum-valid but not a SYN of this protocol, no connection is opened
+            self.log_event(
+                client_addr[1], self.src_port, curr_segment["seq"], 0, "SYN",
+                len(curr_segment["payload"]), "server dropped SYN without a segment size")
+            return
+        with self.state_cond:
+            pending = len(self.accept_queue) + sum(1 for c in self.connections.values() if c.handshake_state)
+            if pending >= self.backlog:
+                print("[handshake] backlog full, server dropped SYN from:", client_addr)
+                self.log_event(
+                    client_addr[1], self.src_port, curr_segment["seq"], 0, "SYN",
+                    len(curr_segment["payload"]), "server dropped SYN, backlog full")
+                return
+            conn = Connection(client_addr, RTTEstimator(*self.rto_bounds))
+            self.connections[client_addr] = conn
+        conn.metrics.received(len(curr_segment["payload"]))
+
+        print("[handshake] server received SYN from:", client_addr)
+        self.log_event(
+            client_addr[1], self.src_port, curr_segment["seq"], 0, "SYN",
+            len(curr_segment["payload"]), "server received SYN")
+        # the SYN's header format picks the format of the whole connection
+        conn.version = curr_segment["version"]
+        client_isn = curr_segment["seq"]
+        conn.segment_size = segment_size
+        conn.N = min(self.receive_buffer_size // conn.segment_size, Segment.WINDOW_MAX[conn.version])
+        if conn.N < 4:
+            conn.N = 4
+        conn.data_buffer = ReceiveBuffer(max(self.receive_buffer_size, conn.N * conn.segment_size))
+        conn.last_window = conn.N
+        options = Segment.decode_options(curr_segment["payload"])
+        accepted = {}
+        conn.sack = self.sack_allowed and options.get("sack") == "1"
+        if conn.sack:
+            accepted["sack"] = 1
+        if options.get("checksum") in self.checksums:
+            conn.checksum = accepted["checksum"] = options["checksum"]
+        if self.fec_allowed and "fec" in options:
+            try:
+                k, m = (int(value) for value in options["fec"].split(","))
+                coefficients(k, m)
+            except ValueError:
+                pass
+            else:
+                conn.fec = ParityGroups(k, m)
+                accepted["fec"] = f"{k},{m}"
+        if options.get("probe") == "1":
+            # the client pads its SYNs to the size they announce, tell it which one was taken
+            accepted["mss"] = conn.segment_size
+        conn.syn_ack_segment = Segment.create_seg(
+            seq=self.server_isn,
+            ack=client_isn + 1,
+            window=conn.N,
+            a_flag=True,
+            s_flag=True,
+            payload=Segment.encode_options(accepted),
+            version=conn.version
+        )
+        self.server_socket.sendto(conn.syn_ack_segment, client_addr)
+        with conn.cond:
+            conn.metrics.sent(0)
+        conn.syn_ack_sent_time = time.monotonic()
+        print("[handshake] server sent SYN-ACK")
+        self.log_event(
+            self.src_port, client_addr[1], self.server_isn, client_isn + 1, "SYN-ACK",
+            0, "server sent SYN-ACK")
+
+    def establish(self, conn):
+        """
+        finish the handshake of a connection and queue it for accept()
+
+        arguments:
+        conn -- the connection whose ACK (or first DATA segment) arrived
+        """
+        # a SYN-ACK answering a retransmitted SYN makes the RTT sample ambiguous
+        conn.rtt.add_sample(time.monotonic() - conn.syn_ack_sent_time, conn.syn_ack_retransmitted)
+        conn.nextseqnum = 0
+        conn.metrics.enter("transfer")
+        with conn.cond:
+            conn.handshake_state = False
+            conn.data_transfer_state = True
+        with self.state_cond:
+            self.accept_queue.append(conn)
+            self.state_cond.notify_all()
+
+    def process_data(self, conn, curr_segment):
+        """
+        deliver or buffer a DATA segment of an established connection and ACK it
+
+        arguments:
+        conn -- the connection the segment belongs to
+        curr_segment -- the parsed DATA segment
+        """
+        client_addr = conn.addr
+        seq_num = curr_segment["seq"]
+        with conn.cond:
+            # position of the segment relative to the next expected one, across wraparound
+            offset = Segment.seq_diff(seq_num, conn.nextseqnum, conn.version)
+            delivered = False
+            filled = 0
+            if conn.fec is not None and 0 <= offset < conn.N:
+                # the segments its arrival rebuilds wait in ooo_buffer like any other
+                self.add_recovered(conn, conn.fec.add_data(conn.nextseqnum + offset, curr_segment["payload"]))
+            if offset == 0:
+                delivered = conn.data_buffer.write(curr_segment["payload"])
+                if delivered:
+                    conn.nextseqnum += 1
+                    # the segment may fill a hole, deliver what it makes contiguous
+                    filled = self.deliver_buffered(conn)
+                    conn.cond.notify_all()
+            elif offset < 0:
+                conn.metrics.counts["duplicates"] += 1
+            else:
+                conn.metrics.counts["out_of_order"] += 1
+                if (conn.sack or conn.fec is not None) and offset < conn.N:
+                    # Selective Repeat keeps it for reassembly if it falls inside the window,
+                    # and so does FEC, whose parity may fill the hole before it
+                    conn.ooo_buffer[conn.nextseqnum + offset] = curr_segment["payload"]
+                    if conn.nextseqnum in conn.ooo_buffer:
+                        filled = self.deliver_buffered(conn)
+                        if filled:
+                            conn.cond.notify_all()
+            if conn.fec is not None:
+                conn.fec.advance(conn.nextseqnum)
+            ack_num = conn.nextseqnum
+            sack = self.sack_payload(conn)
+            window = self.advertised_window(conn)
+            conn.ack_counts["segments"] += 1
+            # only plain in-order arrivals wait, the sender needs to hear about holes at once
+            delay_ack = (delivered and not filled and not conn.ooo_buffer
+                         and conn.pending_acks + 1 < self.ack_every)
+            if delay_ack:
+                conn.pending_acks += 1
+                first_pending = conn.pending_acks == 1
+            else:
+                conn.pending_acks = 0
+                conn.last_window = window
+                self.count_ack(conn, sack)
+
+        if delay_ack:
+            if first_pending:
+                self.delayed_acks[conn] = time.monotonic() + self.ack_delay
+            if self.trace:
+                self.log_event(
+                    client_addr[1], self.src_port, curr_segment["seq"], curr_segment["ack"], "DATA",
+                    len(curr_segment["payload"]), f"server received valid seg, seq={seq_num}, ACK delayed", DEBUG)
+            return
+
+        if offset == 0 and not delivered:
+            # a zero window probe, or a segment sent past the window: drop it and
+            # answer with the current window, the client resends it once there is room
+            self.log_event(
+                client_addr[1], self.src_port, curr_segment["seq"], curr_segment["ack"], "DATA",
+                len(curr_segment["payload"]), f"server dropped seg, receive buffer full, seq={seq_num}")
+            self.send_ack(conn, ack_num, sack, window)
+            self.log_event(
+                self.src_port, client_addr[1], 0, ack_num, "ACK",
+                0, f"server sent ACK for dropped seg, ack={ack_num}, window={window}")
+            return
+
+        self.send_ack(conn, ack_num, sack, window)
+        if not self.trace:
+            return
+        if offset == 0:
+            kind = "valid"
+        elif offset < 0:
+            kind = "duplicate"
+        else:
+            kind = "out of order"
+        self.log_event(
+            client_addr[1], self.src_port, curr_segment["seq"], curr_segment["ack"], "DATA",
+            len(curr_segment["payload"]), f"server received {kind} seg, seq={seq_num}", DEBUG)
+        self.log_event(
+            self.src_port, client_addr[1], 0, ack_num, "ACK",
+            0, f"server sent ACK for {kind} seg, ack={ack_num}", DEBUG)
+
+    def process_parity(self, conn, curr_segment):
+        """
+        rebuild the DATA segments a PARITY segment completes, deliver them and ACK at once
+
+        arguments:
+        conn -- the connection the segment belongs to
+        curr_segment -- the parsed PARITY segment
+        """
+        with conn.cond:
+            start = conn.nextseqnum + Segment.seq_diff(curr_segment.seq, conn.nextseqnum, conn.version)
+            recovered = conn.fec.add_parity(start, curr_segment.window, curr_segment.ack, curr_segment.payload)
+            if not self.add_recovered(conn, recovered):
+                return
+            if self.deliver_buffered(conn):
+                conn.cond.notify_all()
+            conn.fec.advance(conn.nextseqnum)
+            ack_num = conn.nextseqnum
+            sack = self.sack_payload(conn)
+            window = conn.last_window = self.advertised_window(conn)
+            conn.pending_acks = 0
+            self.count_ack(conn, sack)
+        self.send_ack(conn, ack_num, sack, window)
+        self.log_event(
+            conn.addr[1], self.src_port, curr_segment.seq, curr_segment.ack, "PARITY",
+            len(curr_segment.payload), f"server rebuilt seq={', '.join(map(str, sorted(recovered)))} from parity")
+        if self.trace:
+            self.log_event(
+                self.src_port, conn.addr[1], 0, ack_num, "ACK",
+                0, f"server sent ACK for rebuilt seg, ack={ack_num}", DEBUG)
+
+    def add_recovered(self, conn, recovered):
+        """
+        put the DATA segments rebuilt from parity into ooo_buffer, the ones
+        still missing from the window
+        called with conn.cond held
+
+        arguments:
+        conn -- the connection
+        recovered -- dict of the rebuilt seqs and their payloads
+
+        returns:
+        int -- the number of segments added
+        """
+        added = 0
+        for seq, payload in recovered.items():
+            if 0 <= seq - conn.nextseqnum < conn.N and seq not in conn.ooo_buffer:
+                conn.ooo_buffer[seq] = payload
+                added += 1
+        conn.metrics.counts["fec_recovered"] += added
+        return added
+
+    def send_ack(self, conn, ack_num, sack, window):
+        """
+        send a data ACK, encoded into the ACK buffer of sgmnt_handler;
+        the caller counts it with count_ack() while it holds conn.cond
+
+        arguments:
+        conn -- the connection
+        ack_num -- the next expected seq
+        sack -- the SACK payload
+        window -- the advertised window
+        """
+        length = Segment.encode_into(self.ack_view,
+                                     seq=0,
+                                     ack=ack_num,
+                                     window=window,
+                                     a_flag=True,
+                                     payload=sack,
+                                     version=conn.version,
+                                     checksum=conn.checksum)
+        self.server_socket.sendto(self.ack_view[:length], conn.addr)
+
+    def count_ack(self, conn, sack):
+        """
+        count a data ACK about to be sent; sgmnt_handler and the application
+        thread (window updates) both send them, so they are counted under conn.cond
+        called with conn.cond held
+
+        arguments:
+        conn -- the connection
+        sack -- the SACK payload of the ACK
+        """
+        conn.ack_counts["acks"] += 1
+        counts = conn.metrics.counts
+        counts["segments_sent"] += 1
+        counts["bytes_sent"] += len(sack)
+
+    def deliver_buffered(self, conn):
+        """
+        move the out-of-order segments that became contiguous into the receive buffer, as far as they fit
+        called with conn.cond held
+
+        arguments:
+        conn -- the connection
+
+        returns:
+        int -- the number of segments delivered
+        """
+        delivered = 0
+        while conn.nextseqnum in conn.ooo_buffer and conn.data_buffer.write(conn.ooo_buffer[conn.nextseqnum]):
+            del conn.ooo_buffer[conn.nextseqnum]
+            conn.nextseqnum += 1
+            delivered += 1
+        return delivered
+
+    def freed_space(self, conn):
+        """
+        after the application read data, deliver the reassembled segments
+        that did not fit before, and send an ACK if any moved (the client
+        does not retransmit segments it saw SACKed) or if the window opened
+        enough to be worth a window update
+        called with conn.cond held
+
+        arguments:
+        conn -- the connection
+        """
+        conn.cond.notify_all()
+        delivered = conn.ooo_buffer and self.deliver_buffered(conn)
+        window = self.advertised_window(conn)
+        # a closed window always reopens with an update, a small growth waits for the next ACK
+        update = window - conn.last_window >= max(conn.N // 2, 1) or (window and not conn.last_window)
+        if not delivered and not update:
+            return
+        conn.pending_acks = 0
+        conn.last_window = window
+        sack = self.sack_payload(conn)
+        self.count_ack(conn, sack)
+        ack_seg = Segment.create_seg(seq=0,
+                                     ack=conn.nextseqnum,
+                                     window=window,
+                                     a_flag=True,
+                                     payload=sack,
+                                     version=conn.version,
+                                     checksum=conn.checksum)
+        self.server_socket.sendto(ack_seg, conn.addr)
+        self.log_event(self.src_port, conn.addr[1], 0, conn.nextseqnum, "ACK",
+                       0, f"server sent window update after the application read, "
+                          f"ack={conn.nextseqnum}, window={window}")
+
+    def advertised_window(self, conn):
+        """
+        return the window to advertise: the segments the receive buffer
+        still has room for after the next expected one, at most N
+        called with conn.cond held
+
+        arguments:
+        conn -- the connection
+        """
+        return min(conn.data_buffer.free() // conn.segment_size, conn.N, Segment.WINDOW_MAX[conn.version])
+
+    def sack_payload(self, conn):
+        """
+        encode the runs of buffered out-of-order segments as SACK blocks
+        return b"" when Selective Repeat is off or nothing is buffered
+
+        arguments:
+        conn -- the connection to report on
+        """
+        if not conn.sack or not conn.ooo_buffer:
+            return b""
+        blocks = []
+        for seq in sorted(conn.ooo_buffer):
+            if blocks and blocks[-1][1] == seq:
+                blocks[-1][1] = seq + 1
+            else:
+                blocks.append([seq, seq + 1])
+        return Segment.encode_sack(blocks, conn.version)
 
     def accept(self):
         """
@@ -271,18 +858,32 @@ class Server:
         return:
         the connection to the client 
         """
-        self.handshake_state = True
-        while self.handshake_state:
-            time.sleep(0.01)
+        with self.state_cond:
+            while not self.accept_queue:
+                self.state_cond.wait()
+            conn = self.accept_queue.popleft()
 
-        print("3-way handshake completed on server.", self.client_addr)
+        print("3-way handshake completed on server.", conn.addr)
         self.log("3-way handshake completed on server.")
-        return self.client_addr
+        return conn
+
+    def lookup(self, conn):
+        """
+        return the Connection for a connection or a client address
+
+        arguments:
+        conn -- a Connection returned by accept(), or the (ip, port) address of its client
+        """
+        if isinstance(conn, Connection):
+            return conn
+        with self.state_cond:
+            return self.connections[tuple(conn)]
 
     def receive(self, conn, length):
         """
         receive data from the given client
-        blocking until the requested amount of data is received
+        blocking until the requested amount of data is received,
+        or less if the client closes the connection first
         
         it should support protection against segment loss/corruption/reordering 
         the client should never overwhelm the server given the receive buffer size
@@ -294,53 +895,190 @@ class Server:
         return:
         data -- the bytes received from the client, guaranteed to be in its original order
         """
-        data = bytearray()
-        if conn != self.client_addr:
-            print("Address disagree")
-
-        self.data_transfer_state = True
-        while len(data) < length:
-            if len(self.data_buffer) > 0:
-                needed = length - len(data)
-                data.extend(self.data_buffer[:needed])
-                self.data_buffer = self.data_buffer[needed:]
-            time.sleep(0.01)
-
-        print("server returning data of length:", len(data))
-        self.log(f"server returning data of length: {len(data)}")
-        return bytes(data)
-
-    def close(self):
-        """
-        close the server and the client if it is still connected
-        blocking until the connection is closed
-        """
-        fin_seg = Segment.create_seg(
-            seq=0,
-            ack=0,
-            window=0,
-            f_flag=True,
-            payload=b"")
-        self.server_socket.sendto(fin_seg, self.client_addr)
-        print(f"[Finish] server sent FIN")
-        self.log_event(
-            self.src_port, self.client_addr[1], 0, 0, "FIN",
-            0, "server sent FIN")
-        self.send_fin_timer.reset_timer()
-        while not self.fin_ack_received:
-            if self.send_fin_timer.is_timeout():
-                self.send_fin_timer.reset_timer()
-                self.server_socket.sendto(fin_seg, self.client_addr)
-                print(f"[Finish] server re-sent FIN (timeout)")
-                self.log_event(
-                    self.src_port, self.client_addr[1], 0, 0, "FIN",
-                    0, "server re-sent FIN")
-            time.sleep(0.01)
+        conn = self.lookup(conn)
+        views = []
+        received = 0
+        with conn.cond:
+            while received < length:
+                if len(conn.data_buffer) > 0:
+                    for view in conn.data_buffer.read_views(length - received):
+                        views.append(view)
+                        received += len(view)
+                    self.freed_space(conn)
+                elif conn.fin_reached:
+                    break
+                else:
+                    conn.cond.wait()
+
+        print("server returning data of length:", received)
+        self.log(f"server returning data of length: {received}")
+        return b"".join(views)
+
+    def receive_into(self, conn, buffer):
+        """
+        receive data from the given client directly into a buffer
+        blocking until the buffer is full, or less if the client closes the connection first
+
+        arguments:
+        conn -- the connection to the client
+        buffer -- a writable bytes-like object (bytearray, memoryview, ...)
+
+        return:
+        the number of bytes written into buffer
+        """
+        conn = self.lookup(conn)
+        target = memoryview(buffer).cast("B")
+        received = 0
+        with conn.cond:
+            while received < len(target):
+                if len(conn.data_buffer) > 0:
+                    received += conn.data_buffer.read_into(target[received:])
+                    self.freed_space(conn)
+                elif conn.fin_reached:
+                    break
+                else:
+                    conn.cond.wait()
+
+        print("server returning data of length:", received)
+        self.log(f"server returning data of length: {received}")
+        return received
 
+    def close(self, conn=None):
+        """
+        close one connection, or the server and every client still connected
+        blocking until the connection(s) are closed
+
+        arguments:
+        conn -- the connection to close, None to close all of them and stop the server
+        """
+        if conn is not None:
+            self.close_connections([self.lookup(conn)])
+            return
+
+        with self.state_cond:
+            conns = list(self.connections.values())
+        self.close_connections(conns)
         self.running = False
         print("server closed")
         self.log("server closed")
         self.rcv_thread.join()
         self.sgmnt_thread.join()
         self.server_socket.close()
+        if self.metrics_server:
+            self.metrics_server.close()
+        self.events.close()
         pass
+
+    def close_connections(self, conns):
+        """
+        send FIN on every connection and wait for all FIN-ACKs
+        a connection its client already closed only finishes its linger
+
+        arguments:
+        conns -- the connections to close
+        """
+        fin_segs = {}
+        for conn in conns:
+            if conn.fin_reached:
+                continue
+            fin_segs[conn] = Segment.create_seg(
+                seq=0,
+                ack=0,
+                window=0,
+                f_flag=True,
+                payload=b"",
+                version=conn.version,
+                checksum=conn.checksum)
+            conn.metrics.enter("teardown")
+            self.server_socket.sendto(fin_segs[conn], conn.addr)
+            with conn.cond:
+                conn.metrics.sent(0)
+            conn.fin_sent_time = time.monotonic()
+            print(f"[Finish] server sent FIN")
+            self.log_event(
+                self.src_port, conn.addr[1], 0, 0, "FIN",
+                0, "server sent FIN")
+            conn.send_fin_timer.reset_timer()
+
+        while True:
+            with self.state_cond:
+                if all(conn.fin_ack_received for conn in conns):
+                    break
+                # woken by a FIN-ACK or the end of a linger, or when the next FIN is due again
+                timeouts = [conn.send_fin_timer.time_left() for conn in fin_segs if not conn.fin_ack_received]
+                self.state_cond.wait(min(timeouts, default=None))
+            for conn, fin_seg in fin_segs.items():
+                if not conn.fin_ack_received and conn.send_fin_timer.is_timeout():
+                    conn.rtt.backoff()
+                    conn.fin_retransmitted = True
+                    conn.send_fin_timer.reset_timer()
+                    self.server_socket.sendto(fin_seg, conn.addr)
+                    with conn.cond:
+                        conn.metrics.sent(0)
+                    print(f"[Finish] server re-sent FIN (timeout)")
+                    self.log_event(
+                        self.src_port, conn.addr[1], 0, 0, "FIN",
+                        0, "server re-sent FIN")
+
+        for conn in conns:
+            self.remove_connection(conn)
+
+    def rtt_stats(self, conn):
+        """
+        return the RTT/RTO statistics of a connection
+
+        arguments:
+        conn -- the connection, or the address of its client
+
+        return:
+        dict -- srtt, rttvar, last_rtt, p50 and p99 (of the last 65536 samples), rto, min_rto,
+                max_rto (seconds), samples, karn_skipped and backoffs (counts)
+        """
+        return self.lookup(conn).rtt.stats()
+
+    def ack_stats(self, conn):
+        """
+        return the ACK counts of a connection
+
+        arguments:
+        conn -- the connection, or the address of its client
+
+        return:
+        dict -- segments (DATA segments received), acks (data ACKs sent)
+                and delayed (those sent by the delayed-ACK timer)
+        """
+        conn = self.lookup(conn)
+        with conn.cond:
+            return dict(conn.ack_counts)
+
+    def stats(self, conn):
+        """
+        return the metrics of a connection
+
+        arguments:
+        conn -- the connection, or the address of its client
+
+        return:
+        dict -- counters (segments and payload bytes sent and received, corrupt_dropped,
+                duplicates, out_of_order, fec_recovered and the ack_stats() counts), gauges (window in
+                segments, buffered in bytes, srtt, rttvar and rto in seconds), rtt (histogram
+                of every RTT sample, see metrics.Histogram.snapshot()) and phases (seconds
+                spent in handshake, transfer and teardown so far)
+        """
+        conn = self.lookup(conn)
+        with conn.cond:
+            counters = dict(conn.metrics.counts)
+            counters.update(conn.ack_counts)
+            gauges = {"window": conn.last_window, "buffered": len(conn.data_buffer),
+                      "srtt": conn.rtt.srtt, "rttvar": conn.rtt.rttvar, "rto": conn.rtt.rto}
+        return {"counters": counters, "gauges": gauges, "rtt": conn.rtt.histogram.snapshot(),
+                "phases": conn.metrics.phase_seconds()}
+
+    def collect_metrics(self):
+        """
+        return the (labels, stats) of every open connection, for the metrics endpoint
+        """
+        with self.state_cond:
+            conns = list(self.connections.values())
+        return [({"role": "server", "local_port": self.src_port, "peer": f"{conn.addr[0]}:{conn.addr[1]}"},
+                 self.stats(conn)) for conn in conns]
@@ -6,17 +6,39 @@
 #   link loss characteristics (i.e., segment loss and bit error 
 #   rate) based on an external file (e.g., loss.txt).
 #
+# Each line of the loss file starts a period:
+#   time loss bitError [delay jitter bandwidth queue reorder duplicate]
+# time in seconds since start, delay and jitter in ms, bandwidth in kbit/s
+# (0 = unlimited), queue in packets (0 = unlimited), reorder and duplicate
+# as probabilities. The optional columns default to 0; with all of them 0
+# packets are forwarded at once, as by the original simulator.
+#
 # Developed as part of a computer networks project at Columbia University.
 #
 
 #!/usr/bin/env python3.10
 import argparse
 from socket import *
+import bisect
+import collections
+import heapq
+import itertools
+import math
 import threading
 import time
 import random
 
 loss = {}
+# the loss file as sorted columns: start times, and the link from each of them on as
+# (pktLoss, bitError, delay s, jitter s, bandwidth bit/s, queue packets, reorder, duplicate)
+lossTimes = []
+lossRates = []
+# before the first period, and the defaults of the optional columns
+NO_LOSS = (0, 0, 0, 0, 0, 0, 0, 0)
+# extra seconds a reordered packet is held, so the packets behind it overtake it
+REORDER_DELAY = 0.01
+# every random decision of the link, seeded with setSeed() to replay a run
+rng = random.Random()
 
 def createSocket(p):
     """
@@ -26,6 +48,8 @@ def createSocket(p):
     p -- the port of the network
     """
     s = socket(AF_INET,SOCK_DGRAM)
+    # bursts should be dropped by the emulated queue, not by the socket buffer (capped by the OS)
+    s.setsockopt(SOL_SOCKET, SO_RCVBUF, 1 << 22)
     s.bind(('',p))
     return s
 
@@ -37,28 +61,185 @@ def setUpLoss(lossFile):
     lossFile -- name of the loss file
     """
     for line in open(lossFile, 'r').readlines():
-        loss[line.split()[0]] = [float(line.split()[1]), float(line.split()[2])]
+        if not line.split():
+            continue
+        columns = [float(c) for c in line.split()[1:]]
+        loss[line.split()[0]] = columns + list(NO_LOSS[len(columns):])
+    table = sorted((int(t), i, rates) for i, (t, rates) in enumerate(loss.items()))
+    lossTimes[:] = [t for t, _, _ in table]
+    lossRates[:] = [linkRates(rates) for _, _, rates in table]
     return True
 
+def linkRates(columns):
+    """
+    converts the columns of a loss file line to the units used when forwarding
+
+    arguments:
+    columns -- loss, bitError, delay (ms), jitter (ms), bandwidth (kbit/s), queue, reorder, duplicate
+    """
+    pktLoss, bitError, delay, jitter, bandwidth, queue, reorder, duplicate = columns
+    return (pktLoss, bitError, delay / 1000, jitter / 1000, bandwidth * 1000, int(queue), reorder, duplicate)
+
+def setSeed(seed):
+    """
+    seeds the link's random number generator
+
+    arguments:
+    seed -- the seed, None to seed from the system
+    """
+    rng.seed(seed)
+
 def getCurrentLoss(st):
     """
     determines current loss rate and bit error of the link
 
+    arguments:
+    st -- the start time of the client connection
+    """
+    return getCurrentLink(st)[:2]
+
+def getCurrentLink(st):
+    """
+    determines every characteristic of the link, as a lossRates entry
+
     arguments:
     st -- the start time of the client connection
     """
     ct = time.time() - st
 
-    lastPktLoss = 0
-    lastBitError = 0
+    # the last entry that started strictly before ct
+    i = bisect.bisect_left(lossTimes, ct)
+    if i == 0:
+        return NO_LOSS
+    return lossRates[i - 1]
+
+def flipBits(d, bitError):
+    """
+    flips every bit of a packet independently with probability bitError
 
-    for t in loss.keys():
-        if ct > int(t):
-            lastPktLoss = loss[t][0]
-            lastBitError = loss[t][1]
-    return lastPktLoss, lastBitError
+    rather than drawing a number per bit, the distance to the next
+    flipped bit is drawn from a geometric distribution, so the cost
+    grows with the number of flips and not with the packet size
 
-def handleMessage(ns, ca, sa, st): 
+    arguments:
+    d -- the packet, a bytearray changed in place
+    bitError -- the bit error rate
+    """
+    bits = len(d) * 8
+    if bitError <= 0:
+        return
+    if bitError >= 1:
+        for i in range(len(d)):
+            d[i] ^= 0xff
+        return
+    logKeep = math.log1p(-bitError)
+    pos = -1
+    while True:
+        # bits skipped before the next flip; 1 - random() is in (0, 1]
+        pos += 1 + int(math.log(1.0 - rng.random()) / logKeep)
+        if pos >= bits:
+            return
+        d[pos >> 3] ^= 1 << (pos & 7)
+
+class Link:
+    """
+    one direction of the emulated link: a bottleneck of limited bandwidth
+    with a drop-tail queue, followed by a propagation delay with jitter
+
+    packets are scheduled on a heap by delivery time and sent by the
+    link's own thread, so each direction is delayed independently
+    """
+    def __init__(self, ns, addr):
+        """
+        creates the link and starts its thread
+
+        arguments:
+        ns -- the network socket
+        addr -- the address the link delivers to
+        """
+        self.ns = ns
+        self.addr = addr
+        # (delivery time, arrival order, packet)
+        self.heap = []
+        self.order = itertools.count()
+        self.cond = threading.Condition()
+        # when the bottleneck finishes sending the last queued packet
+        self.busyUntil = 0
+        # when the packets still in the queue leave it
+        self.departures = collections.deque()
+        # jitter never reorders, only the reorder probability does
+        self.lastDelivery = 0
+        self.queueDrops = 0
+        self.stopped = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def busy(self):
+        """
+        returns whether packets are still queued or in flight on the link
+        """
+        return bool(self.heap)
+
+    def schedule(self, d, rates):
+        """
+        queues a packet, or drops it when the queue is full
+
+        arguments:
+        d -- the packet
+        rates -- the current lossRates entry
+        """
+        _, _, delay, jitter, bandwidth, queue, reorder, _ = rates
+        now = time.time()
+        with self.cond:
+            while self.departures and self.departures[0] <= now:
+                self.departures.popleft()
+            if queue and len(self.departures) >= queue:
+                self.queueDrops += 1
+                return
+            self.busyUntil = max(now, self.busyUntil)
+            if bandwidth:
+                self.busyUntil += len(d) * 8 / bandwidth
+            self.departures.append(self.busyUntil)
+
+            t = self.busyUntil + delay
+            if jitter:
+                t = max(t + rng.uniform(-jitter, jitter), self.busyUntil)
+            if reorder and rng.random() < reorder:
+                t += REORDER_DELAY
+            else:
+                t = max(t, self.lastDelivery)
+                self.lastDelivery = t
+            heapq.heappush(self.heap, (t, next(self.order), d))
+            self.cond.notify()
+
+    def stop(self):
+        """
+        drops the packets still queued and ends the link's thread
+        """
+        with self.cond:
+            self.stopped = True
+            self.heap.clear()
+            self.cond.notify()
+        self.thread.join()
+
+    def run(self):
+        """
+        sends every packet at its delivery time
+        """
+        while True:
+            with self.cond:
+                while not self.heap and not self.stopped:
+                    self.cond.wait()
+                if self.stopped:
+                    return
+                wait = self.heap[0][0] - time.time()
+                if wait > 0:
+                    self.cond.wait(wait)
+                    continue
+                _, _, d = heapq.heappop(self.heap)
+            self.ns.sendto(d, self.addr)
+
+def handleMessage(ns, ca, sa, st, stop=None):
     """
     handling the server's response (data)
 
@@ -67,24 +248,51 @@ def handleMessage(ns, ca, sa, st):
     ca - the client address
     sa - the server address
     st - the connection start time
+    stop - a threading.Event, the forwarder returns at the first datagram
+           after it is set (see stopForwarder()); None to forward forever
     """
-    buff_size = 2000000000
+    # the largest UDP datagram
+    buff_size = 65535
+    links = {ca: Link(ns, ca), sa: Link(ns, sa)}
     while True:
         c, a = ns.recvfrom(buff_size)
-        pktLoss, bitError = getCurrentLoss(st)
-        if random.random() <= pktLoss:
+        if stop is not None and stop.is_set():
+            for link in links.values():
+                link.stop()
+            return
+        rates = getCurrentLink(st)
+        pktLoss, bitError = rates[0], rates[1]
+        if rng.random() <= pktLoss:
             continue
         else:
-            d = bytearray(c)
-            for i in range(len(d)):
-                for j in range(8):
-                    if random.random() <= bitError:
-                        d[i] = d[i] ^ (1 << j)
-            if a == sa:
-              ns.sendto(d, ca)
-            else:
-              ns.sendto(d, sa)
+            d = c
+            if bitError > 0:
+                d = bytearray(c)
+                flipBits(d, bitError)
+            link = links[ca] if a == sa else links[sa]
+            if not any(rates[2:]) and not link.busy():
+                # nothing to emulate, forward at once
+                ns.sendto(d, link.addr)
+                continue
+            copies = 2 if rates[7] and rng.random() < rates[7] else 1
+            for _ in range(copies):
+                link.schedule(d, rates)
   
+def stopForwarder(ns, stop, thread):
+    """
+    ends a handleMessage() thread started with stop and closes its socket
+
+    arguments:
+    ns -- the network socket
+    stop -- the threading.Event given to handleMessage()
+    thread -- the thread running handleMessage()
+    """
+    stop.set()
+    # wake up the blocking recvfrom() with an empty datagram
+    ns.sendto(b"", ("127.0.0.1", ns.getsockname()[1]))
+    thread.join()
+    ns.close()
+
 if __name__ == '__main__':
     # accepts commandline arguments
     parser = argparse.ArgumentParser(
@@ -96,11 +304,13 @@ if __name__ == '__main__':
     parser.add_argument('serverAddr', type=str)
     parser.add_argument('serverPort', type=int, choices=range(49151,65535), metavar='serverPort: (49151 – 65535)')
     parser.add_argument('lossFile', type=str)
+    parser.add_argument('--seed', type=int, default=None, help='seed of the loss and bit errors, to replay a run')
 
     args = parser.parse_args()
 
     # reads in loss file and connects required sockets
     setup = setUpLoss(args.lossFile)
+    setSeed(args.seed)
 
     clientAddr = (args.clientAddr, args.clientPort)
     serverAddr = (args.serverAddr, args.serverPort)
@@ -0,0 +1,73 @@
+#
+# Mini Reliable Transport - Pacing
+# Token bucket spreading the client's new DATA segments over the RTT
+#
+# Without pacing, the window goes out back to back at the speed of the
+# local interface: after the handshake, after a timeout and whenever a
+# cumulative ACK opens the window by many segments. Such a burst arrives at
+# the bottleneck faster than it drains and overflows its queue even when the
+# window fits the path. With pacing the sender takes a token per byte from
+# a bucket refilled at the pacing rate, so a window is spread over one RTT.
+#
+
+import time
+
+# the pacing rate is this multiple of window / SRTT, above 1 so that pacing
+# alone never holds the sender below its window (slow start doubles the
+# window every RTT and gets a larger gain, as in Linux)
+PACING_GAIN = 1.25
+SLOW_START_GAIN = 2.0
+# the bucket holds the bytes of this many seconds at the pacing rate, at
+# least MIN_BURST segments: waits shorter than the wake-up latency of a
+# thread (tens of microseconds) would only cost CPU time
+PACING_QUANTUM = 0.001
+MIN_BURST = 2
+
+
+class TokenBucket:
+    """
+    tokens (bytes) refilled at a constant rate up to a burst size, on the
+    time.perf_counter() clock
+    """
+    def __init__(self, rate, burst):
+        """
+        start with a full bucket
+
+        arguments:
+        rate -- the refill rate in bytes/s
+        burst -- the capacity of the bucket in bytes
+        """
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.perf_counter()
+
+    def set_rate(self, rate, burst):
+        """
+        change the refill rate and the capacity, the tokens refilled so far at the old rate are kept
+        """
+        self.refill()
+        self.rate = rate
+        self.burst = burst
+        self.tokens = min(self.tokens, burst)
+
+    def refill(self):
+        now = time.perf_counter()
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def take(self, size):
+        """
+        take the tokens of size bytes if the bucket has them
+
+        arguments:
+        size -- the number of bytes to send
+
+        returns:
+        float -- 0 if the tokens were taken, otherwise the seconds until the bucket has them
+        """
+        self.refill()
+        if self.tokens >= size:
+            self.tokens -= size
+            return 0
+        return (size - self.tokens) / self.rate
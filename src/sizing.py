@@ -0,0 +1,195 @@
+#
+# Mini Reliable Transport - Segment Sizing
+# Path MTU probing at connect time, and segment sizes adapted to the loss
+# measured per segment length
+#
+# network.py flips every bit independently, so a segment of L bytes arrives
+# intact with probability (1 - BER)^(8L): its loss grows exponentially with
+# its length while the cost of the headers per payload byte shrinks. The
+# client counts per segment length how many segments it had to resend,
+# estimates the BER from how that loss grows with the length, and cuts new
+# segments as long as they can be while losing at most TARGET_LOSS of them.
+#
+# The size announced in the SYN is the ceiling. A shorter segment always
+# fits the server's window, which is counted in segments of the announced
+# size, so the size changes mid-connection without any message.
+#
+
+import math
+import socket
+import sys
+
+# UDP payload sizes of the SYN probes, largest first: the IPv4 UDP maximum,
+# a 9000-byte jumbo frame, a 1500-byte Ethernet frame, the IPv6 minimum MTU
+# and the IPv4 minimum reassembly size, all minus the IPv4 and UDP headers
+PROBE_SIZES = (65507, 8972, 1472, 1232, 548)
+# SYNs sent at one size before the next smaller one is tried, so a single
+# random loss does not lower the size
+PROBE_TRIES = 2
+# the IPv4 and UDP headers of every datagram
+IP_UDP_OVERHEAD = 28
+# getsockopt() option of the path MTU of a connected socket on Linux, missing from the socket module
+IP_MTU = 14
+
+# segments are never cut shorter than this many payload bytes
+MIN_PAYLOAD = 64
+# until the first estimate, segments are cut to at most this length: a
+# segment keeps its length when it is resent, so the first window must not be
+# too long for the BER, and on a clean path the length doubles every update
+INITIAL_LENGTH = 512
+# the size is chosen again every UPDATE_EVERY segments counted, and the counts
+# are halved every HORIZON, so the estimate follows a BER that changes
+UPDATE_EVERY = 16
+HORIZON = 512
+# segments of a length counted before its loss rate is used
+MIN_SAMPLES = 32
+# every EXPLORE_EVERY payloads one is cut into half as many pieces, so that
+# the loss of a second length is measured
+EXPLORE_EVERY = 4
+# the share of segments the bit errors may destroy: a lost segment costs more
+# than its bytes, its recovery shrinks the congestion window and may wait for
+# the RTO, while every datagram costs the same per-packet work, so very short
+# segments are slow too
+TARGET_LOSS = 0.08
+
+
+def path_mtu(addr):
+    """
+    return the MTU the kernel knows for the path to addr (Linux), None where it cannot tell
+
+    arguments:
+    addr -- the (address, port) of the peer
+    """
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as probe:
+            probe.connect(addr)
+            return probe.getsockopt(socket.IPPROTO_IP, IP_MTU)
+    except OSError:
+        return None
+
+
+def probe_sizes(segment_size, addr):
+    """
+    return the segment sizes the SYN probes try, largest first: segment_size
+    (lowered to the kernel's path MTU), then every PROBE_SIZES entry below it
+
+    arguments:
+    segment_size -- the largest segment size wanted (including the header)
+    addr -- the (address, port) of the peer
+    """
+    mtu = path_mtu(addr)
+    largest = segment_size if mtu is None else min(segment_size, mtu - IP_UDP_OVERHEAD)
+    return [largest] + [size for size in PROBE_SIZES if size < largest]
+
+
+class SegmentSizer:
+    """
+    the loss rate of the client's DATA segments per length, and the number
+    of pieces each segment of the negotiated size is cut into
+
+    a segment cut into k pieces carries about max_payload / k bytes; the
+    lengths are counted by k, the same way they are chosen
+    """
+    def __init__(self, max_payload, header_size):
+        """
+        arguments:
+        max_payload -- the payload of a segment of the negotiated size
+        header_size -- the MRT header size of the connection
+        """
+        self.max_payload = max_payload
+        self.header_size = header_size
+        self.max_pieces = max(1, max_payload // MIN_PAYLOAD)
+        # pieces -> [segments counted, segments among them that had to be resent]
+        self.outcomes = {}
+        self.recorded = 0
+        self.payloads = 0
+        self.pieces = min(-(-max_payload // (INITIAL_LENGTH - header_size)), self.max_pieces)
+        self.ber = 0.0
+
+    def length(self, pieces):
+        """
+        return the encoded length of a segment cut into pieces
+        """
+        return self.header_size + -(-self.max_payload // pieces)
+
+    def cut(self):
+        """
+        return the number of pieces to cut the next payload of the negotiated size into:
+        self.pieces, and every EXPLORE_EVERY payloads half as many
+        """
+        self.payloads += 1
+        if self.pieces > 1 and self.payloads % EXPLORE_EVERY == 0:
+            return (self.pieces + 1) // 2
+        return self.pieces
+
+    def record(self, length, lost):
+        """
+        count a DATA segment once the fate of its first transmission is known: lost
+        when it is first resent as a known hole, or delivered when acknowledged
+        without a retransmission; the rest of a resent Go-Back-N window is not counted
+
+        arguments:
+        length -- the encoded length of the segment
+        lost -- whether it is being resent
+        """
+        payload = length - self.header_size
+        pieces = self.max_pieces
+        if payload > 0:
+            pieces = min(max(1, round(self.max_payload / payload)), self.max_pieces)
+        outcome = self.outcomes.get(pieces)
+        if outcome is None:
+            outcome = self.outcomes[pieces] = [0, 0]
+        outcome[0] += 1
+        if lost:
+            outcome[1] += 1
+        self.recorded += 1
+        if self.recorded % UPDATE_EVERY == 0:
+            self.update()
+        if self.recorded == HORIZON:
+            self.recorded = 0
+            for outcome in self.outcomes.values():
+                outcome[0] /= 2
+                outcome[1] /= 2
+
+    def update(self):
+        """
+        estimate the BER from the lengths with MIN_SAMPLES segments and choose the pieces
+
+        ln(survival) falls by 8 * BER per byte of length. With lengths at
+        least a factor 1.5 apart, a least-squares line separates bit errors from
+        loss that does not depend on the length (e.g. a full queue), which only
+        its intercept changes; otherwise the whole loss is taken as bit errors.
+        The segments at most double per update, shorter ones are cut at once.
+        """
+        points = []
+        for pieces, (sent, lost) in self.outcomes.items():
+            if sent >= MIN_SAMPLES:
+                survived = min(max(sent - lost, 0.5), sent)
+                points.append((8 * self.length(pieces), math.log(survived / sent), sent))
+        if not points:
+            return
+        if max(points)[0] < 1.5 * min(points)[0]:
+            ber = -sum(log * weight for _, log, weight in points) / sum(bits * weight for bits, _, weight in points)
+        else:
+            total = sum(weight for _, _, weight in points)
+            mean_bits = sum(bits * weight for bits, _, weight in points) / total
+            mean_log = sum(log * weight for _, log, weight in points) / total
+            spread = sum(weight * (bits - mean_bits) ** 2 for bits, _, weight in points)
+            slope = sum(weight * (bits - mean_bits) * (log - mean_log) for bits, log, weight in points) / spread
+            ber = max(0.0, -slope)
+        self.ber = ber
+        self.pieces = max(self.best_pieces(ber), self.pieces // 2)
+
+    def best_pieces(self, ber):
+        """
+        return the fewest pieces whose segments the BER destroys at most TARGET_LOSS of
+
+        (1 - BER)^(8L) >= 1 - TARGET_LOSS for L <= -ln(1 - TARGET_LOSS) / (8 * BER)
+        """
+        if ber <= 0:
+            return 1
+        longest = -math.log(1 - TARGET_LOSS) / (8 * ber)
+        pieces = math.ceil(self.max_payload / max(longest - self.header_size, 1))
+        return min(max(pieces, 1), self.max_pieces)
@@ -0,0 +1,24 @@
+#
+# pytest configuration
+# The modules in src/ import each other by name, as when run from there.
+#
+
+import os
+import socket
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+
+@pytest.fixture
+def free_port():
+    """
+    return a function giving a UDP port nothing is bound to
+    """
+    def pick():
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as probe:
+            probe.bind(("127.0.0.1", 0))
+            return probe.getsockname()[1]
+    return pick
@@ -0,0 +1,99 @@
+import threading
+
+import pytest
+
+from Segment import Segment
+from mrt_client import Client
+from mrt_server import Server
+
+
+@pytest.fixture(autouse=True)
+def in_tmp_path(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+
+@pytest.mark.parametrize("checksum", sorted(Segment.CHECKSUMS))
+@pytest.mark.parametrize("version", [1, 2])
+def test_segments_round_trip_with_every_checksum(checksum, version):
+    for payload in (b"", b"payload bytes"):
+        seg = Segment.create_seg(seq=5, ack=9, window=3, d_flag=True, payload=payload, version=version,
+                                 checksum=checksum)
+        buffer = memoryview(bytearray(len(seg)))
+        assert Segment.encode_into(buffer, seq=5, ack=9, window=3, d_flag=True, payload=payload, version=version,
+                                   checksum=checksum) == len(seg)
+        assert bytes(buffer) == seg
+        parsed = Segment.parse_seg(seg, checksum)
+        assert parsed.valid and bytes(parsed.payload) == payload
+
+
+@pytest.mark.parametrize("checksum", sorted(set(Segment.CHECKSUMS) - {"none"}))
+def test_corruption_is_detected(checksum):
+    seg = bytearray(Segment.create_seg(seq=1, ack=0, window=0, d_flag=True, payload=b"abcdef", version=2,
+                                       checksum=checksum))
+    seg[-1] ^= 0x04
+    assert not Segment.parse_seg(seg, checksum).valid
+
+
+def test_none_leaves_the_field_zero_and_trusts_the_segment():
+    seg = bytearray(Segment.create_seg(seq=1, ack=0, window=0, d_flag=True, payload=b"abcdef", version=2,
+                                       checksum="none"))
+    assert Segment.parse_seg(seg, "none").checksum == 0
+    seg[-1] ^= 0x04
+    assert Segment.parse_seg(seg, "none").valid
+
+
+def test_syn_always_uses_crc32():
+    syn = Segment.create_seg(seq=0, ack=0, window=0, s_flag=True, payload=b"500", version=2, checksum="adler32")
+    assert syn == Segment.create_seg(seq=0, ack=0, window=0, s_flag=True, payload=b"500", version=2)
+    assert Segment.parse_seg(syn, "none").valid
+
+
+def test_unknown_checksum_is_rejected(free_port):
+    with pytest.raises(ValueError):
+        Client().init(free_port(), "127.0.0.1", free_port(), 500, checksum="md5", log_level="off")
+    with pytest.raises(ValueError):
+        Server().init(free_port(), 8000, checksums=["crc32", "md5"], log_level="off")
+
+
+def negotiate(free_port, requested, checksums=None):
+    """
+    connect a client asking for the requested checksum, transfer some data and
+    return the algorithm each side used
+    """
+    server = Server()
+    server.init(free_port(), 8000, checksums=checksums, log_level="off")
+    client = Client()
+    client.init(free_port(), "127.0.0.1", server.src_port, 500, checksum=requested, log_level="off")
+    data = bytes(range(256)) * 20
+    received = []
+    accepted = []
+
+    def serve():
+        conn = server.accept()
+        accepted.append(conn.checksum)
+        received.append(server.receive(conn, len(data)))
+
+    receiver = threading.Thread(target=serve)
+    receiver.start()
+    try:
+        client.connect()
+        client.send(data)
+        receiver.join(10)
+        client.close()
+    finally:
+        server.close()
+    assert received == [data]
+    return client.checksum, accepted[0]
+
+
+def test_negotiated_checksum_is_used_by_both_sides(free_port):
+    assert negotiate(free_port, "adler32") == ("adler32", "adler32")
+
+
+def test_none_is_refused_unless_the_server_lists_it(free_port):
+    assert negotiate(free_port, "none") == ("crc32", "crc32")
+    assert negotiate(free_port, "none", checksums=["none"]) == ("none", "none")
+
+
+def test_checksum_outside_the_server_list_falls_back_to_crc32(free_port):
+    assert negotiate(free_port, "adler32", checksums=["none"]) == ("crc32", "crc32")
@@ -0,0 +1,91 @@
+import itertools
+import random
+
+import pytest
+
+from fec import ParityEncoder, ParityGroups, coefficients
+
+
+def encode(k, m, payloads, start=0):
+    """
+    return the parity group of the payloads: (first seq, count, parity payloads)
+    """
+    encoder = ParityEncoder(k, m)
+    for offset, payload in enumerate(payloads):
+        encoder.add(start + offset, payload)
+    return encoder.flush()
+
+
+def deliver(k, m, payloads, parity, lost, start=0):
+    """
+    feed a receiver every DATA and PARITY segment of a group but the lost ones
+    (indexes below len(payloads) are DATA, the rest PARITY) and return what it rebuilt
+    """
+    groups = ParityGroups(k, m)
+    rebuilt = {}
+    for offset, payload in enumerate(payloads):
+        if offset not in lost:
+            rebuilt.update(groups.add_data(start + offset, payload))
+    for index, payload in enumerate(parity):
+        if len(payloads) + index not in lost:
+            rebuilt.update(groups.add_parity(start, len(payloads), index, payload))
+    return rebuilt
+
+
+@pytest.mark.parametrize("k, m", [(4, 1), (4, 2), (6, 3)])
+def test_any_m_lost_segments_are_rebuilt(k, m):
+    rng = random.Random(k * 10 + m)
+    # uneven lengths, trailing zero bytes and an empty payload
+    payloads = [rng.randbytes(rng.randrange(1, 60)) for _ in range(k - 2)] + [b"tail\0\0", b""]
+    start, count, parity = encode(k, m, payloads, start=1000)
+    assert (start, count, len(parity)) == (1000, k, m)
+    for lost in itertools.combinations(range(k + m), m):
+        rebuilt = deliver(k, m, payloads, parity, set(lost), start=1000)
+        assert rebuilt == {1000 + i: payloads[i] for i in lost if i < k}
+
+
+def test_single_parity_is_the_xor_of_the_symbols():
+    _, _, [parity] = encode(2, 1, [b"\x01\x02", b"\x10"])
+    # each symbol is the 2-byte little-endian length, then the payload
+    assert parity == bytes([2 ^ 1, 0, 0x01 ^ 0x10, 0x02])
+
+
+def test_more_than_m_lost_is_not_rebuilt():
+    payloads = [b"a" * 10, b"b" * 10, b"c" * 10, b"d" * 10]
+    _, _, parity = encode(4, 2, payloads)
+    assert deliver(4, 2, payloads, parity, {0, 1, 2}) == {}
+    assert deliver(4, 2, payloads, parity, {0, 1, 4}) == {}
+
+
+def test_short_group_flushed_early():
+    payloads = [b"first", b"second"]
+    start, count, parity = encode(4, 2, payloads, start=7)
+    assert (start, count) == (7, 2)
+    assert deliver(4, 2, payloads, parity, {0, 1}, start=7) == {7: b"first", 8: b"second"}
+
+
+def test_parity_before_data():
+    payloads = [b"x" * 5, b"y" * 9, b"z" * 3]
+    _, _, parity = encode(3, 1, payloads)
+    groups = ParityGroups(3, 1)
+    assert groups.add_parity(0, 3, 0, parity[0]) == {}
+    assert groups.add_data(0, payloads[0]) == {}
+    assert groups.add_data(2, payloads[2]) == {1: payloads[1]}
+
+
+def test_advance_forgets_delivered_groups():
+    groups = ParityGroups(4, 1)
+    groups.add_parity(0, 4, 0, b"\0" * 4)
+    for seq in range(10):
+        groups.add_data(seq, b"p")
+    groups.advance(10)
+    assert groups.groups == {}
+    assert min(groups.data) == groups.floor == 6
+    # too old to belong to a group any more
+    assert groups.add_data(3, b"late") == {}
+
+
+@pytest.mark.parametrize("k, m", [(0, 1), (1, 0), (200, 57)])
+def test_invalid_group_sizes(k, m):
+    with pytest.raises(ValueError):
+        coefficients(k, m)
@@ -0,0 +1,44 @@
+from mrt_server import ReceiveBuffer
+
+
+def test_write_refuses_payloads_past_capacity():
+    buffer = ReceiveBuffer(10)
+    assert buffer.write(b"abcdef")
+    assert not buffer.write(b"ghijk")
+    assert len(buffer) == 6 and buffer.free() == 4
+    assert buffer.write(b"ghij")
+    assert buffer.free() == 0
+    assert not buffer.write(b"k")
+    # an empty payload always fits and queues nothing
+    assert buffer.write(b"")
+    assert len(buffer.chunks) == 2
+
+
+def test_reads_free_space_across_chunks():
+    buffer = ReceiveBuffer(8)
+    buffer.write(b"abc")
+    buffer.write(b"defgh")
+    assert b"".join(buffer.read_views(4)) == b"abcd"
+    assert (len(buffer), buffer.free()) == (4, 4)
+    assert buffer.write(b"ijkl")
+    assert b"".join(buffer.read_views(100)) == b"efghijkl"
+    assert (len(buffer), buffer.free(), buffer.offset) == (0, 8, 0)
+    assert buffer.read_views(5) == []
+
+
+def test_read_into_a_smaller_buffer():
+    buffer = ReceiveBuffer(16)
+    buffer.write(b"0123456789")
+    target = bytearray(4)
+    assert buffer.read_into(target) == 4
+    assert target == b"0123"
+    target = bytearray(10)
+    assert buffer.read_into(memoryview(target)[2:]) == 6
+    assert target == b"\x00\x00456789\x00\x00"
+    assert len(buffer) == 0
+
+
+def test_zero_capacity():
+    buffer = ReceiveBuffer(0)
+    assert not buffer.write(b"x")
+    assert buffer.free() == 0 and len(buffer) == 0
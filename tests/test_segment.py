@@ -0,0 +1,79 @@
+import pytest
+
+from Segment import Segment
+
+
+@pytest.mark.parametrize("version, modulo", [(1, 1 << 8), (2, 1 << 32)])
+def test_seq_diff_across_wraparound(version, modulo):
+    assert Segment.seq_diff(2, modulo - 3, version) == 5
+    assert Segment.seq_diff(modulo - 3, 2, version) == -5
+    assert Segment.seq_diff(0, modulo - 1, version) == 1
+
+
+@pytest.mark.parametrize("version, modulo", [(1, 1 << 8), (2, 1 << 32)])
+def test_seq_diff_half_space(version, modulo):
+    half = modulo // 2
+    assert Segment.seq_diff(half - 1, 0, version) == half - 1
+    # half the space apart is taken as behind, never ahead
+    assert Segment.seq_diff(half, 0, version) == -half
+
+
+@pytest.mark.parametrize("version", [1, 2])
+def test_seq_diff_maps_wire_numbers_back(version):
+    modulo = Segment.SEQ_MODULO[version]
+    base = 5 * modulo - 10
+    for absolute in range(base - Segment.WINDOW_MAX[version], base + Segment.WINDOW_MAX[version]):
+        assert base + Segment.seq_diff(absolute % modulo, base, version) == absolute
+
+
+@pytest.mark.parametrize("version", [1, 2])
+def test_wrapped_seq_and_ack_round_trip(version):
+    modulo = Segment.SEQ_MODULO[version]
+    seg = Segment.create_seg(seq=modulo + 7, ack=3 * modulo - 1, window=4, d_flag=True, payload=b"abc",
+                             version=version)
+    parsed = Segment.parse_seg(seg)
+    assert parsed.valid
+    assert (parsed.seq, parsed.ack, parsed.version) == (7, modulo - 1, version)
+    assert bytes(parsed.payload) == b"abc"
+
+
+def test_window_capped_below_half_the_v1_space():
+    seg = Segment.parse_seg(Segment.create_seg(seq=0, ack=0, window=200, a_flag=True, version=1))
+    assert seg.window == Segment.WINDOW_MAX[1] == 127
+
+
+@pytest.mark.parametrize("version", [1, 2])
+def test_sack_blocks_round_trip(version):
+    blocks = [(3, 5), (8, 9), (12, 20)]
+    payload = Segment.encode_sack(blocks, version)
+    assert len(payload) == 3 * Segment.SACK_BLOCK.size
+    assert Segment.decode_sack(payload) == blocks
+
+
+@pytest.mark.parametrize("version", [1, 2])
+def test_sack_blocks_carry_wire_numbers(version):
+    modulo = Segment.SEQ_MODULO[version]
+    payload = Segment.encode_sack([(modulo - 2, modulo + 3)], version)
+    [(start, end)] = Segment.decode_sack(payload)
+    assert (start, end) == (modulo - 2, 3)
+    # mapped back next to the send base like the cumulative ACK
+    base = modulo - 4
+    assert base + Segment.seq_diff(end, base, version) == modulo + 3
+
+
+def test_sack_blocks_limited_to_max():
+    blocks = [(i, i + 1) for i in range(0, 20, 2)]
+    assert Segment.decode_sack(Segment.encode_sack(blocks, 2)) == blocks[:Segment.MAX_SACK_BLOCKS]
+
+
+def test_decode_sack_ignores_a_truncated_block():
+    payload = Segment.encode_sack([(1, 2), (4, 6)], 2)
+    assert Segment.decode_sack(payload[:-3]) == [(1, 2)]
+    assert Segment.decode_sack(b"") == []
+
+
+def test_sack_payload_survives_an_ack():
+    sack = Segment.encode_sack([(10, 12)], 2)
+    ack = Segment.parse_seg(Segment.create_seg(seq=0, ack=7, window=8, a_flag=True, payload=sack, version=2))
+    assert ack.valid and ack.ACK
+    assert Segment.decode_sack(ack.payload) == [(10, 12)]
@@ -0,0 +1,94 @@
+import asyncio
+import socket
+import threading
+import time
+
+import pytest
+
+from Segment import Segment
+from mrt_client import Client
+from mrt_server import Server
+
+MALFORMED = [
+    b"",
+    b"abc",
+    # checksum-valid SYNs without a usable segment size
+    Segment.create_seg(seq=1, ack=0, window=0, s_flag=True, payload=b"xyz"),
+    Segment.create_seg(seq=1, ack=0, window=0, s_flag=True, payload=b"0"),
+    Segment.create_seg(seq=1, ack=0, window=0, s_flag=True, payload=b"\xff\xfe"),
+    Segment.create_seg(seq=1, ack=0, window=0, s_flag=True, payload=b""),
+]
+
+
+@pytest.fixture
+def server(free_port, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    server = Server()
+    server.init(free_port(), 8000, log_level="off")
+    yield server
+    server.close()
+
+
+def transfer(server, client, data):
+    """
+    send data from client to server and return what the server received
+    """
+    received = []
+    receiver = threading.Thread(target=lambda: received.append(server.receive(server.accept(), len(data))))
+    receiver.start()
+    client.connect()
+    client.send(data)
+    receiver.join(10)
+    client.close()
+    return received[0]
+
+
+def test_server_survives_malformed_datagrams(server, free_port):
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as raw:
+        for datagram in MALFORMED:
+            raw.sendto(datagram, ("127.0.0.1", server.src_port))
+    # let sgmnt_handler go through them
+    time.sleep(0.2)
+    assert server.sgmnt_thread.is_alive()
+    assert server.connections == {}
+
+    client = Client()
+    client.init(free_port(), "127.0.0.1", server.src_port, 500, log_level="off")
+    assert transfer(server, client, b"x" * 3000) == b"x" * 3000
+
+
+def test_short_datagram_on_a_connection_is_counted_as_corrupt(server, free_port):
+    client = Client()
+    client.init(free_port(), "127.0.0.1", server.src_port, 500, log_level="off")
+    client.connect()
+    conn = server.accept()
+    client.client_socket.sendto(b"abc", ("127.0.0.1", server.src_port))
+    client.send(b"y" * 2000)
+    assert server.receive(conn, 2000) == b"y" * 2000
+    assert server.stats(conn)["counters"]["corrupt_dropped"] >= 1
+    assert server.sgmnt_thread.is_alive()
+    client.close()
+
+
+def test_async_server_survives_malformed_datagrams(free_port):
+    from mrt_async import AsyncClient, AsyncServer
+
+    async def run():
+        server = AsyncServer()
+        await server.init(free_port(), 8000, log=False)
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as raw:
+            for datagram in MALFORMED:
+                raw.sendto(datagram, ("127.0.0.1", server.src_port))
+        await asyncio.sleep(0.1)
+        assert server.connections == {}
+        client = AsyncClient()
+        await client.init(0, "127.0.0.1", server.src_port, 500, log=False)
+        await client.connect()
+        conn = await server.accept()
+        await client.send(b"z" * 3000)
+        data = await server.receive(conn, 3000)
+        await client.close()
+        await server.close()
+        return data
+
+    assert asyncio.run(asyncio.wait_for(run(), 10)) == b"z" * 3000
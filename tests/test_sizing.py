@@ -0,0 +1,80 @@
+import math
+import random
+
+import pytest
+
+from sizing import SegmentSizer, EXPLORE_EVERY, HORIZON, TARGET_LOSS, UPDATE_EVERY, probe_sizes, PROBE_SIZES
+
+
+def simulate(sizer, ber, segments, rng):
+    """
+    cut and record segments, each lost with the probability bit errors destroy it
+    """
+    for _ in range(segments):
+        length = sizer.length(sizer.cut())
+        sizer.record(length, rng.random() > (1 - ber) ** (8 * length))
+
+
+def test_starts_below_the_initial_length():
+    sizer = SegmentSizer(1440, 16)
+    assert sizer.pieces == 3
+    assert sizer.length(sizer.pieces) <= 512
+
+
+def test_every_explore_every_payload_is_cut_in_half_as_many_pieces():
+    sizer = SegmentSizer(1440, 16)
+    sizer.pieces = 6
+    cuts = [sizer.cut() for _ in range(2 * EXPLORE_EVERY)]
+    assert cuts.count(3) == 2 and cuts.count(6) == 2 * EXPLORE_EVERY - 2
+
+
+def test_clean_path_grows_to_the_negotiated_size():
+    sizer = SegmentSizer(1440, 16)
+    simulate(sizer, 0.0, 20 * UPDATE_EVERY, random.Random(1))
+    assert sizer.pieces == 1
+    assert sizer.ber == 0.0
+
+
+@pytest.mark.parametrize("ber", [2e-5, 1e-4])
+def test_bit_errors_shrink_segments_to_the_target_loss(ber):
+    sizer = SegmentSizer(1440, 16)
+    simulate(sizer, ber, 4 * HORIZON, random.Random(2))
+    # an estimate from a few hundred losses, right within a factor of two
+    assert ber / 2 <= sizer.ber <= 2 * ber
+    length = sizer.length(sizer.pieces)
+    # the chosen segments lose about TARGET_LOSS, the next longer ones more
+    assert 1 - (1 - ber) ** (8 * length) <= 2 * TARGET_LOSS
+    if sizer.pieces > 1:
+        assert 1 - (1 - ber) ** (8 * sizer.length(sizer.pieces - 1)) > TARGET_LOSS / 2
+
+
+def test_loss_independent_of_length_is_not_taken_for_bit_errors():
+    sizer = SegmentSizer(1440, 16)
+    rng = random.Random(3)
+    for _ in range(4 * HORIZON):
+        sizer.record(sizer.length(sizer.cut()), rng.random() < 0.05)
+    assert sizer.pieces <= 2
+
+
+def test_best_pieces_bounds():
+    sizer = SegmentSizer(1440, 16)
+    assert sizer.best_pieces(0) == 1
+    assert sizer.best_pieces(1.0) == sizer.max_pieces
+    ber = 1e-4
+    pieces = sizer.best_pieces(ber)
+    longest = -math.log(1 - TARGET_LOSS) / (8 * ber)
+    assert sizer.length(pieces) <= longest + 1 < sizer.length(pieces - 1)
+
+
+def test_counts_are_halved_every_horizon():
+    sizer = SegmentSizer(1440, 16)
+    for _ in range(HORIZON):
+        sizer.record(sizer.length(1), False)
+    assert sizer.outcomes[1] == [HORIZON / 2, 0]
+
+
+def test_probe_sizes_are_decreasing():
+    sizes = probe_sizes(9000, ("127.0.0.1", 9))
+    assert sizes == sorted(sizes, reverse=True)
+    assert sizes[0] <= 9000
+    assert set(sizes[1:]) <= set(PROBE_SIZES)
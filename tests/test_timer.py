@@ -0,0 +1,66 @@
+import pytest
+
+from Timer import RTTEstimator, Timer
+
+
+def test_first_sample_sets_srtt_and_rttvar():
+    rtt = RTTEstimator(initial_rto=1.0, min_rto=0.01, max_rto=10.0)
+    rtt.add_sample(0.1)
+    assert rtt.srtt == pytest.approx(0.1)
+    assert rtt.rttvar == pytest.approx(0.05)
+    assert rtt.rto == pytest.approx(0.1 + 4 * 0.05)
+
+
+def test_karn_skips_retransmitted_samples():
+    rtt = RTTEstimator(initial_rto=1.0, min_rto=0.01, max_rto=10.0)
+    rtt.add_sample(0.1)
+    before = rtt.stats()
+    rtt.add_sample(5.0, retransmitted=True)
+    after = rtt.stats()
+    assert after["karn_skipped"] == 1
+    assert after["samples"] == before["samples"] == 1
+    assert (after["srtt"], after["rttvar"], after["rto"]) == (before["srtt"], before["rttvar"], before["rto"])
+
+
+def test_backoff_doubles_up_to_max_rto():
+    rtt = RTTEstimator(initial_rto=1.0, min_rto=0.01, max_rto=5.0)
+    rtt.backoff()
+    assert rtt.rto == 2.0
+    rtt.backoff()
+    rtt.backoff()
+    assert rtt.rto == 5.0
+    assert rtt.backoffs == 3
+
+
+def test_karn_skip_keeps_the_backoff():
+    rtt = RTTEstimator(initial_rto=0.5, min_rto=0.01, max_rto=10.0)
+    rtt.add_sample(0.1)
+    base = rtt.rto
+    rtt.backoff()
+    rtt.backoff()
+    # the ACK of a retransmitted segment neither measures nor clears the backoff
+    rtt.add_sample(0.1, retransmitted=True)
+    assert rtt.rto == pytest.approx(4 * base)
+    # a segment sent once does
+    rtt.add_sample(0.1)
+    assert rtt.rto < 4 * base
+
+
+def test_rto_stays_within_bounds():
+    rtt = RTTEstimator(initial_rto=1.0, min_rto=0.2, max_rto=3.0)
+    rtt.add_sample(0.001)
+    assert rtt.rto == 0.2
+    rtt = RTTEstimator(initial_rto=1.0, min_rto=0.2, max_rto=3.0)
+    rtt.add_sample(10.0)
+    assert rtt.rto == 3.0
+
+
+def test_timer_follows_the_estimator():
+    rtt = RTTEstimator(initial_rto=0.5)
+    timer = Timer(rtt, scale=4)
+    assert timer.time_left() is None
+    assert not timer.is_timeout()
+    timer.reset_timer()
+    assert 0 < timer.time_left() <= 2.0
+    rtt.backoff()
+    assert timer.timeout() == pytest.approx(4.0)